@@ -2,6 +2,7 @@ import logging
 from flask import Flask
 
 from .config import Config
+from . import db, timing
 from .mock_db import initialize_mock_db
 from .routes.auth import auth_bp
 from .routes.main import main_bp
@@ -18,6 +19,12 @@ def create_app():
     # initialize our mock "database" (encrypts personal data)
     #initialize_mock_db()
 
+    # one pooled DB connection per request, released on teardown
+    db.init_app(app)
+
+    # REQUEST_TIMING: Server-Timing header with the request's db/crypto/password time
+    timing.init_app(app)
+
     # register blueprints
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
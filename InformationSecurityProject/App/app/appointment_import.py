@@ -0,0 +1,479 @@
+# app/appointment_import.py
+# bulk appointment import: streams a CSV, validates each row, encrypts `details` in batches and inserts
+# with executemany in chunked transactions, collecting a per-row error report
+# usage (from App/):  python -m app.appointment_import schedule.csv [--medic-id N] [--report errors.csv]
+#
+# CSV columns: patient_id, medic_id (not needed when a medic imports their own schedule), date, status, details
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from mysql.connector import Error, errorcode
+
+from .appointment_summary import bump, month_of
+from .audit import audit
+from .config import Config
+from .crypto_utils import CRYPTO_FAILED, encrypt_many
+from .db import get_db, get_db_connection
+
+STATUSES = ("scheduled", "completed", "cancelled")
+
+_INSERT = """
+    INSERT INTO appointments (patient_id, medic_id, date, status, details)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+class ImportResult:
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.read = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []  # (line, message), the first max_errors of them
+        self.started = time.monotonic()
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    @property
+    def seconds(self):
+        return time.monotonic() - self.started
+
+    def to_dict(self):
+        return {
+            "read": self.read,
+            "imported": self.imported,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 2),
+            "errors": [{"line": line, "error": message} for line, message in self.errors],
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+class _UserRoles:
+    # role of each referenced user id, looked up per chunk and remembered for the rest of the import
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._roles = {}
+
+    def load(self, ids):
+        missing = [i for i in set(ids) if i not in self._roles]
+        if not missing:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT id, role FROM users WHERE id IN ({', '.join(['%s'] * len(missing))})",
+                missing,
+            )
+            found = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+        for i in missing:
+            self._roles[i] = found.get(i)
+
+    def role(self, user_id):
+        return self._roles.get(user_id)
+
+
+def _parse_id(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_row(row, medic_id=None):
+    # (patient_id, medic_id, date, status, details) or raises ValueError with a readable reason
+    patient = _parse_id(row.get("patient_id"))
+    if patient is None:
+        raise ValueError("patient_id is missing or not a number")
+    medic = medic_id if medic_id is not None else _parse_id(row.get("medic_id"))
+    if medic is None:
+        raise ValueError("medic_id is missing or not a number")
+
+    raw_date = (row.get("date") or "").strip()
+    try:
+        date = datetime.fromisoformat(raw_date)
+    except ValueError:
+        raise ValueError(f"date {raw_date!r} is not an ISO date/time (YYYY-MM-DD[ HH:MM])")
+
+    status = (row.get("status") or "scheduled").strip().lower()
+    if status not in STATUSES:
+        raise ValueError(f"status {status!r} is not one of {', '.join(STATUSES)}")
+
+    return patient, medic, date.strftime("%Y-%m-%d %H:%M:%S"), status, row.get("details") or ""
+
+
+def _insert_chunk(conn, rows):
+    # rows: [(line, values)] -- inserts them in one transaction; when the batch is rejected
+    # the chunk is retried row by row so one bad row only fails itself. returns [(line, error)]
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.executemany(_INSERT, [values for _, values in rows])
+            _bump_summary(cursor, [values for _, values in rows])
+            conn.commit()
+            return []
+        except Error:
+            conn.rollback()
+
+        failures = []
+        for line, values in rows:
+            try:
+                cursor.execute(_INSERT, values)
+                _bump_summary(cursor, [values])
+                conn.commit()
+            except Error as e:
+                conn.rollback()
+                failures.append((line, f"database rejected the row: {e}"))
+        return failures
+    finally:
+        cursor.close()
+
+
+def _bump_summary(cursor, values):
+    # one summary upsert per (month, status, medic) cell of the chunk
+    cells = {}
+    for patient, medic, date, status, _ in values:
+        key = (month_of(date), status, medic)
+        cells[key] = cells.get(key, 0) + 1
+    for (month, status, medic), n in cells.items():
+        bump(cursor, month, status, medic, n)
+
+
+def _flush(conn, roles, pending, result):
+    roles.load([v[0] for _, v in pending] + [v[1] for _, v in pending])
+
+    valid = []
+    for line, values in pending:
+        if roles.role(values[0]) != "patient":
+            result.error(line, f"user {values[0]} is not a patient")
+        elif roles.role(values[1]) != "medic":
+            result.error(line, f"user {values[1]} is not a medic")
+        else:
+            valid.append((line, values))
+
+    encrypted = encrypt_many([values[4] for _, values in valid])
+    rows = []
+    for (line, values), details in zip(valid, encrypted):
+        if details is CRYPTO_FAILED:
+            result.error(line, "details could not be encrypted")
+        else:
+            rows.append((line, values[:4] + (details,)))
+
+    failures = _insert_chunk(conn, rows) if rows else []
+    for line, message in failures:
+        result.error(line, message)
+    result.imported += len(rows) - len(failures)
+
+
+def import_appointments(lines, medic_id=None, chunk_rows=None, max_errors=None, progress=None):
+    # `lines`: any iterable of CSV text lines (an open file, a decoded upload stream);
+    # medic_id forces every row onto that medic (a medic importing their own schedule)
+    chunk_rows = chunk_rows or Config.IMPORT_CHUNK_ROWS
+    result = ImportResult(max_errors or Config.IMPORT_MAX_ERRORS)
+
+    reader = csv.DictReader(lines)
+    required = {"patient_id", "date"} | (set() if medic_id is not None else {"medic_id"})
+    missing = required - set(reader.fieldnames or ())
+    if missing:
+        result.error(1, f"missing column(s): {', '.join(sorted(missing))}")
+        return result
+
+    conn = get_db_connection()
+    try:
+        roles = _UserRoles(conn)
+        pending = []
+        for row in reader:
+            result.read += 1
+            # header is line 1; quoted fields with newlines would shift this, which is fine for a report
+            line = reader.line_num
+            try:
+                pending.append((line, parse_row(row, medic_id)))
+            except ValueError as e:
+                result.error(line, str(e))
+            if len(pending) >= chunk_rows:
+                _flush(conn, roles, pending, result)
+                pending = []
+                if progress:
+                    progress(result)
+        if pending:
+            _flush(conn, roles, pending, result)
+    finally:
+        conn.close()
+
+    # validation errors are reported as rows are read, database/role errors per chunk
+    result.errors.sort()
+    audit(
+        f"Bulk import: {result.imported} appointments imported, {result.failed} rows rejected",
+        action="appointment.import",
+        target=f"medic:{medic_id}" if medic_id is not None else "appointments",
+    )
+    return result
+
+
+def import_appointments_file(path, **kwargs):
+    # import_appointments() on a CSV file (keyword arguments as there)
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        return import_appointments(f, **kwargs)
+
+
+def write_report(result, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["line", "error"])
+        writer.writerows(result.errors)
+
+
+# --- background jobs -------------------------------------------------------------
+# uploads from the web UI are spooled to a temp file and imported on a thread (like backup.BackupJob), so a
+# large file does not hold a request -- and a worker -- for the whole import; the job state is kept in the
+# database, not in the worker that runs it, so polling works behind any number of workers
+
+def check_upload_size(size, max_bytes=None):
+    # ValueError when an upload of `size` bytes (None = unknown) exceeds the import limit
+    max_bytes = Config.IMPORT_MAX_BYTES if max_bytes is None else max_bytes
+    if max_bytes and size and size > max_bytes:
+        raise ValueError(f"the file is larger than the {max_bytes // (1024 * 1024)} MB import limit")
+
+
+def spool_upload(stream, max_bytes=None):
+    # copies an upload to a private temp file and returns its path; ValueError once it exceeds the limit
+    fd, path = tempfile.mkstemp(prefix="import-", suffix=".upload")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                check_upload_size(size, max_bytes)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+# a queued/running job that has not written progress for this long is taken to be dead (its worker was
+# restarted) and stops blocking new imports; finished jobs stay pollable for _KEEP_SECONDS
+_STALE_SECONDS = 600
+_KEEP_SECONDS = 7 * 24 * 3600
+# progress is written at most this often while a job runs
+_SAVE_INTERVAL = 1.0
+
+# shared with migrate.hot_queries(), which EXPLAINs them
+_JOB_COLUMNS = "id, owner, kind, state, report, error, created, started, finished"
+JOB_BY_ID_SQL = f"SELECT {_JOB_COLUMNS} FROM import_jobs WHERE id = %s"
+LATEST_JOB_SQL = (
+    f"SELECT {_JOB_COLUMNS} FROM import_jobs WHERE owner = %s AND kind = %s ORDER BY created DESC LIMIT 1"
+)
+_ACTIVE_JOB_SQL = f"SELECT {_JOB_COLUMNS} FROM import_jobs WHERE active = %s"
+
+
+class ImportJob:
+    # one import running on a background thread of the worker that received the upload (the spooled file is
+    # local to it); `target(path, progress=...)` returns the ImportResult, the file is removed when it
+    # finishes. the state is written through to the import_jobs table (migration v006), so whichever
+    # worker answers the progress poll sees it
+
+    def __init__(self, owner, kind, target=None, path=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.kind = kind
+        self.state = "queued"
+        self.error = None
+        self.report = None  # ImportResult.to_dict() as of the last progress write
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._target = target
+        self._path = path
+        self._saved = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"import-{self.id}", daemon=True)
+
+    @classmethod
+    def _from_row(cls, row):
+        job = cls(row["owner"], row["kind"])
+        job.id = row["id"]
+        job.state = row["state"]
+        job.error = row["error"]
+        job.report = json.loads(row["report"]) if row["report"] else None
+        job.created, job.started, job.finished = row["created"], row["started"], row["finished"]
+        return job
+
+    def _active_key(self):
+        # unique while set: one queued/running import per owner and kind
+        return f"{self.owner}:{self.kind}"
+
+    def _insert(self, cursor):
+        cursor.execute(
+            "INSERT INTO import_jobs (id, owner, kind, state, active, created, heartbeat) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (self.id, self.owner, self.kind, self.state, self._active_key(), self.created, self.created),
+        )
+
+    def _save(self):
+        self._saved = time.time()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE import_jobs SET state = %s, active = %s, report = %s, error = %s, "
+                "started = %s, finished = %s, heartbeat = %s WHERE id = %s",
+                (self.state, self._active_key() if self.finished is None else None,
+                 json.dumps(self.report) if self.report is not None else None, self.error,
+                 self.started, self.finished, self._saved, self.id),
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _progress(self, result):
+        self.report = result.to_dict()
+        if time.time() - self._saved >= _SAVE_INTERVAL:
+            try:
+                self._save()
+            except Exception as e:
+                # a missed progress write is not worth failing the import for
+                logging.warning(f"Import {self.id}: could not record progress: {e}")
+
+    def _run(self):
+        self.state = "running"
+        self.started = time.time()
+        try:
+            self._save()
+            result = self._target(self._path, progress=self._progress)
+            self.report = result.to_dict()
+            self.state = "done"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logging.error(f"Import {self.id} failed: {e}")
+            audit(f"Import {self.id} failed: {e}", level="ERROR", action=f"{self.kind}.import_failed", target=self.id)
+        finally:
+            self.finished = time.time()
+            os.remove(self._path)
+            try:
+                self._save()
+            except Exception as e:
+                logging.error(f"Import {self.id}: could not record the final state: {e}")
+
+    def to_dict(self):
+        data = {"read": 0, "imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+        if self.report is not None:
+            data.update(self.report)
+        if self.finished is not None and self.started is not None:
+            data["seconds"] = round(self.finished - self.started, 2)
+        data.update(id=self.id, kind=self.kind, state=self.state, error=self.error,
+                    started=self.started, finished=self.finished)
+        return data
+
+
+def _is_duplicate(e):
+    return isinstance(e, sqlite3.IntegrityError) or getattr(e, "errno", None) == errorcode.ER_DUP_ENTRY
+
+
+def start_import_job(owner, kind, target, path):
+    # starts an import unless `owner` already runs one of this kind (in any worker); returns
+    # (job, started_now) -- when it did not start, the spooled file is removed here
+    job = ImportJob(owner, kind, target, path)
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        now = time.time()
+        cursor.execute("DELETE FROM import_jobs WHERE finished < %s", (now - _KEEP_SECONDS,))
+        # a worker that died mid-import never cleared its job -- stop it from blocking the owner forever
+        cursor.execute(
+            "UPDATE import_jobs SET state = 'failed', error = %s, active = NULL, finished = %s "
+            "WHERE active = %s AND heartbeat < %s",
+            ("the worker running the import stopped", now, job._active_key(), now - _STALE_SECONDS),
+        )
+        conn.commit()
+        while True:
+            try:
+                job._insert(cursor)
+                conn.commit()
+                break
+            except (Error, sqlite3.IntegrityError) as e:
+                conn.rollback()
+                if not _is_duplicate(e):
+                    raise
+            cursor.execute(_ACTIVE_JOB_SQL, (job._active_key(),))
+            running = cursor.fetchone()
+            if running is not None:
+                os.remove(path)
+                return ImportJob._from_row(running), False
+            # it finished between the INSERT and the SELECT -- try again
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        cursor.close()
+
+    job._thread.start()
+    return job, True
+
+
+def get_import_job(job_id):
+    cursor = get_db().cursor(dictionary=True)
+    try:
+        cursor.execute(JOB_BY_ID_SQL, (job_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return ImportJob._from_row(row) if row else None
+
+
+def latest_import_job(owner, kind):
+    cursor = get_db().cursor(dictionary=True)
+    try:
+        cursor.execute(LATEST_JOB_SQL, (owner, kind))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return ImportJob._from_row(row) if row else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import appointments from a CSV file.")
+    parser.add_argument("path", help="CSV with patient_id, medic_id, date, status, details columns")
+    parser.add_argument("--medic-id", type=int, help="assign every row to this medic (medic_id column not needed)")
+    parser.add_argument("--chunk-rows", type=int, help="rows per transaction")
+    parser.add_argument("--report", help="write the rejected rows to this CSV")
+    args = parser.parse_args(argv)
+
+    def progress(result):
+        print(f"  {result.read} rows read, {result.imported} imported ({result.imported / max(result.seconds, 1e-6):.0f} rows/s)", flush=True)
+
+    result = import_appointments_file(args.path, medic_id=args.medic_id, chunk_rows=args.chunk_rows, progress=progress)
+
+    print(f"Imported {result.imported} of {result.read} rows in {result.seconds:.1f}s, {result.failed} rejected")
+    for line, message in result.errors[:20]:
+        print(f"  line {line}: {message}")
+    if args.report:
+        write_report(result, args.report)
+        print(f"Error report written to {args.report}")
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# app/appointment_summary.py
+# monthly appointment counts (month x status x medic) kept up to date by the routes that change appointments,
+# so the admin report reads a few rows per month instead of grouping the whole appointments table
+# usage (from App/):  python -m app.appointment_summary rebuild|reconcile [--dry-run]
+import argparse
+import sys
+import threading
+
+from mysql.connector import Error
+
+from .audit import audit
+from .config import Config
+from .db import get_db_connection
+
+_SCHEMA = {
+    "mysql": """
+        CREATE TABLE IF NOT EXISTS appointment_monthly_summary (
+            month CHAR(7) NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            medic_id INT NOT NULL,
+            count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, status, medic_id)
+        )
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS appointment_monthly_summary (
+            month CHAR(7) NOT NULL,
+            status VARCHAR(32) NOT NULL,
+            medic_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, status, medic_id)
+        )
+    """,
+}
+
+_ACTUAL_COUNTS = """
+    SELECT DATE_FORMAT(date, '%Y-%m') AS month, COALESCE(status, '') AS status, medic_id, COUNT(*) AS count
+    FROM appointments
+    GROUP BY DATE_FORMAT(date, '%Y-%m'), COALESCE(status, ''), medic_id
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _backend():
+    return "sqlite" if Config.DB_BACKEND == "sqlite" else "mysql"
+
+
+def for_update():
+    # row lock for read-modify-write of an appointment (the sqlite stand-in locks the whole file on write anyway)
+    return "" if Config.DB_BACKEND == "sqlite" else " FOR UPDATE"
+
+
+def month_of(date):
+    # "YYYY-MM" of a DATETIME value or of the ISO string the forms submit -- same as DATE_FORMAT(date, '%Y-%m')
+    return str(date)[:7]
+
+
+def ensure_summary_schema(conn):
+    # creates the summary table and fills it from the appointments table -- run by migration v005 and the
+    # maintenance commands, never from a request (the first fill reads every appointment)
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        cursor = conn.cursor()
+        try:
+            if _backend() == "sqlite":
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'appointment_monthly_summary'")
+            else:
+                cursor.execute("SHOW TABLES LIKE 'appointment_monthly_summary'")
+            exists = cursor.fetchone() is not None
+            cursor.execute(_SCHEMA[_backend()])
+            conn.commit()
+        finally:
+            cursor.close()
+        if not exists:
+            rebuild(conn)
+        _schema_ready = True
+
+
+def bump(cursor, month, status, medic_id, delta):
+    # adds `delta` to one summary cell -- call it in the same transaction as the appointment change
+    if _backend() == "sqlite":
+        query = """
+            INSERT INTO appointment_monthly_summary (month, status, medic_id, count) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (month, status, medic_id) DO UPDATE SET count = count + excluded.count
+        """
+    else:
+        query = """
+            INSERT INTO appointment_monthly_summary (month, status, medic_id, count) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+        """
+    cursor.execute(query, (month, status or "", medic_id, delta))
+
+
+def subtract_appointments(cursor, where, params):
+    # takes the appointments matching `where` out of the summary -- call it right before they are deleted
+    # (like backup.record_deletions, this also covers rows that go away through an FK cascade)
+    cursor.execute(
+        f"SELECT date, status, medic_id FROM appointments WHERE {where}",
+        tuple(params),
+    )
+    cells = {}
+    for date, status, medic_id in cursor.fetchall():
+        key = (month_of(date), status or "", medic_id)
+        cells[key] = cells.get(key, 0) + 1
+    for (month, status, medic_id), n in cells.items():
+        bump(cursor, month, status, medic_id, -n)
+
+
+def monthly_report(cursor):
+    # {month: count}, newest first -- reads O(months x statuses x medics) summary rows
+    cursor.execute(
+        """
+        SELECT month, SUM(count) AS count
+        FROM appointment_monthly_summary
+        GROUP BY month
+        HAVING SUM(count) > 0
+        ORDER BY month DESC
+        """
+    )
+    return {row[0]: int(row[1]) for row in cursor.fetchall()}
+
+
+# --- maintenance -----------------------------------------------------------------
+
+def rebuild(conn):
+    # recomputes the whole table from appointments in one transaction
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM appointment_monthly_summary")
+        cursor.execute(
+            "INSERT INTO appointment_monthly_summary (month, status, medic_id, count) " + _ACTUAL_COUNTS
+        )
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def reconcile(conn, fix=True):
+    # compares the summary with a fresh GROUP BY and corrects only the cells that drifted;
+    # returns [(month, status, medic_id, stored, actual), ...]
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_ACTUAL_COUNTS)
+        actual = {(r[0], r[1], r[2]): r[3] for r in cursor.fetchall()}
+        cursor.execute("SELECT month, status, medic_id, count FROM appointment_monthly_summary")
+        stored = {(r[0], r[1], r[2]): r[3] for r in cursor.fetchall()}
+
+        drift = []
+        for key in sorted(set(actual) | set(stored)):
+            have, want = stored.get(key, 0), actual.get(key, 0)
+            if have != want:
+                drift.append((*key, have, want))
+                if fix:
+                    bump(cursor, *key, want - have)
+        if fix:
+            cursor.execute("DELETE FROM appointment_monthly_summary WHERE count = 0")
+        conn.commit()
+        return drift
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the monthly appointment summary table.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="recompute the summary from the appointments table")
+    check = sub.add_parser("reconcile", help="report and repair cells that drifted from the appointments table")
+    check.add_argument("--dry-run", action="store_true", help="only report the drift")
+    args = parser.parse_args(argv)
+
+    conn = get_db_connection()
+    try:
+        ensure_summary_schema(conn)
+        if args.command == "rebuild":
+            rebuild(conn)
+            audit("Appointment summary rebuilt", action="summary.rebuild")
+            print("Summary rebuilt.")
+            return 0
+
+        drift = reconcile(conn, fix=not args.dry_run)
+        for month, status, medic_id, have, want in drift:
+            print(f"  {month} {status or '-'} medic {medic_id}: summary {have}, actual {want}")
+        if drift and not args.dry_run:
+            audit(f"Appointment summary reconciled: {len(drift)} cells corrected", action="summary.reconcile")
+        print(f"{len(drift)} cells drifted" + (" (not fixed)" if args.dry_run and drift else ""))
+        return 1 if drift and args.dry_run else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,581 @@
 # app/audit.py
+import atexit
+import gzip
+import hashlib
+import hmac
+import glob
+import json
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
 from datetime import datetime, timezone
 
-LOG_FILE = "audit.log" 
+from flask import has_request_context, request, session
 
+from .config import Config
 
-def audit(message: str, level: str = "INFO"):
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z")
-    line = f"{timestamp} [{level}] {message}"
+# base path of the log; with AUDIT_PER_PROCESS every process writes its own <name>.<pid><ext> next to it,
+# so rotation, the manifest and the hash chain each have a single owner
+LOG_FILE = Config.AUDIT_LOG_FILE
 
-    print(line, flush=True)
 
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+def log_path(pid=None):
+    # the active log file of this (or the given) process
+    if not Config.AUDIT_PER_PROCESS:
+        return LOG_FILE
+    root, ext = os.path.splitext(LOG_FILE)
+    return f"{root}.{pid or os.getpid()}{ext}"
+
+
+def active_logs(base=LOG_FILE):
+    # every active log belonging to `base`: the base file itself and the per-process files, oldest name first
+    root, ext = os.path.splitext(base)
+    per_process = re.compile(re.escape(root) + r"\.\d+" + re.escape(ext) + "$")
+    found = [p for p in glob.glob(f"{glob.escape(root)}.*{ext}") if per_process.match(p)]
+    if os.path.exists(base):
+        found.append(base)
+    return sorted(found)
+
+TEXT_TS_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _parse_line_ts(line):
+    # timestamp of an existing log line (json or text format), None if it cannot be read
+    try:
+        if line.startswith("{"):
+            ts = json.loads(line)["ts"]
+            return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+        return datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S UTC").replace(tzinfo=timezone.utc).timestamp()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def format_record(record, fmt, seq=None):
+    if fmt == "json":
+        data = {"ts": _iso(record["ts"])}
+        if seq is not None:
+            data["seq"] = seq
+        data.update(
+            level=record["level"],
+            actor=record["actor"],
+            action=record["action"],
+            target=record["target"],
+            ip=record["ip"],
+            msg=record["msg"],
+        )
+        return json.dumps(data, separators=(",", ":"), default=str)
+    timestamp = datetime.fromtimestamp(record["ts"], timezone.utc).strftime(TEXT_TS_FORMAT)
+    return f"{timestamp} [{record['level']}] {record['msg']}"
+
+
+# --- hash chain ----------------------------------------------------------------
+# a chained record is its JSON body with ',"h":"<sha256(previous h + body)>"' appended as the last key
+
+GENESIS_HASH = "0" * 64
+_SEAL_LEN = len(',"h":"') + 64 + len('"}')
+
+
+def chain_hash(prev_hash, body):
+    return hashlib.sha256(prev_hash.encode() + body.encode("utf-8")).hexdigest()
+
+
+def seal_line(body, h):
+    return body[:-1] + f',"h":"{h}"}}'
+
+
+def split_sealed(line):
+    # (body, h) of a chained line -- the body is recovered byte for byte, no re-serialization involved
+    return line[:-_SEAL_LEN] + "}", line[-66:-2]
+
+
+class AuditConfigError(RuntimeError):
+    # AUDIT_CHAIN without AUDIT_HMAC_KEY -- checkpoints MAC'd with a fallback key would prove nothing
+    pass
+
+
+def require_hmac_key(key):
+    if not key:
+        raise AuditConfigError(
+            "AUDIT_CHAIN=1 needs AUDIT_HMAC_KEY -- set it to a random secret that is not SECRET_KEY"
+        )
+    return key
+
+
+def checkpoint_mac(key, seq, h, ts):
+    return hmac.new(key.encode(), f"{seq}:{h}:{ts}".encode(), hashlib.sha256).hexdigest()
+
+
+def checkpoints_path(path=LOG_FILE):
+    return path + ".checkpoints"
+
+
+def _last_chained_record(path):
+    # (seq, h) of the newest chained record in a log file, None if it has none
+    last = None
+    if path.endswith(".gz"):
+        with open_segment(path) as f:
+            for line in f:
+                if line.startswith("{") and '"seq":' in line and '"type":"checkpoint"' not in line:
+                    last = line.rstrip("\n")
+    else:
+        with open(path, "rb") as f:
+            # the tail is enough -- records are far smaller than this
+            f.seek(max(0, os.path.getsize(path) - 65536))
+            for raw in f.read().decode("utf-8", errors="replace").splitlines():
+                if raw.startswith("{") and '"seq":' in raw and '"type":"checkpoint"' not in raw:
+                    last = raw
+    if last is None:
+        return None
+    return json.loads(last)["seq"], split_sealed(last)[1]
+
+
+# --- segment manifest ----------------------------------------------------------
+# rotated segments are listed with the time range they cover so readers can skip files
+
+def manifest_path(path=LOG_FILE):
+    return path + ".manifest.json"
+
+
+def load_manifest(path=LOG_FILE):
+    try:
+        with open(manifest_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)["segments"]
+    except FileNotFoundError:
+        return []
+
+
+def segments_for_range(start=None, end=None, path=LOG_FILE):
+    # files (oldest first) that may hold records between the ISO timestamps start and end -- the active log is always last
+    base_dir = os.path.dirname(os.path.abspath(path))
+    files = []
+    for seg in load_manifest(path):
+        if start is not None and seg["last_ts"] < start:
+            continue
+        if end is not None and seg["first_ts"] > end:
+            continue
+        files.append(os.path.join(base_dir, seg["file"]))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def open_segment(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class AuditLog:
+    # the active log file, its rotation into timestamped segments and their background compression
+    # (one process must own a given log file -- see log_path / AUDIT_PER_PROCESS)
+
+    def __init__(self, path, fmt="text", rotate_bytes=0, rotate_seconds=0, compress=False,
+                 chain=False, checkpoint_every=0, hmac_key=None):
+        self.path = path
+        self.fmt = fmt
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        # chaining needs the structured format, it is ignored for text logs
+        self.chain = chain and fmt == "json"
+        self.checkpoint_every = checkpoint_every
+        self.hmac_key = require_hmac_key(hmac_key) if self.chain else hmac_key
+        self._manifest_lock = threading.Lock()
+        self._compressors = []
+        self._open()
+        if self.chain:
+            self._seq, self._head = self._load_chain_head()
+
+        # segments left uncompressed by an earlier shutdown are picked up again
+        if self.compress:
+            base_dir = os.path.dirname(os.path.abspath(self.path))
+            for seg in load_manifest(self.path):
+                if not seg["compressed"]:
+                    self._compress_async(os.path.join(base_dir, seg["file"]))
+
+    def _open(self):
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._size = self._f.tell()
+        self._first_ts = None
+        self._last_ts = None
+        if self._size:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._first_ts = _parse_line_ts(f.readline())
+            self._last_ts = os.path.getmtime(self.path)
+            if self._first_ts is None:
+                self._first_ts = self._last_ts
+
+    def _load_chain_head(self):
+        # continue the chain where the previous run stopped: active log first, then the newest segment
+        base_dir = os.path.dirname(os.path.abspath(self.path))
+        candidates = [self.path] + [os.path.join(base_dir, seg["file"]) for seg in reversed(load_manifest(self.path))]
+        for candidate in candidates:
+            if os.path.exists(candidate) and os.path.getsize(candidate):
+                head = _last_chained_record(candidate)
+                if head is not None:
+                    return head
+        return 0, GENESIS_HASH
+
+    def _format(self, record):
+        if not self.chain:
+            return format_record(record, self.fmt)
+        self._seq += 1
+        body = format_record(record, "json", seq=self._seq)
+        self._head = chain_hash(self._head, body)
+        return seal_line(body, self._head)
+
+    def _checkpoint(self, ts):
+        # HMAC'd (seq, chain hash) pair -- written inline and to the checkpoint index the verifier seeks with
+        ts = _iso(ts)
+        line = json.dumps({
+            "ts": ts,
+            "type": "checkpoint",
+            "seq": self._seq,
+            "h": self._head,
+            "mac": checkpoint_mac(self.hmac_key, self._seq, self._head, ts),
+        }, separators=(",", ":"))
+        with open(checkpoints_path(self.path), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        return line + "\n"
+
+    def _update_manifest(self, change):
+        with self._manifest_lock:
+            segments = load_manifest(self.path)
+            change(segments)
+            tmp = manifest_path(self.path) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"segments": segments}, f, indent=2)
+            os.replace(tmp, manifest_path(self.path))
+
+    def _should_rotate(self, ts):
+        if not self._size:
+            return False
+        if self.rotate_bytes and self._size >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and ts - self._first_ts >= self.rotate_seconds
+
+    def rotate(self):
+        if not self._size:
+            return
+        self.fsync()
+        self._f.close()
+
+        stamp = datetime.fromtimestamp(self._first_ts, timezone.utc).strftime("%Y%m%d-%H%M%S")
+        name = f"{self.path}.{stamp}"
+        n = 1
+        while os.path.exists(name) or os.path.exists(name + ".gz"):
+            name = f"{self.path}.{stamp}.{n}"
+            n += 1
+        os.replace(self.path, name)
+
+        entry = {
+            "file": os.path.basename(name),
+            "first_ts": _iso(self._first_ts),
+            "last_ts": _iso(self._last_ts),
+            "bytes": self._size,
+            "compressed": False,
+        }
+        self._update_manifest(lambda segments: segments.append(entry))
+        self._open()
+        if self.compress:
+            self._compress_async(name)
+
+    def _compress(self, name):
+        tmp = name + ".gz.tmp"
+        try:
+            with open(name, "rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, name + ".gz")
+        except OSError as e:
+            print(f"audit segment compression failed for {name}: {e}", file=sys.stderr, flush=True)
+            return
+
+        basename = os.path.basename(name)
+        size = os.path.getsize(name + ".gz")
+
+        def mark_compressed(segments):
+            for seg in segments:
+                if seg["file"] == basename:
+                    seg.update(file=basename + ".gz", bytes=size, compressed=True)
+
+        self._update_manifest(mark_compressed)
+        os.remove(name)
+
+    def _compress_async(self, name):
+        self._compressors = [t for t in self._compressors if t.is_alive()]
+        t = threading.Thread(target=self._compress, args=(name,), name="audit-compress", daemon=True)
+        t.start()
+        self._compressors.append(t)
+
+    def write(self, records, echo=False):
+        lines = []
+        for record in records:
+            line = self._format(record) + "\n"
+            if self.chain and self.checkpoint_every and self._seq % self.checkpoint_every == 0:
+                # the checkpoint travels with its record, so both always land in the same segment
+                line += self._checkpoint(record["ts"])
+            lines.append(line)
+        if echo:
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        for record, line in zip(records, lines):
+            # checked per record so one large batch cannot overshoot the segment size by much
+            if self._should_rotate(record["ts"]):
+                self._f.flush()
+                self.rotate()
+            self._f.write(line)
+            self._size += len(line.encode("utf-8"))
+            if self._first_ts is None:
+                self._first_ts = record["ts"]
+            self._last_ts = record["ts"]
+        self._f.flush()
+
+    def fsync(self):
+        os.fsync(self._f.fileno())
+
+    def close(self, timeout=5.0):
+        try:
+            self.fsync()
+        finally:
+            self._f.close()
+        for t in self._compressors:
+            t.join(timeout)
+
+
+# checked at import, like the encryption key ring: a misconfigured chain stops the app from starting instead of
+# failing on the first audited request
+if Config.AUDIT_CHAIN and Config.AUDIT_FORMAT == "json":
+    require_hmac_key(Config.AUDIT_HMAC_KEY)
+
+
+def _new_log():
+    return AuditLog(
+        log_path(),
+        fmt=Config.AUDIT_FORMAT,
+        rotate_bytes=Config.AUDIT_ROTATE_BYTES,
+        rotate_seconds=Config.AUDIT_ROTATE_SECONDS,
+        compress=Config.AUDIT_COMPRESS,
+        chain=Config.AUDIT_CHAIN,
+        checkpoint_every=Config.AUDIT_CHECKPOINT_EVERY,
+        hmac_key=Config.AUDIT_HMAC_KEY,
+    )
+
+
+class AuditWriter:
+    # requests only enqueue the record -- a single background thread batches
+    # them into a long-lived file handle, so request latency doesn't depend on the disk
+
+    _STOP = object()
+
+    def __init__(self, log, queue_size, batch_size, overflow, block_timeout, fsync, fsync_interval, echo):
+        self.log = log
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.echo = echo
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "batches": 0,
+            "fsyncs": 0,
+            "write_errors": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def submit(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow != "block":
+                self._count("dropped")
+                return False
+            # backpressure: the caller waits a bounded time for the writer to catch up
+            self._count("blocked")
+            try:
+                self._queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        self._count("enqueued")
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _maybe_fsync(self):
+        if self.fsync == "never":
+            return
+        now = time.monotonic()
+        if self.fsync == "always" or now - self._last_fsync >= self.fsync_interval:
+            self.log.fsync()
+            self._last_fsync = now
+            self._count("fsyncs")
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = self._STOP in batch
+                records = [r for r in batch if r is not self._STOP]
+                try:
+                    if records:
+                        self.log.write(records, echo=self.echo)
+                        self._maybe_fsync()
+                        self._count("written", len(records))
+                        self._count("batches")
+                except Exception as e:
+                    self._count("write_errors")
+                    print(f"audit writer failed: {e}", file=sys.stderr, flush=True)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                if stop:
+                    break
+        finally:
+            self.log.close()
+
+    def flush(self):
+        # block until everything queued so far has been written (tests, shutdown)
+        self._queue.join()
+
+    def close(self, timeout=5.0):
+        if not self._thread.is_alive():
+            return
+        # runs at exit -- a writer stuck on a hung disk with a full queue must not hang the process with it
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # give up on what is still queued (counted as dropped) to make room for the stop marker
+            dropped = 0
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+                dropped += 1
+            self._count("dropped", dropped)
+            print(f"audit writer: {dropped} queued records dropped at shutdown", file=sys.stderr, flush=True)
+            try:
+                self._queue.put_nowait(self._STOP)
+            except queue.Full:
+                pass
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["queued"] = self._queue.qsize()
+        return data
+
+
+_writer = None
+_sync_log = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer, _writer_pid
+    # (re)start lazily -- also after a fork, since the parent's writer thread does not survive it
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = AuditWriter(
+                    _new_log(),
+                    queue_size=Config.AUDIT_QUEUE_SIZE,
+                    batch_size=Config.AUDIT_BATCH_SIZE,
+                    overflow=Config.AUDIT_OVERFLOW,
+                    block_timeout=Config.AUDIT_BLOCK_TIMEOUT,
+                    fsync=Config.AUDIT_FSYNC,
+                    fsync_interval=Config.AUDIT_FSYNC_INTERVAL,
+                    echo=Config.AUDIT_ECHO,
+                )
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def _write_sync(record):
+    global _sync_log
+    with _writer_lock:
+        if _sync_log is None:
+            _sync_log = _new_log()
+        _sync_log.write([record], echo=Config.AUDIT_ECHO)
+
+
+def flush_audit():
+    if _writer is not None:
+        _writer.flush()
+
+
+def shutdown_audit():
+    # drains the queue and closes the log file -- registered with atexit
+    global _writer, _sync_log
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.close()
+    _writer = None
+    with _writer_lock:
+        if _sync_log is not None:
+            _sync_log.close()
+        _sync_log = None
+
+
+atexit.register(shutdown_audit)
+
+
+def audit_stats():
+    if _writer is None:
+        return {"async": Config.AUDIT_ASYNC}
+    return dict(_writer.stats(), **{"async": Config.AUDIT_ASYNC})
+
+
+def audit(message: str, level: str = "INFO", actor=None, action=None, target=None, ip=None):
+    record = {
+        "ts": time.time(),
+        "level": level,
+        "msg": message,
+        "actor": actor,
+        "action": action,
+        "target": target,
+        "ip": ip,
+    }
+    # inside a request the logged-in user and client address are filled in automatically
+    if has_request_context():
+        if actor is None:
+            record["actor"] = session.get("username")
+        if ip is None:
+            record["ip"] = request.remote_addr
+
+    if Config.AUDIT_ASYNC:
+        _get_writer().submit(record)
+        return
+
+    _write_sync(record)
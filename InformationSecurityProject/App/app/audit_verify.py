@@ -0,0 +1,121 @@
+# app/audit_verify.py
+# streaming verifier for the chained audit log (AUDIT_FORMAT=json, AUDIT_CHAIN=1)
+# usage (from App/):  python -m app.audit_verify [--log audit.1234.log] [--since ISO-TS] [--until ISO-TS]
+# without --log every active log of AUDIT_LOG_FILE is verified (one chain per process)
+import argparse
+import hmac
+import json
+import sys
+
+from .audit import (
+    LOG_FILE,
+    GENESIS_HASH,
+    active_logs,
+    chain_hash,
+    checkpoint_mac,
+    checkpoints_path,
+    open_segment,
+    require_hmac_key,
+    segments_for_range,
+    split_sealed,
+)
+from .config import Config
+
+
+class VerificationError(Exception):
+    pass
+
+
+def _check_mac(key, cp):
+    expected = checkpoint_mac(key, cp["seq"], cp["h"], cp["ts"])
+    return hmac.compare_digest(cp["mac"], expected)
+
+
+def find_anchor(path, key, since=None):
+    # newest authentic checkpoint at or before `since` (verification starts there instead of at record 1)
+    # plus the highest checkpointed seq, which tells us whether the tail of the log went missing
+    anchor = {"seq": 0, "h": GENESIS_HASH, "ts": None}
+    last_seq = 0
+    try:
+        f = open(checkpoints_path(path), "r", encoding="utf-8")
+    except FileNotFoundError:
+        return anchor, last_seq
+
+    with f:
+        for lineno, line in enumerate(f, 1):
+            cp = json.loads(line)
+            if not _check_mac(key, cp):
+                raise VerificationError(f"checkpoint index line {lineno} (seq={cp['seq']}) has a bad MAC")
+            last_seq = cp["seq"]
+            if since is not None and cp["ts"] <= since:
+                anchor = cp
+    return anchor, last_seq
+
+
+def verify(path=LOG_FILE, key=None, since=None, until=None):
+    # checks the chain from the nearest checkpoint up to `until` -- memory use does not depend on log size
+    key = require_hmac_key(key or Config.AUDIT_HMAC_KEY)
+    anchor, last_checkpoint = find_anchor(path, key, since)
+    seq, head = anchor["seq"], anchor["h"]
+    checked = 0
+
+    for file in segments_for_range(anchor["ts"], until, path):
+        with open_segment(file) as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.rstrip("\n")
+                # older plain-text lines and unchained json lines carry no integrity data
+                if not line.startswith("{") or '"seq":' not in line:
+                    continue
+                rec = json.loads(line)
+                where = f"{file}:{lineno}"
+
+                if rec.get("type") == "checkpoint":
+                    if not _check_mac(key, rec):
+                        raise VerificationError(f"{where}: checkpoint seq={rec['seq']} has a bad MAC")
+                    if rec["seq"] == seq and rec["h"] != head:
+                        raise VerificationError(f"{where}: chain does not match checkpoint seq={rec['seq']}")
+                    continue
+
+                if rec["seq"] <= anchor["seq"]:
+                    continue
+                if until is not None and rec["ts"] > until:
+                    return {"from_seq": anchor["seq"], "to_seq": seq, "checked": checked}
+                if rec["seq"] != seq + 1:
+                    raise VerificationError(f"{where}: expected seq {seq + 1}, found {rec['seq']} (records missing or reordered)")
+
+                body, h = split_sealed(line)
+                if chain_hash(head, body) != h:
+                    raise VerificationError(f"{where}: hash mismatch at seq {rec['seq']} (record altered)")
+                seq, head = rec["seq"], h
+                checked += 1
+
+    if until is None and seq < last_checkpoint:
+        raise VerificationError(f"log ends at seq {seq} but a checkpoint exists for seq {last_checkpoint} (tail truncated)")
+    return {"from_seq": anchor["seq"], "to_seq": seq, "checked": checked}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the tamper-evident audit log chain.")
+    parser.add_argument("--log", action="append", help="active audit log (segments are found via its manifest); repeatable")
+    parser.add_argument("--since", help="start of the range to verify (ISO timestamp, UTC)")
+    parser.add_argument("--until", help="end of the range to verify (ISO timestamp, UTC)")
+    args = parser.parse_args(argv)
+
+    logs = args.log or active_logs()
+    if not logs:
+        print(f"No audit logs found for {LOG_FILE}")
+        return 1
+    failed = 0
+    for path in logs:
+        try:
+            result = verify(path, since=args.since, until=args.until)
+        except VerificationError as e:
+            print(f"{path}: FAILED: {e}")
+            failed += 1
+            continue
+        print(f"{path}: OK: verified {result['checked']} records (seq {result['from_seq'] + 1}..{result['to_seq']})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
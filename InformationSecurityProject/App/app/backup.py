@@ -0,0 +1,460 @@
+# app/backup.py
+# streaming backups: rows are read in chunks from unbuffered cursors and written as NDJSON
+# through a compressor into a temp file that is renamed into place once complete
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from mysql.connector import Error, errorcode
+
+try:
+    import zstandard
+except ImportError:  # optional -- gzip is always available
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows -- there only the in-process guard in start_backup_job applies
+    fcntl = None
+
+from .audit import audit
+from .config import Config
+from .db import get_db_connection
+
+BACKUP_TABLES = ("users", "appointments")
+BACKUP_FORMAT = "ndjson-v1"
+
+_EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst", "none": ".ndjson"}
+
+
+class BackupBusy(Exception):
+    # raised when another process (worker, host sharing BACKUP_DIR, CLI) is already taking a backup
+    pass
+
+# incremental backups need a change timestamp on every table and a record of deleted rows
+_SCHEMA_COLUMNS = {
+    "mysql": {
+        table: [
+            f"ALTER TABLE {table} "
+            f"ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, "
+            f"ADD INDEX idx_{table}_updated_at (updated_at)"
+        ]
+        for table in BACKUP_TABLES
+    },
+    # sqlite cannot add a column with a non-constant default and has no ON UPDATE -- triggers keep it current
+    # (both write UTC "YYYY-MM-DD HH:MM:SS", the same text the stand-in's NOW() returns)
+    "sqlite": {
+        table: [
+            f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP NULL",
+            f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP",
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at_insert AFTER INSERT ON {table} "
+            f"WHEN NEW.updated_at IS NULL "
+            f"BEGIN UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at_update AFTER UPDATE ON {table} "
+            f"WHEN NEW.updated_at IS OLD.updated_at "
+            f"BEGIN UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END",
+        ]
+        for table in BACKUP_TABLES
+    },
+}
+_SCHEMA_TOMBSTONES = {
+    "mysql": """
+        CREATE TABLE IF NOT EXISTS deleted_rows (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            table_name VARCHAR(64) NOT NULL,
+            row_id BIGINT NOT NULL,
+            deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_deleted_rows_deleted_at (deleted_at)
+        )
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS deleted_rows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name VARCHAR(64) NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+
+def canonical_row(row):
+    # stable text form of a row, used for the per-table checksums (backup and restore must agree on it)
+    return json.dumps(row, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def open_backup_file(path, mode="rt", name=None):
+    # opens a backup for reading ("rt") or writing ("wt"), picking the codec from the extension of `name` (default: path)
+    name = name or path
+    if name.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8", compresslevel=6)
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed, cannot handle .zst backups")
+        raw = open(path, mode.replace("t", "b"))
+        if "w" in mode:
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _compression():
+    compression = Config.BACKUP_COMPRESSION
+    if compression == "zstd" and zstandard is None:
+        logging.warning("BACKUP_COMPRESSION=zstd but zstandard is not installed, using gzip")
+        return "gzip"
+    return compression
+
+
+def _backend():
+    return "sqlite" if Config.DB_BACKEND == "sqlite" else "mysql"
+
+
+def _has_updated_at(cursor, table):
+    if _backend() == "sqlite":
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == "updated_at" for row in cursor.fetchall())
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = 'updated_at'",
+        (table,),
+    )
+    return bool(cursor.fetchone()[0])
+
+
+def ensure_backup_schema(conn):
+    # adds updated_at columns and the deleted_rows table -- run by migration v003
+    backend = _backend()
+    cursor = conn.cursor()
+    try:
+        for table, statements in _SCHEMA_COLUMNS[backend].items():
+            if not _has_updated_at(cursor, table):
+                for ddl in statements:
+                    cursor.execute(ddl)
+        cursor.execute(_SCHEMA_TOMBSTONES[backend])
+        if backend == "sqlite":
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_deleted_rows_deleted_at ON deleted_rows (deleted_at)")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def record_deletions(cursor, table, where, params):
+    # remembers the rows a DELETE is about to remove so the next incremental backup can replay it --
+    # call it right before the DELETE, in the same transaction (cascaded FK deletes don't fire triggers,
+    # so callers also record the child rows they take with them)
+    try:
+        cursor.execute(
+            f"INSERT INTO deleted_rows (table_name, row_id) SELECT %s, id FROM {table} WHERE {where}",
+            (table,) + tuple(params),
+        )
+    except (Error, sqlite3.OperationalError) as e:
+        # no tombstone table means no backup was ever taken -- nothing to keep track of yet
+        missing = getattr(e, "errno", None) == errorcode.ER_NO_SUCH_TABLE or "no such table" in str(e)
+        if not missing:
+            raise
+
+
+# --- manifest ---------------------------------------------------------------------
+# every backup is listed with its parent, so any point can be restored as base snapshot + deltas
+
+def backup_manifest_path():
+    return os.path.join(Config.BACKUP_DIR, "manifest.json")
+
+
+def load_backup_manifest():
+    try:
+        with open(backup_manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)["backups"]
+    except FileNotFoundError:
+        return []
+
+
+@contextmanager
+def _backup_lock():
+    # exclusive lock file in BACKUP_DIR, held for the whole backup including the manifest update: the
+    # chain is picked from the manifest, so two backups at once would both hang off the same parent
+    # (and one manifest write would drop the other's entry) -- the OS releases it if the process dies
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(Config.BACKUP_DIR, ".backup.lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupBusy("another backup is already running") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _append_to_manifest(entry):
+    # only called under _backup_lock
+    entries = load_backup_manifest()
+    entries.append(entry)
+    tmp = f"{backup_manifest_path()}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"backups": entries}, f, indent=2)
+    os.replace(tmp, backup_manifest_path())
+
+
+def backup_chain(file=None):
+    # manifest entries needed to restore `file` (default: the newest backup), base snapshot first
+    entries = load_backup_manifest()
+    if not entries:
+        return []
+    by_file = {e["file"]: e for e in entries}
+    entry = by_file[file] if file else entries[-1]
+    chain = [entry]
+    while entry["parent"] is not None:
+        entry = by_file[entry["parent"]]
+        chain.append(entry)
+    chain.reverse()
+    return chain
+
+
+def _start_snapshot(conn):
+    # InnoDB: one consistent read view for all tables, without locking writers out
+    if hasattr(conn, "start_transaction"):
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+
+
+def _db_now(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT NOW()")
+        return str(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def _changed_since(hwm):
+    # lower bound for a delta, computed here rather than with INTERVAL arithmetic so the query is portable:
+    # the overlap catches transactions that were still open when the previous snapshot started
+    since = datetime.fromisoformat(str(hwm)) - timedelta(seconds=Config.BACKUP_HWM_OVERLAP)
+    return since.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _max_id(conn, table):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MAX(id) FROM {table}")
+        return cursor.fetchone()[0] or 0
+    finally:
+        cursor.close()
+
+
+def dump_table(conn, table, out, query=None, params=(), progress=None):
+    # streams one table into the open backup file, returns (row count, sha256 of the canonical rows)
+    digest = hashlib.sha256()
+    count = 0
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(query or f"SELECT * FROM {table} ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(Config.BACKUP_CHUNK_ROWS)
+            if not rows:
+                break
+            lines = []
+            for row in rows:
+                digest.update(canonical_row(row).encode("utf-8") + b"\n")
+                lines.append(json.dumps({"type": "row", "table": table, "data": row}, default=str))
+            out.write("\n".join(lines) + "\n")
+            count += len(rows)
+            if progress:
+                progress(table, count, rows[-1].get("id"))
+    finally:
+        cursor.close()
+    return count, digest.hexdigest()
+
+
+def write_backup(path, writer, header=None):
+    # runs writer(out) against a temp file next to `path` and atomically renames it on success
+    tmp = path + ".tmp"
+    try:
+        with open_backup_file(tmp, "wt", name=path) as out:
+            head = {"type": "header", "format": BACKUP_FORMAT, "created": datetime.utcnow().isoformat()}
+            head.update(header or {})
+            out.write(json.dumps(head) + "\n")
+            summary = writer(out)
+            out.write(json.dumps({"type": "footer", "tables": summary}) + "\n")
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return summary
+
+
+def dump_deletions(conn, out, since):
+    # tombstones recorded since the previous backup, returns {table: count}
+    counts = {table: 0 for table in BACKUP_TABLES}
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(
+            "SELECT table_name, row_id FROM deleted_rows "
+            "WHERE deleted_at >= %s ORDER BY id",
+            (_changed_since(since),),
+        )
+        while True:
+            rows = cursor.fetchmany(Config.BACKUP_CHUNK_ROWS)
+            if not rows:
+                break
+            out.write("".join(json.dumps({"type": "delete", "table": t, "id": row_id}) + "\n" for t, row_id in rows))
+            for t, _ in rows:
+                counts[t] = counts.get(t, 0) + 1
+    finally:
+        cursor.close()
+    return counts
+
+
+def perform_backup_sql(progress=None, incremental=False):
+    # full dump of every table, or (incremental=True) only what changed since the newest backup
+    # (data remains ENCRYPTED/HASHED) -- memory use is one chunk, not the whole DB
+    backup_dir = Config.BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+    with _backup_lock():
+        return _perform_backup(backup_dir, progress, incremental)
+
+
+def _perform_backup(backup_dir, progress, incremental):
+    parent = None
+    if incremental:
+        chain = backup_chain()
+        if chain and len(chain) <= Config.BACKUP_MAX_CHAIN:
+            parent = chain[-1]
+    # no base snapshot yet (or the chain got too long to restore quickly) -> take a full one
+    kind = "incremental" if parent else "full"
+
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    suffix = "_incr" if parent else ""
+    path = os.path.join(backup_dir, f"backup_{timestamp}{suffix}{_EXTENSIONS[_compression()]}")
+
+    conn = get_db_connection()
+    try:
+        _start_snapshot(conn)
+        # high-water mark: the next delta picks up every change made from here on
+        hwm = _db_now(conn)
+
+        def writer(out):
+            summary = {}
+            for table in BACKUP_TABLES:
+                total = _max_id(conn, table)
+                query, params = None, ()
+                if parent:
+                    # replaying a row twice (see _changed_since) is harmless, restore upserts
+                    query = f"SELECT * FROM {table} WHERE updated_at >= %s ORDER BY id"
+                    params = (_changed_since(parent["hwm"]),)
+                rows, checksum = dump_table(
+                    conn, table, out, query=query, params=params,
+                    progress=(lambda t, n, last_id: progress(t, n, last_id, total)) if progress else None,
+                )
+                summary[table] = {"rows": rows, "sha256": checksum}
+            if parent:
+                for table, deleted in dump_deletions(conn, out, parent["hwm"]).items():
+                    summary.setdefault(table, {})["deleted"] = deleted
+            return summary
+
+        header = {"kind": kind, "tables": list(BACKUP_TABLES), "hwm": hwm}
+        if parent:
+            header.update(parent=parent["file"], since=parent["hwm"])
+        summary = write_backup(path, writer, header=header)
+    finally:
+        conn.close()
+
+    _append_to_manifest({
+        "file": os.path.basename(path),
+        "kind": kind,
+        "parent": parent["file"] if parent else None,
+        "hwm": hwm,
+        "created": datetime.utcnow().isoformat(),
+        "tables": summary,
+    })
+    return path
+
+
+class BackupJob:
+    # one backup running on a background thread, with progress the admin page can poll
+
+    def __init__(self, target):
+        self.id = uuid.uuid4().hex[:12]
+        self.state = "queued"
+        self.path = None
+        self.error = None
+        self.table = None
+        self.rows = 0
+        self.percent = 0.0
+        self.started = None
+        self.finished = None
+        self._target = target
+        self._thread = threading.Thread(target=self._run, name=f"backup-{self.id}", daemon=True)
+
+    def _progress(self, table, rows, last_id, max_id):
+        self.table = table
+        self.rows = rows
+        if max_id:
+            self.percent = round(100.0 * (last_id or 0) / max_id, 1)
+
+    def _run(self):
+        self.state = "running"
+        self.started = time.time()
+        try:
+            self.path = self._target(progress=self._progress)
+            self.state = "done"
+            self.percent = 100.0
+            audit(f"Backup Created at {self.path}", action="backup.create", target=self.path)
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logging.error(f"Backup failed: {e}")
+            audit(f"Backup failed: {e}", level="ERROR", action="backup.failed")
+        finally:
+            self.finished = time.time()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "path": self.path,
+            "error": self.error,
+            "table": self.table,
+            "rows": self.rows,
+            "percent": self.percent,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+_current_job = None
+_job_lock = threading.Lock()
+
+
+def start_backup_job(target=perform_backup_sql):
+    # starts a backup unless one is already running in this process; returns (job, started_now) -- other
+    # processes are kept out by the lock file perform_backup_sql takes, their job fails with BackupBusy
+    global _current_job
+    with _job_lock:
+        if _current_job is not None and _current_job.state in ("queued", "running"):
+            return _current_job, False
+        _current_job = BackupJob(target)
+        _current_job._thread.start()
+        return _current_job, True
+
+
+def current_backup_job():
+    return _current_job
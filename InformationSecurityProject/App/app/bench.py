@@ -0,0 +1,283 @@
+# app/bench.py
+# microbenchmarks for the crypto and password paths: latency percentiles and throughput per operation, field
+# size, thread count and batch size, written as JSON; --compare flags regressions against a saved baseline
+# usage (from App/):  python -m app.bench [--quick] [--only decrypt] [--repeat 3] [--output bench.json]
+#                     python -m app.bench --compare baseline.json [--threshold 0.15]
+#
+# run it on the host class you deploy to, with the same config -- results from different machines do not compare
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from werkzeug.security import check_password_hash
+
+from . import crypto_utils
+from .config import Config
+from .passwords import _method_prefix, hash_password
+
+FIELD_SIZES = (16, 64, 256, 1024, 4096)
+THREADS = (1, 4)
+BATCH_SIZES = (10, 100, 1000)
+
+
+def _field(size):
+    # printable, like the stored fields (names, emails, notes)
+    return (os.urandom(size).hex())[:size]
+
+
+def _percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+class Case:
+    # one measured configuration; `make()` returns the callable one thread runs, `batch` is the number of
+    # values one call handles (the batch size for *_many, 1 otherwise)
+
+    def __init__(self, op, make, size=None, threads=1, batch=1, fmt=None):
+        self.op = op
+        self.make = make
+        self.size = size
+        self.threads = threads
+        self.batch = batch
+        self.fmt = fmt
+
+    @property
+    def name(self):
+        parts = [self.op + (f"[{self.fmt}]" if self.fmt else "")]
+        if self.size is not None:
+            parts.append(f"size={self.size}")
+        if self.batch > 1:
+            parts.append(f"batch={self.batch}")
+        parts.append(f"threads={self.threads}")
+        return " ".join(parts)
+
+
+def run_case(case, duration, min_calls, warmup):
+    # every thread calls its function back to back until `duration` has passed (and at least min_calls calls
+    # were made overall); per-call latencies are collected, throughput is values per wall-clock second
+    funcs = [case.make() for _ in range(case.threads)]
+    for func in funcs:
+        for _ in range(warmup):
+            func()
+
+    latencies = [[] for _ in funcs]
+    counter = {"calls": 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(len(funcs) + 1)
+    deadline = [0.0]
+
+    def worker(func, samples):
+        start_gate.wait()
+        while True:
+            t0 = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - t0)
+            with lock:
+                counter["calls"] += 1
+                if t0 >= deadline[0] and counter["calls"] >= min_calls:
+                    return
+
+    threads = [threading.Thread(target=worker, args=(f, s)) for f, s in zip(funcs, latencies)]
+    for t in threads:
+        t.start()
+    started = time.perf_counter()
+    deadline[0] = started + duration
+    start_gate.wait()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - started
+
+    samples = [s for per_thread in latencies for s in per_thread]
+    p50, p95, p99 = _percentiles(samples)
+    return {
+        "name": case.name,
+        "op": case.op,
+        "format": case.fmt,
+        "size": case.size,
+        "threads": case.threads,
+        "batch": case.batch,
+        "calls": len(samples),
+        "seconds": round(seconds, 3),
+        "values_per_second": round(len(samples) * case.batch / seconds, 1),
+        "p50_us": round(p50 * 1e6, 2),
+        "p95_us": round(p95 * 1e6, 2),
+        "p99_us": round(p99 * 1e6, 2),
+    }
+
+
+class _FieldCipher:
+    # switches Config.FIELD_CIPHER for the duration of a case (encrypt_value follows it)
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+
+    def __enter__(self):
+        self.previous, Config.FIELD_CIPHER = Config.FIELD_CIPHER, self.fmt
+
+    def __exit__(self, *exc):
+        Config.FIELD_CIPHER = self.previous
+
+
+def crypto_cases(sizes, threads, batches):
+    cases = []
+    for fmt in ("aead", "fernet"):
+        for size in sizes:
+            for n in threads:
+                def make_encrypt(value=_field(size)):
+                    return lambda: crypto_utils.encrypt_value(value)
+
+                def make_decrypt(size=size, fmt=fmt):
+                    with _FieldCipher(fmt):
+                        token = crypto_utils.encrypt_value(_field(size))
+                    return lambda: crypto_utils.decrypt_value(token)
+
+                cases.append(Case("encrypt_value", make_encrypt, size, n, fmt=fmt))
+                cases.append(Case("decrypt_value", make_decrypt, size, n, fmt=fmt))
+
+        # the batch API as the routes use it: one column of distinct values per call
+        for batch in batches:
+            def make_encrypt_many(batch=batch):
+                values = [_field(64) for _ in range(batch)]
+                return lambda: crypto_utils.encrypt_many(values)
+
+            def make_decrypt_many(batch=batch, fmt=fmt):
+                with _FieldCipher(fmt):
+                    tokens = crypto_utils.encrypt_many([_field(64) for _ in range(batch)])
+                return lambda: crypto_utils.decrypt_many(tokens)
+
+            cases.append(Case("encrypt_many", make_encrypt_many, 64, 1, batch, fmt=fmt))
+            cases.append(Case("decrypt_many", make_decrypt_many, 64, 1, batch, fmt=fmt))
+    return cases
+
+
+def password_cases(threads):
+    method = Config.PASSWORD_HASH_METHOD
+    cases = []
+    for n in threads:
+        def make_hash():
+            return lambda: hash_password("correct horse battery staple", method)
+
+        def make_check():
+            pwhash = hash_password("correct horse battery staple", method)
+            return lambda: check_password_hash(pwhash, "correct horse battery staple")
+
+        cases.append(Case("generate_password_hash", make_hash, threads=n, fmt=_method_prefix(method)))
+        cases.append(Case("check_password_hash", make_check, threads=n, fmt=_method_prefix(method)))
+    return cases
+
+
+def machine_info():
+    try:
+        from cryptography import __version__ as cryptography_version
+    except ImportError:
+        cryptography_version = None
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "cryptography": cryptography_version,
+        "field_cipher": Config.FIELD_CIPHER,
+        "key_ring_size": len(crypto_utils.keys),
+        "password_hash_method": _method_prefix(Config.PASSWORD_HASH_METHOD),
+        "crypto_threads": Config.CRYPTO_THREADS,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(only=None, quick=False, repeat=3, progress=print):
+    sizes, threads, batches = ((64, 1024), (1, 4), (100,)) if quick else (FIELD_SIZES, THREADS, BATCH_SIZES)
+    duration = 0.2 if quick else 1.0
+    cases = crypto_cases(sizes, threads, batches) + password_cases(threads)
+    if only:
+        cases = [c for c in cases if any(o in c.op for o in only)]
+
+    # the cache would turn repeated decrypts of one token into dict lookups; the raw cost is what is measured
+    cache_enabled, crypto_utils.decrypt_cache.enabled = crypto_utils.decrypt_cache.enabled, False
+    results = []
+    try:
+        for case in cases:
+            slow = "password" in case.op
+            with _FieldCipher(case.fmt if case.fmt in ("aead", "fernet") else Config.FIELD_CIPHER):
+                # best of `repeat` runs: scheduler/turbo noise only ever makes a run slower
+                runs = [
+                    run_case(case, duration, min_calls=5 if slow else 50, warmup=1 if slow else 20)
+                    for _ in range(1 if slow else repeat)
+                ]
+            result = max(runs, key=lambda r: r["values_per_second"])
+            results.append(result)
+            progress(
+                f"  {result['name']:<48} {result['values_per_second']:>12,.0f}/s  "
+                f"p50 {result['p50_us']:>10,.1f}us  p95 {result['p95_us']:>10,.1f}us  p99 {result['p99_us']:>10,.1f}us"
+            )
+    finally:
+        crypto_utils.decrypt_cache.enabled = cache_enabled
+    return {"machine": machine_info(), "results": results}
+
+
+def compare(current, baseline, threshold):
+    # [(name, metric, baseline, current, change)] for every result that got worse by more than `threshold`
+    # (p50 latency up, or throughput down); cases missing on either side are skipped
+    previous = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = previous.get(result["name"])
+        if base is None:
+            continue
+        if base["p50_us"] and result["p50_us"] > base["p50_us"] * (1 + threshold):
+            change = result["p50_us"] / base["p50_us"] - 1
+            regressions.append((result["name"], "p50_us", base["p50_us"], result["p50_us"], change))
+        if base["values_per_second"] and result["values_per_second"] < base["values_per_second"] * (1 - threshold):
+            change = result["values_per_second"] / base["values_per_second"] - 1
+            regressions.append(
+                (result["name"], "values_per_second", base["values_per_second"], result["values_per_second"], change)
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark field encryption and password hashing.")
+    parser.add_argument("--quick", action="store_true", help="fewer sizes and shorter runs (smoke test)")
+    parser.add_argument("--only", action="append", help="run operations whose name contains this (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best one is kept")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output run")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    current = run(only=args.only, quick=args.quick, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"Results written to {args.output}")
+
+    if baseline is None:
+        return 0
+
+    for field in ("host", "cpu_count", "cryptography", "password_hash_method"):
+        if baseline["machine"].get(field) != current["machine"].get(field):
+            print(f"Warning: baseline {field} is {baseline['machine'].get(field)!r}, now {current['machine'].get(field)!r}")
+    regressions = compare(current, baseline, args.threshold)
+    for name, metric, before, after, change in regressions:
+        print(f"  REGRESSION {name}: {metric} {before:,.1f} -> {after:,.1f} ({change:+.0%})")
+    print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} against {args.compare}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
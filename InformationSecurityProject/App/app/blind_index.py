@@ -0,0 +1,222 @@
+# app/blind_index.py
+# keyed HMAC "blind indexes" for the encrypted user fields: stored ciphertexts are randomized, so equality
+# lookups go through HMAC(key, normalized value) columns instead of decrypting every row
+# usage (from App/):  python -m app.blind_index backfill [--all] [--batch N]
+import argparse
+import hashlib
+import hmac
+import re
+import sys
+import threading
+import time
+import unicodedata
+
+from mysql.connector import Error
+
+from . import crypto_utils
+from .audit import audit
+from .config import Config
+from .db import get_db_connection
+
+# hex chars kept from the HMAC -- 128 bits, collisions are not a practical concern and the index stays small
+BIDX_LENGTH = 32
+
+_SCHEMA_EMAIL_COLUMN = {
+    "mysql": "ALTER TABLE users ADD COLUMN email_bidx CHAR(32) NULL, ADD INDEX idx_users_email_bidx (email_bidx)",
+    "sqlite": "ALTER TABLE users ADD COLUMN email_bidx CHAR(32) NULL",
+}
+_SCHEMA_TOKENS = {
+    "mysql": """
+        CREATE TABLE IF NOT EXISTS user_name_tokens (
+            token_bidx CHAR(32) NOT NULL,
+            user_id INT NOT NULL,
+            PRIMARY KEY (token_bidx, user_id),
+            INDEX idx_user_name_tokens_user (user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS user_name_tokens (
+            token_bidx CHAR(32) NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (token_bidx, user_id)
+        )
+    """,
+}
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _index_key():
+    # BLIND_INDEX_KEY if configured, otherwise derived from SECRET_KEY -- never from the encryption key ring:
+    # the primary key changes on every rotation, and search would miss every row rekey had not reached yet
+    if Config.BLIND_INDEX_KEY:
+        return Config.BLIND_INDEX_KEY.encode()
+    return hmac.new(Config.SECRET_KEY.encode(), b"blind-index-v2", hashlib.sha256).digest()
+
+
+# --- normalization ---------------------------------------------------------------
+
+def normalize_email(email):
+    return unicodedata.normalize("NFKC", email or "").strip().lower()
+
+
+def name_tokens(full_name):
+    # "Dr. Ana-Maria  POPESCU" -> ["dr", "ana", "maria", "popescu"]
+    text = unicodedata.normalize("NFKC", full_name or "").casefold()
+    return list(dict.fromkeys(t for t in re.split(r"[\W_]+", text) if t))
+
+
+def blind_index(value, domain):
+    # domain separates the email and name indexes, so equal strings do not produce equal digests across them
+    mac = hmac.new(_index_key(), domain.encode() + b"\0" + value.encode("utf-8"), hashlib.sha256)
+    return mac.hexdigest()[:BIDX_LENGTH]
+
+
+def email_bidx(email):
+    email = normalize_email(email)
+    return blind_index(email, "email") if email else None
+
+
+def name_bidxs(full_name):
+    return [blind_index(t, "name") for t in name_tokens(full_name)]
+
+
+# --- schema / maintenance --------------------------------------------------------
+
+def _has_email_column(cursor):
+    if Config.DB_BACKEND == "sqlite":
+        cursor.execute("PRAGMA table_info(users)")
+        return any(row[1] == "email_bidx" for row in cursor.fetchall())
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = 'users' AND column_name = 'email_bidx'"
+    )
+    return bool(cursor.fetchone()[0])
+
+
+def ensure_blind_index_schema(conn):
+    # adds users.email_bidx and the user_name_tokens table (once per process) -- run by migration v004 and the
+    # backfill/restore commands, never from a request
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        backend = "sqlite" if Config.DB_BACKEND == "sqlite" else "mysql"
+        cursor = conn.cursor()
+        try:
+            if not _has_email_column(cursor):
+                cursor.execute(_SCHEMA_EMAIL_COLUMN[backend])
+                if backend == "sqlite":
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email_bidx ON users (email_bidx)")
+            cursor.execute(_SCHEMA_TOKENS[backend])
+            if backend == "sqlite":
+                # index_user/unindex_user delete by user_id (MySQL gets this index with the table)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_name_tokens_user ON user_name_tokens (user_id)")
+            conn.commit()
+        finally:
+            cursor.close()
+        _schema_ready = True
+
+
+def index_user(cursor, user_id, full_name, email):
+    # (re)writes both indexes of one user -- call it in the same transaction as the INSERT/UPDATE of the row
+    cursor.execute("UPDATE users SET email_bidx = %s WHERE id = %s", (email_bidx(email), user_id))
+    cursor.execute("DELETE FROM user_name_tokens WHERE user_id = %s", (user_id,))
+    tokens = name_bidxs(full_name)
+    if tokens:
+        cursor.executemany(
+            "INSERT INTO user_name_tokens (token_bidx, user_id) VALUES (%s, %s)",
+            [(t, user_id) for t in tokens],
+        )
+
+
+def unindex_user(cursor, user_id):
+    # FK cascade covers MySQL, the sqlite stand-in does not enforce foreign keys
+    cursor.execute("DELETE FROM user_name_tokens WHERE user_id = %s", (user_id,))
+
+
+def search_user_ids(cursor, query, limit=50):
+    # ids of users whose email equals `query`, or whose name contains every token of `query`
+    if "@" in query:
+        cursor.execute(
+            "SELECT id FROM users WHERE email_bidx = %s ORDER BY id LIMIT %s",
+            (email_bidx(query), limit),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    tokens = name_bidxs(query)
+    if not tokens:
+        return []
+    placeholders = ", ".join(["%s"] * len(tokens))
+    cursor.execute(
+        f"SELECT user_id FROM user_name_tokens WHERE token_bidx IN ({placeholders}) "
+        f"GROUP BY user_id HAVING COUNT(*) = %s ORDER BY user_id LIMIT %s",
+        (*tokens, len(tokens), limit),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+# --- backfill --------------------------------------------------------------------
+
+def backfill(rebuild=False, batch=None, progress=print):
+    # walks users in id order (keyset batches, one transaction each) and fills in missing indexes;
+    # rebuild=True rewrites all of them, e.g. after BLIND_INDEX_KEY (or SECRET_KEY without it) changed
+    batch = batch or Config.BLIND_INDEX_BATCH_ROWS
+    conn = get_db_connection()
+    ensure_blind_index_schema(conn)
+    where = "" if rebuild else "AND email_bidx IS NULL"
+    last_id, done, failed = 0, 0, 0
+    started = time.monotonic()
+    try:
+        while True:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(
+                    f"SELECT id, full_name, email FROM users WHERE id > %s {where} ORDER BY id LIMIT %s",
+                    (last_id, batch),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                names = crypto_utils.decrypt_many([r["full_name"] for r in rows])
+                emails = crypto_utils.decrypt_many([r["email"] for r in rows])
+                for row, full_name, email in zip(rows, names, emails):
+                    if full_name is crypto_utils.CRYPTO_FAILED or email is crypto_utils.CRYPTO_FAILED:
+                        failed += 1
+                        continue
+                    index_user(cursor, row["id"], full_name, email)
+                    done += 1
+                conn.commit()
+            except Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            last_id = rows[-1]["id"]
+            progress(f"  indexed up to user id {last_id} ({done} done, {failed} undecryptable)")
+    finally:
+        conn.close()
+
+    audit(f"Blind index backfill finished: {done} users indexed, {failed} skipped", action="blind_index.backfill")
+    progress(f"Backfill finished in {time.monotonic() - started:.1f}s: {done} users indexed, {failed} skipped")
+    return done, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the blind indexes of the encrypted user fields.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill = sub.add_parser("backfill", help="compute missing email/name indexes for existing users")
+    fill.add_argument("--all", action="store_true", help="rewrite every index (after a key change)")
+    fill.add_argument("--batch", type=int, help="users per batch/transaction")
+    args = parser.parse_args(argv)
+
+    _, failed = backfill(rebuild=args.all, batch=args.batch)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,157 @@
+import json
 import os
 
+# app/config.json -- settings written by the maintenance commands (e.g. `python -m app.passwords calibrate`)
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+def _load_file_config():
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+_FILE_CONFIG = _load_file_config()
+
 
 class Config:
 
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 
     #ENCRYPTION_KEY = os.environ.get("ENCRYPTION_KEY")
+    # the key ring itself (ENCRYPTION_KEYS / ENCRYPTION_KEY) is read by crypto_utils.load_keys
+    # format of newly encrypted fields: "fernet" or "aead" (compact AES-GCM envelope); this version reads both,
+    # `python -m app.rekey run` converts stored values to this format. Older versions only read Fernet, so "aead"
+    # is opt-in once every worker runs this code (see the rollout steps in app/rekey.py)
+    FIELD_CIPHER = os.environ.get("FIELD_CIPHER", "fernet")
+
+    # key rotation job: rows per batch/transaction, throughput cap (0 = unthrottled) and where progress is kept
+    REKEY_BATCH_ROWS = int(os.environ.get("REKEY_BATCH_ROWS", "500"))
+    REKEY_ROWS_PER_SECOND = float(os.environ.get("REKEY_ROWS_PER_SECOND", "2000"))
+    REKEY_CHECKPOINT = os.environ.get("REKEY_CHECKPOINT", "rekey_checkpoint.json")
 
     BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+    # streaming backups: rows fetched per round trip, and the codec ("gzip", "zstd" if installed, or "none")
+    BACKUP_CHUNK_ROWS = int(os.environ.get("BACKUP_CHUNK_ROWS", "1000"))
+    BACKUP_COMPRESSION = os.environ.get("BACKUP_COMPRESSION", "gzip")
+    # incremental backups: seconds re-read before the previous high-water mark, and how many deltas may
+    # follow one base snapshot before the next backup is forced to be full again
+    BACKUP_HWM_OVERLAP = int(os.environ.get("BACKUP_HWM_OVERLAP", "60"))
+    BACKUP_MAX_CHAIN = int(os.environ.get("BACKUP_MAX_CHAIN", "24"))
+    # restore: rows per multi-row INSERT and rows per transaction
+    RESTORE_BATCH_ROWS = int(os.environ.get("RESTORE_BATCH_ROWS", "1000"))
+    RESTORE_COMMIT_ROWS = int(os.environ.get("RESTORE_COMMIT_ROWS", "20000"))
+
+    # admin dashboard: users shown (and decrypted) per page of the keyset-paginated user list
+    ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "50"))
+
+    # bulk appointment import: rows per transaction, and how many rejected rows are listed in the report
+    IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "1000"))
+    IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+    # uploads to the import forms are refused above this size (they are spooled to a temp file, then imported
+    # on a background thread)
+    IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+    # bulk user provisioning: password hashing processes and users per transaction
+    PROVISION_WORKERS = int(os.environ.get("PROVISION_WORKERS", str(os.cpu_count() or 1)))
+    PROVISION_CHUNK_ROWS = int(os.environ.get("PROVISION_CHUNK_ROWS", "500"))
+
+    # database connection -- "mysql" for the real server, "sqlite" for a local stand-in file
+    DB_BACKEND = os.environ.get("DB_BACKEND", "mysql")
+    DB_HOST = os.environ.get("DB_HOST", "localhost")
+    DB_PORT = int(os.environ.get("DB_PORT", "3306"))
+    DB_USER = os.environ.get("DB_USER", "root")
+    DB_PASSWORD = os.environ.get("DB_PASSWORD", "root")
+    DB_NAME = os.environ.get("DB_NAME", "healthcare_app")
+    DB_SQLITE_PATH = os.environ.get("DB_SQLITE_PATH", "healthcare_app.sqlite3")
+
+    # connection pool: DB_POOL_SIZE connections are kept warm, up to DB_POOL_MAX_OVERFLOW extra
+    # are opened under load (and closed again on release), checkout waits DB_POOL_TIMEOUT seconds
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get("DB_POOL_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+    # connections older than DB_POOL_RECYCLE seconds are replaced, idle ones are pinged after DB_POOL_PING_INTERVAL
+    DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", "3600"))
+    DB_POOL_PING_INTERVAL = float(os.environ.get("DB_POOL_PING_INTERVAL", "10"))
+
+    # login sessions: "memory" (single process), "sqlite" (workers on one host share SESSION_SQLITE_PATH)
+    # or "redis" (SESSION_REDIS_URL, any number of hosts); sessions live SESSION_TTL seconds
+    SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+    SESSION_TTL = int(os.environ.get("SESSION_TTL", str(8 * 3600)))
+    SESSION_SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH", "sessions.sqlite3")
+    SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+    SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "60"))
+
+    # authenticated-user cache: rows are reused across requests for up to IDENTITY_CACHE_TTL seconds
+    IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", "1024"))
+    IDENTITY_CACHE_TTL = float(os.environ.get("IDENTITY_CACHE_TTL", "60"))
+
+    # opt-in cache of decrypted field values, keyed by a digest of the ciphertext
+    DECRYPT_CACHE_ENABLED = os.environ.get("DECRYPT_CACHE_ENABLED", "0") == "1"
+    DECRYPT_CACHE_MAX_ENTRIES = int(os.environ.get("DECRYPT_CACHE_MAX_ENTRIES", "4096"))
+    DECRYPT_CACHE_MAX_BYTES = int(os.environ.get("DECRYPT_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+    DECRYPT_CACHE_TTL = float(os.environ.get("DECRYPT_CACHE_TTL", "300"))
+
+    # batch encrypt/decrypt: batches with at least CRYPTO_PARALLEL_THRESHOLD distinct values are split across CRYPTO_THREADS threads
+    CRYPTO_THREADS = int(os.environ.get("CRYPTO_THREADS", str(min(8, os.cpu_count() or 1))))
+    CRYPTO_PARALLEL_THRESHOLD = int(os.environ.get("CRYPTO_PARALLEL_THRESHOLD", "64"))
+
+    # blind indexes (HMAC of normalized email / name tokens) used to search the encrypted user fields;
+    # without BLIND_INDEX_KEY the key is derived from SECRET_KEY (changing either needs `blind_index backfill --all`)
+    BLIND_INDEX_KEY = os.environ.get("BLIND_INDEX_KEY")
+    BLIND_INDEX_BATCH_ROWS = int(os.environ.get("BLIND_INDEX_BATCH_ROWS", "500"))
+
+    # werkzeug hash method for new and rehashed passwords, e.g. "scrypt:32768:8:1" -- set by the calibrate command,
+    # which picks the strongest parameters that verify within PASSWORD_TARGET_MS and PASSWORD_MAX_MEMORY_MB
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") or _FILE_CONFIG.get("PASSWORD_HASH_METHOD", "scrypt")
+    PASSWORD_TARGET_MS = float(os.environ.get("PASSWORD_TARGET_MS", "250"))
+    PASSWORD_MAX_MEMORY_MB = int(os.environ.get("PASSWORD_MAX_MEMORY_MB", "64"))
+
+    # login password checks run in PASSWORD_WORKERS processes (0 = inline); at most PASSWORD_MAX_PENDING checks
+    # are admitted at once, a login that can't get a slot within PASSWORD_ADMIT_TIMEOUT seconds gets a 503
+    PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", str(4 * PASSWORD_WORKERS or 1)))
+    PASSWORD_ADMIT_TIMEOUT = float(os.environ.get("PASSWORD_ADMIT_TIMEOUT", "0.05"))
+    PASSWORD_VERIFY_TIMEOUT = float(os.environ.get("PASSWORD_VERIFY_TIMEOUT", "5"))
+
+    # password of the synthetic accounts created by `python -m app.loadtest seed`
+    LOADTEST_PASSWORD = os.environ.get("LOADTEST_PASSWORD", "LoadTest_2024")
+
+    # add a Server-Timing header (db, crypto, password, total) to every response -- for load runs, it tells
+    # clients how the server spends its time, so leave it off in production
+    REQUEST_TIMING = os.environ.get("REQUEST_TIMING", "0") == "1"
+
+    # audit log file; with AUDIT_PER_PROCESS=1 each process writes <name>.<pid><ext> instead -- off by default
+    # (one process, one audit.log), turn it on for any deployment with more than one worker process
+    # (gunicorn -w N, several hosts on a shared volume): rotation and the hash chain assume a single
+    # writer per file; `python -m app.audit_verify` checks every per-process file next to the base name
+    AUDIT_LOG_FILE = os.environ.get("AUDIT_LOG_FILE", "audit.log")
+    AUDIT_PER_PROCESS = os.environ.get("AUDIT_PER_PROCESS", "0") == "1"
+    # audit log: records are queued and written by one background thread (AUDIT_ASYNC=0 writes inline)
+    AUDIT_ASYNC = os.environ.get("AUDIT_ASYNC", "1") == "1"
+    AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "256"))
+    # what to do when the queue is full: "block" (wait up to AUDIT_BLOCK_TIMEOUT, then drop) or "drop"
+    AUDIT_OVERFLOW = os.environ.get("AUDIT_OVERFLOW", "block")
+    AUDIT_BLOCK_TIMEOUT = float(os.environ.get("AUDIT_BLOCK_TIMEOUT", "0.5"))
+    # "always" = fsync after every batch, "interval" = at most every AUDIT_FSYNC_INTERVAL seconds, "never" = leave it to the OS
+    AUDIT_FSYNC = os.environ.get("AUDIT_FSYNC", "interval")
+    AUDIT_FSYNC_INTERVAL = float(os.environ.get("AUDIT_FSYNC_INTERVAL", "1.0"))
+    # also echo every record to stdout (console view during development)
+    AUDIT_ECHO = os.environ.get("AUDIT_ECHO", "1") == "1"
+    # "text" keeps the classic one-line format, "json" writes JSON-lines records (ts, level, actor, action, target, ip, msg)
+    AUDIT_FORMAT = os.environ.get("AUDIT_FORMAT", "text")
+    # rotate the active log once it reaches AUDIT_ROTATE_BYTES or its first record is AUDIT_ROTATE_SECONDS old (0 = off)
+    AUDIT_ROTATE_BYTES = int(os.environ.get("AUDIT_ROTATE_BYTES", str(64 * 1024 * 1024)))
+    AUDIT_ROTATE_SECONDS = int(os.environ.get("AUDIT_ROTATE_SECONDS", "86400"))
+    # gzip rotated segments in the background
+    AUDIT_COMPRESS = os.environ.get("AUDIT_COMPRESS", "1") == "1"
+    # tamper evidence (json format only): every record gets a seq number and a rolling sha256 chain hash,
+    # and every AUDIT_CHECKPOINT_EVERY records an HMAC'd checkpoint is written so verification can start mid-log
+    AUDIT_CHAIN = os.environ.get("AUDIT_CHAIN", "0") == "1"
+    AUDIT_CHECKPOINT_EVERY = int(os.environ.get("AUDIT_CHECKPOINT_EVERY", "1000"))
+    # required with AUDIT_CHAIN=1 (the app refuses to start without it) -- a secret of its own, not SECRET_KEY:
+    # whoever holds the key can forge checkpoints, and the session key is shared far more widely
+    AUDIT_HMAC_KEY = os.environ.get("AUDIT_HMAC_KEY")
@@ -1,9 +1,25 @@
+import base64
+import hashlib
 import logging
 import json
 import os
-from cryptography.fernet import Fernet
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 from .audit import audit
+from .config import Config
+from .timing import timed
+
+class KeyConfigError(RuntimeError):
+    # no usable encryption key -- generating one here would make every stored value unreadable
+    pass
+
 
 def load_config():
 
@@ -19,29 +35,294 @@ def load_config():
         audit("config.json not found, using empty defaults.")
         return {}
 
-# load the JSON data
-_config_data = load_config()
 
-# try fetching from environment (Most Secure)
-# try fetching from JSON config
-# if both are missing/null, generate a new key
-_env_key = os.environ.get("ENCRYPTION_KEY")
-_json_key = _config_data.get("ENCRYPTION_KEY")
+def load_keys(config_data=None):
+    # the key ring, primary (used for new ciphertexts) first, older keys after it (still accepted for reads):
+    #   env ENCRYPTION_KEYS="new,old" or ENCRYPTION_KEY="key" (Most Secure), else the same names in config.json
+    config_data = load_config() if config_data is None else config_data
+    env_ring = os.environ.get("ENCRYPTION_KEYS")
+    env_key = os.environ.get("ENCRYPTION_KEY")
+    if env_ring:
+        keys = env_ring.split(",")
+    elif env_key:
+        keys = [env_key]
+    elif config_data.get("ENCRYPTION_KEYS"):
+        keys = list(config_data["ENCRYPTION_KEYS"])
+    elif config_data.get("ENCRYPTION_KEY"):
+        keys = [config_data["ENCRYPTION_KEY"]]
+    else:
+        raise KeyConfigError(
+            "No ENCRYPTION_KEY/ENCRYPTION_KEYS configured. Set the existing key, or create one for a new "
+            "database with `python -m app.rekey generate-key`."
+        )
+    keys = [k.strip().encode() for k in keys if k.strip()]
+    for k in keys:
+        Fernet(k)  # fails early on a malformed key
+    return keys
+
+
+def key_fingerprint(k: bytes) -> str:
+    # short, non-reversible key id for logs and checkpoints (never log the key itself)
+    return hashlib.sha256(k).hexdigest()[:12]
+
+
+# compact field format ("aead"): AEAD_PREFIX + unpadded urlsafe base64(key id | nonce | AES-256-GCM ciphertext+tag).
+# about half the size of a Fernet token for short fields (no timestamp, CBC padding or separate HMAC), one AES
+# pass, and the key id picks the key directly instead of trying every key of the ring. "~" is not in the base64
+# alphabet, so the prefix cannot start a Fernet token. (base85 would be ~6% smaller, but Python's codec is
+# pure Python and costs more per field than the AES-GCM itself)
+AEAD_PREFIX = "~1"
+_KEY_ID_BYTES = 4
+_NONCE_BYTES = 12
+
+
+def _aead_for(fernet_key: bytes):
+    # (key id, AESGCM) derived from a ring key, so both formats are configured by the same ENCRYPTION_KEYS
+    raw = base64.urlsafe_b64decode(fernet_key)
+    aead_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"field-aead-v1").derive(raw)
+    return hashlib.sha256(b"field-key-id" + aead_key).digest()[:_KEY_ID_BYTES], AESGCM(aead_key)
+
+
+def _build_ring(ring_keys):
+    global keys, key, fernet, _primary, _aead_keys, _aead_primary
+    fernet = MultiFernet([Fernet(k) for k in ring_keys])
+    _primary = Fernet(ring_keys[0])
+    _aead_keys = dict(_aead_for(k) for k in ring_keys)
+    _aead_primary = _aead_for(ring_keys[0])
+    keys, key = ring_keys, ring_keys[0]
+
+
+_build_ring(load_keys())
+
+
+class DecryptCache:
+    # bounded (entries + bytes) TTL/LRU cache of plaintexts keyed by sha256(ciphertext)
+    # -- the same stored value is rendered many times per page, Fernet work is not cheap
+
+    def __init__(self, enabled, max_entries, max_bytes, ttl):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # bumped on every flush so a decrypt that raced with a key change cannot repopulate the cache
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(ciphertext: str) -> bytes:
+        return hashlib.sha256(ciphertext.encode()).digest()
+
+    def _drop(self, digest):
+        self._bytes -= self._entries.pop(digest)[2]
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(digest)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, digest, plaintext, generation):
+        size = len(plaintext.encode()) + len(digest)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (time.monotonic() + self.ttl, plaintext, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+decrypt_cache = DecryptCache(
+    Config.DECRYPT_CACHE_ENABLED,
+    Config.DECRYPT_CACHE_MAX_ENTRIES,
+    Config.DECRYPT_CACHE_MAX_BYTES,
+    Config.DECRYPT_CACHE_TTL,
+)
+
+
+def set_keys(new_keys):
+    # switch the key ring (primary first) -- cached plaintexts may belong to a dropped key and are flushed
+    _build_ring([k if isinstance(k, bytes) else k.encode() for k in new_keys])
+    decrypt_cache.clear()
+
+
+def set_key(new_key: bytes):
+    set_keys([new_key])
+
+
+def _aead_encrypt(plaintext: str) -> str:
+    key_id, aead = _aead_primary
+    nonce = os.urandom(_NONCE_BYTES)
+    header = AEAD_PREFIX.encode() + key_id
+    # the header is authenticated too, so a value cannot be re-labelled with another key id or version
+    sealed = aead.encrypt(nonce, plaintext.encode(), header)
+    return AEAD_PREFIX + base64.urlsafe_b64encode(key_id + nonce + sealed).rstrip(b"=").decode()
 
-if _env_key:
-    key = _env_key.encode()
-elif _json_key:
-    key = _json_key.encode()
-else:
-    # no key found in Env or JSON ----> generate a fresh one
-    key = Fernet.generate_key()
-    audit(f"Generated new ENCRYPTION_KEY {key}")
-print(key)
 
-fernet = Fernet(key)
+def _aead_unwrap(ciphertext: str) -> bytes:
+    body = ciphertext[len(AEAD_PREFIX):]
+    return base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
 
+
+def _aead_decrypt(ciphertext: str) -> str:
+    blob = _aead_unwrap(ciphertext)
+    key_id, nonce = blob[:_KEY_ID_BYTES], blob[_KEY_ID_BYTES:_KEY_ID_BYTES + _NONCE_BYTES]
+    sealed = blob[_KEY_ID_BYTES + _NONCE_BYTES:]
+    aead = _aead_keys.get(key_id)
+    if aead is None:
+        raise InvalidToken("value was encrypted with a key that is not in the ring")
+    return aead.decrypt(nonce, sealed, AEAD_PREFIX.encode() + key_id).decode()
+
+
+def is_aead(ciphertext: str) -> bool:
+    return ciphertext.startswith(AEAD_PREFIX)
+
+
+@timed("crypto")
 def encrypt_value(plaintext: str) -> str:
-    return fernet.encrypt(plaintext.encode()).decode()
+    # new values use FIELD_CIPHER; both formats are always readable
+    if Config.FIELD_CIPHER == "fernet":
+        return fernet.encrypt(plaintext.encode()).decode()
+    return _aead_encrypt(plaintext)
+
+def _decrypt_uncached(ciphertext: str) -> str:
+    if is_aead(ciphertext):
+        return _aead_decrypt(ciphertext)
+    return fernet.decrypt(ciphertext.encode()).decode()
+
+def rotate_value(ciphertext: str) -> str:
+    # re-encrypts a value under the primary key and the current FIELD_CIPHER, whatever it was written with
+    return encrypt_value(_decrypt_uncached(ciphertext))
 
+def needs_rotation(ciphertext: str) -> bool:
+    # True when the value is not in the current FIELD_CIPHER format under the primary key
+    if is_aead(ciphertext):
+        if Config.FIELD_CIPHER == "fernet":
+            return True
+        return _aead_unwrap(ciphertext)[:_KEY_ID_BYTES] != _aead_primary[0]
+    if Config.FIELD_CIPHER != "fernet":
+        return True
+    try:
+        _primary.decrypt(ciphertext.encode())
+        return False
+    except InvalidToken:
+        return True
+
+@timed("crypto")
 def decrypt_value(ciphertext: str) -> str:
-    return fernet.decrypt(ciphertext.encode()).decode()
\ No newline at end of file
+    if not decrypt_cache.enabled:
+        return _decrypt_uncached(ciphertext)
+
+    digest = decrypt_cache.digest(ciphertext)
+    plaintext = decrypt_cache.get(digest)
+    if plaintext is None:
+        generation = decrypt_cache.generation
+        # failures raise as before and are never cached
+        plaintext = _decrypt_uncached(ciphertext)
+        decrypt_cache.put(digest, plaintext, generation)
+    return plaintext
+
+
+# --- batch API -----------------------------------------------------------------
+
+class _CryptoFailed:
+    # sentinel put in place of values that could not be encrypted/decrypted by the *_many functions
+    def __repr__(self):
+        return "CRYPTO_FAILED"
+
+CRYPTO_FAILED = _CryptoFailed()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.CRYPTO_THREADS, thread_name_prefix="crypto")
+    return _executor
+
+
+def _apply_chunk(func, chunk):
+    results = []
+    for value in chunk:
+        try:
+            results.append(func(value))
+        except Exception:
+            results.append(CRYPTO_FAILED)
+    return results
+
+
+def _apply_all(func, values):
+    # the cryptography backend releases the GIL, so big batches are fanned out to the thread pool
+    threads = Config.CRYPTO_THREADS
+    if threads <= 1 or len(values) < Config.CRYPTO_PARALLEL_THRESHOLD:
+        return _apply_chunk(func, values)
+
+    size = -(-len(values) // threads)
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    results = []
+    for part in _get_executor().map(_apply_chunk, [func] * len(chunks), chunks):
+        results.extend(part)
+    return results
+
+
+@timed("crypto")
+def transform_many(func, values):
+    # applies func(value) to a column of values on the crypto pool, failures come back as CRYPTO_FAILED
+    return _apply_all(func, list(values))
+
+
+@timed("crypto")
+def decrypt_many(ciphertexts):
+    # decrypts a column of values in one go -- identical ciphertexts are decrypted once,
+    # None is passed through and failures come back as CRYPTO_FAILED instead of raising
+    unique = list(dict.fromkeys(c for c in ciphertexts if c is not None))
+    plain = dict(zip(unique, _apply_all(decrypt_value, unique)))
+    return [None if c is None else plain[c] for c in ciphertexts]
+
+
+@timed("crypto")
+def encrypt_many(plaintexts):
+    # encrypts a column of values, None is passed through and failures come back as CRYPTO_FAILED
+    # equal plaintexts are deliberately NOT deduplicated: sharing one ciphertext would reveal which rows are equal
+    values = [p for p in plaintexts if p is not None]
+    encrypted = iter(_apply_all(encrypt_value, values))
+    return [None if p is None else next(encrypted) for p in plaintexts]
\ No newline at end of file
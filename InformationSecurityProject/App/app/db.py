@@ -1,9 +1,389 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
 import mysql.connector
+from flask import g
 
-def get_db_connection():
+from .config import Config
+from .timing import TimedCursor, measure
+
+
+class PoolTimeout(Exception):
+    # raised when no connection could be checked out within DB_POOL_TIMEOUT
+    pass
+
+
+# --- SQLite stand-in ---------------------------------------------------------
+# lets the MySQL-flavoured queries used in routes/ run against a local file (tests, load runs)
+
+_MYSQL_DATE_TOKENS = {"%Y": "%Y", "%m": "%m", "%d": "%d", "%H": "%H", "%i": "%M", "%s": "%S"}
+
+
+def _sqlite_date_format(value, fmt):
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(str(value))
+    for mysql_token, py_token in _MYSQL_DATE_TOKENS.items():
+        fmt = fmt.replace(mysql_token, py_token)
+    return parsed.strftime(fmt)
+
+
+class SQLiteCursor:
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(query):
+        # mysql-connector uses the "format" paramstyle, sqlite3 wants "qmark"
+        return query.replace("%s", "?")
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {col[0]: value for col, value in zip(self._cursor.description, row)}
+
+    def execute(self, query, params=()):
+        self._cursor.execute(self._translate(query), tuple(params or ()))
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(self._translate(query), [tuple(p) for p in seq_of_params])
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+
+    def __init__(self, path):
+        # the pool hands connections between threads (one owner at a time), so the thread check is disabled
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.create_function("DATE_FORMAT", 2, _sqlite_date_format)
+        self._conn.create_function("NOW", 0, lambda: datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def cursor(self, dictionary=False, **kwargs):
+        # mysql-connector options such as buffered= have no sqlite equivalent and are ignored
+        return SQLiteCursor(self._conn.cursor(), dictionary=dictionary)
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def _open_raw_connection():
+    if Config.DB_BACKEND == "sqlite":
+        return SQLiteConnection(Config.DB_SQLITE_PATH)
     return mysql.connector.connect(
-        host="localhost",
-        user="root", 
-        password="root", 
-        database="healthcare_app"
-    )
\ No newline at end of file
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+        database=Config.DB_NAME,
+    )
+
+
+# --- pool --------------------------------------------------------------------
+
+class PooledConnection:
+    # handed out by the pool -- behaves like the driver connection, but close() gives it back instead of dropping it
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise mysql.connector.InterfaceError("Connection already returned to the pool")
+        return getattr(raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self.__getattr__("cursor")(*args, **kwargs)
+        # REQUEST_TIMING: statement time is accounted per request (Server-Timing "db")
+        return TimedCursor(cursor) if Config.REQUEST_TIMING else cursor
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool._release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, size=5, max_overflow=10, timeout=30.0, recycle=3600.0, ping_interval=10.0):
+        self._connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        # idle connections as (raw, created_at, idle_since) -- used as a stack so the most
+        # recently used (warm, recently pinged) connections stay in rotation
+        self._idle = []
+        self._cond = threading.Condition()
+        self._open = 0
+        self._checked_out = 0
+        # set by dispose(): connections still checked out are not parked again when they come back
+        self._disposed = False
+        self._close_on_dispose = True
+        self._stats = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "discarded": 0,
+        }
+
+    def _count(self, name):
+        with self._cond:
+            self._stats[name] += 1
+
+    def _forget(self):
+        # one connection slot is free again -- wake up a waiting checkout
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception as e:
+            logging.debug(f"Error closing pooled connection: {e}")
+
+    @staticmethod
+    def _ping(raw):
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _validate(self, raw, created_at, idle_since):
+        # returns a usable connection, replacing it in the same slot when it is too old or dead
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self._count("recycled")
+        elif now - idle_since < self.ping_interval or self._ping(raw):
+            return raw, created_at
+        else:
+            self._count("ping_failures")
+
+        self._close_quietly(raw)
+        raw = self._connect()
+        self._count("created")
+        return raw, time.monotonic()
+
+    def connect(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    item = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    item = None
+                    break
+
+                # pool exhausted -- wait for somebody to give a connection back
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+        # connecting / pinging happens outside the lock so other threads are not serialized behind it
+        try:
+            if item is None:
+                raw, created_at = self._connect(), time.monotonic()
+                self._count("created")
+            else:
+                raw, created_at = self._validate(*item)
+        except Exception:
+            self._forget()
+            raise
+
+        with self._cond:
+            self._checked_out += 1
+            self._stats["checkouts"] += 1
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        with self._cond:
+            disposed = self._disposed
+        if disposed:
+            # the pool was dropped while this connection was out -- close it (or, after a fork, just let go
+            # of the parent's socket without touching it)
+            with self._cond:
+                self._checked_out -= 1
+            if self._close_on_dispose:
+                self._close_quietly(raw)
+            self._forget()
+            return
+
+        try:
+            # never hand the next user a half-finished transaction
+            raw.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._checked_out -= 1
+            if healthy and not self._disposed and len(self._idle) < self.size:
+                self._idle.append((raw, created_at, time.monotonic()))
+                self._cond.notify()
+                return
+            if not healthy:
+                self._stats["discarded"] += 1
+
+        # broken, or an overflow connection -- close it so we shrink back to DB_POOL_SIZE once load drops
+        self._close_quietly(raw)
+        self._forget()
+
+    def dispose(self, close=True):
+        # close every idle connection (checked out ones are closed when they come back); close=False only
+        # drops the references -- for a forked child, where closing would send COM_QUIT on the parent's
+        # sockets and end the parent's sessions
+        with self._cond:
+            self._disposed = True
+            self._close_on_dispose = close
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        if close:
+            for raw, _, _ in idle:
+                self._close_quietly(raw)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update(
+                size=self.size,
+                max_overflow=self.max_overflow,
+                open=self._open,
+                idle=len(self._idle),
+                checked_out=self._checked_out,
+            )
+        return data
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _open_raw_connection,
+                    size=Config.DB_POOL_SIZE,
+                    max_overflow=Config.DB_POOL_MAX_OVERFLOW,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    recycle=Config.DB_POOL_RECYCLE,
+                    ping_interval=Config.DB_POOL_PING_INTERVAL,
+                )
+    return _pool
+
+
+def dispose_pool(close=True):
+    # drops the shared pool when the DB settings change -- in a child process right after a fork call
+    # dispose_pool(close=False): the inherited connections belong to the parent and must not be closed
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.dispose(close=close)
+        _pool = None
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def get_db_connection():
+    # checks a connection out of the shared pool -- conn.close() returns it
+    return get_pool().connect()
+
+
+# --- request scope -----------------------------------------------------------
+
+def get_db():
+    # one pooled connection per request, opened on first use and shared by the
+    # auth decorators, the view and every helper it calls
+    if "db_conn" not in g:
+        # waiting for a pooled connection is database time too
+        with measure("db"):
+            g.db_conn = get_db_connection()
+    return g.db_conn
+
+
+def close_db(exc=None):
+    # teardown hook: commit what the request did (or roll back if it crashed) and release the connection
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
+    try:
+        if exc is None:
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception as e:
+        logging.error(f"Error finishing request transaction: {e}")
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,445 @@
+# app/loadtest.py
+# load harness: seeds a stand-in database with synthetic users and appointments (PII encrypted through
+# crypto_utils) and drives /login and the role dashboards with concurrent virtual users, in-process through the
+# Flask test client or over HTTP; reports throughput, latency percentiles and per-route db/crypto/password time
+# usage (from App/):  DB_BACKEND=sqlite python -m app.loadtest seed --users 100000 --appointments 5000000
+#                     DB_BACKEND=sqlite python -m app.loadtest run [--concurrency 16] [--duration 60]
+#                         [--mix patient=70,medic=25,admin=5] [--views-per-login 10] [--output report.json]
+#                     python -m app.loadtest run --base-url http://127.0.0.1:5000 ...
+#
+# seeded accounts are lt_<role>_<n> with the password LOADTEST_PASSWORD. the db/crypto/password split comes from
+# the Server-Timing header: in-process runs switch REQUEST_TIMING on, a server under HTTP load needs REQUEST_TIMING=1
+import argparse
+import http.cookiejar
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from .appointment_summary import rebuild as rebuild_summary
+from .audit import audit
+from .blind_index import backfill as backfill_blind_indexes
+from .config import Config
+from .crypto_utils import CRYPTO_FAILED, encrypt_many
+from .db import get_db_connection, pool_stats
+from .migrate import migrate
+from .passwords import hash_password
+from .timing import parse_server_timing
+
+ROLES = ("patient", "medic", "admin")
+DASHBOARDS = {"patient": "/patient/", "medic": "/medic/", "admin": "/admin/"}
+
+_FIRST = ("Ana", "Bogdan", "Carmen", "Dan", "Elena", "Florin", "Gabriela", "Horia", "Ioana", "Mihai", "Radu", "Sofia")
+_LAST = ("Popescu", "Ionescu", "Stan", "Dumitru", "Georgescu", "Marin", "Tudor", "Constantin", "Lazar", "Munteanu")
+_DETAILS = (
+    "Routine check-up",
+    "Follow-up after blood work, review results and adjust medication",
+    "Persistent cough for two weeks, no fever",
+    "Annual physical, fasting required",
+    "Post-operative control, check wound healing and remove stitches",
+    "Allergy consultation",
+)
+_STATUS_WEIGHTS = (("scheduled", 30), ("completed", 60), ("cancelled", 10))
+
+
+# --- seeding -------------------------------------------------------------------------
+
+def _person(rng, n):
+    first, last = rng.choice(_FIRST), rng.choice(_LAST)
+    return f"{first} {last}", f"{first.lower()}.{last.lower()}{n}@example.test"
+
+
+def _insert_users(conn, role, count, password_hash, rng, batch, progress):
+    cursor = conn.cursor()
+    try:
+        for start in range(1, count + 1, batch):
+            numbers = range(start, min(start + batch, count + 1))
+            people = [_person(rng, n) for n in numbers]
+            names = encrypt_many([p[0] for p in people])
+            emails = encrypt_many([p[1] for p in people])
+            if CRYPTO_FAILED in names or CRYPTO_FAILED in emails:
+                raise RuntimeError("encryption failed while seeding users")
+            cursor.executemany(
+                "INSERT INTO users (username, password, full_name, email, role) VALUES (%s, %s, %s, %s, %s)",
+                [(f"lt_{role}_{n:07d}", password_hash, name, email, role) for n, name, email in zip(numbers, names, emails)],
+            )
+            conn.commit()
+        progress(f"  {count} {role} accounts")
+    finally:
+        cursor.close()
+
+
+def _user_ids(conn, role):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM users WHERE role = %s AND username LIKE %s ORDER BY id", (role, f"lt_{role}_%"))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _insert_appointments(conn, count, patients, medics, rng, batch, progress):
+    # every patient has one medic (by position), appointments spread over the last two years and next six months
+    statuses = [s for s, weight in _STATUS_WEIGHTS for _ in range(weight)]
+    origin = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=730)
+    span_hours = 912 * 24
+    cursor = conn.cursor()
+    started = time.monotonic()
+    try:
+        for start in range(0, count, batch):
+            rows = []
+            for _ in range(min(batch, count - start)):
+                i = rng.randrange(len(patients))
+                date = origin + timedelta(hours=rng.randrange(span_hours))
+                rows.append([patients[i], medics[i % len(medics)], date.strftime("%Y-%m-%d %H:%M:%S"),
+                             rng.choice(statuses), rng.choice(_DETAILS)])
+            details = encrypt_many([r[4] for r in rows])
+            if CRYPTO_FAILED in details:
+                raise RuntimeError("encryption failed while seeding appointments")
+            for row, detail in zip(rows, details):
+                row[4] = detail
+            cursor.executemany(
+                "INSERT INTO appointments (patient_id, medic_id, date, status, details) VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+            conn.commit()
+            done = start + len(rows)
+            if done % (batch * 20) == 0 or done == count:
+                progress(f"  {done} appointments ({done / max(time.monotonic() - started, 1e-6):.0f}/s)")
+    finally:
+        cursor.close()
+
+
+def seed(users, appointments, medic_share=0.01, admins=5, batch=5000, random_seed=None, force=False, progress=print):
+    # creates the schema if needed, then the synthetic accounts and appointments; refuses to touch a
+    # database that already has users unless force=True
+    rng = random.Random(random_seed)
+    migrate(progress=lambda message: None)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COUNT(*) FROM users")
+            existing = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if existing and not force:
+            raise RuntimeError(f"users already has {existing} rows -- seed an empty database, or pass --force")
+
+        medics = max(1, int(users * medic_share))
+        patients = max(1, users - medics - admins)
+        # one shared hash: hashing 100k passwords with production parameters would take longer than the run
+        password_hash = hash_password(Config.LOADTEST_PASSWORD)
+        started = time.monotonic()
+        for role, count in (("admin", admins), ("medic", medics), ("patient", patients)):
+            _insert_users(conn, role, count, password_hash, rng, batch, progress)
+
+        _insert_appointments(
+            conn, appointments, _user_ids(conn, "patient"), _user_ids(conn, "medic"), rng, batch, progress
+        )
+        rebuild_summary(conn)
+    finally:
+        conn.close()
+
+    backfill_blind_indexes(progress=lambda message: None)
+    audit(
+        f"Load test data seeded: {admins + medics + patients} users, {appointments} appointments",
+        action="loadtest.seed",
+    )
+    progress(f"Seeded {admins + medics + patients} users and {appointments} appointments in {time.monotonic() - started:.0f}s")
+
+
+# --- clients -------------------------------------------------------------------------
+
+class TestClientSession:
+    # one browser: a Flask test client keeps its own cookie jar
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data, follow_redirects=False)
+        response.close()
+        return response.status_code, response.headers
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # redirects are answers in their own right here (login -> dashboard), not something to follow
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers
+
+
+# --- measuring -----------------------------------------------------------------------
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.server = {}  # Server-Timing totals (ms)
+        self.timed = 0
+
+    def add(self, seconds, ok, server_timing):
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+        if server_timing:
+            self.timed += 1
+            for kind, ms in server_timing.items():
+                self.server[kind] = self.server.get(kind, 0.0) + ms
+
+    def to_dict(self, seconds):
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        data = {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "per_second": round(len(self.latencies) / max(seconds, 1e-6), 1),
+            "p50_ms": ms(_percentile(self.latencies, 50)),
+            "p95_ms": ms(_percentile(self.latencies, 95)),
+            "p99_ms": ms(_percentile(self.latencies, 99)),
+        }
+        for kind, total in sorted(self.server.items()):
+            data[f"{kind}_ms_mean"] = round(total / self.timed, 2)
+        return data
+
+
+class Recorder:
+    # thread-safe per-route results; requests that start during the warm-up are not recorded
+
+    def __init__(self, record_from):
+        self.record_from = record_from
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, started, seconds, ok, headers):
+        if started < self.record_from:
+            return
+        server_timing = parse_server_timing(headers.get("Server-Timing"))
+        with self._lock:
+            self.routes.setdefault(route, RouteStats()).add(seconds, ok, server_timing)
+
+
+def _virtual_user(new_session, accounts, roles, weights, views_per_login, deadline, recorder, rng):
+    # log in as a random account of a role picked by the mix, then look at its dashboard views_per_login times
+    while time.monotonic() < deadline:
+        role = rng.choices(roles, weights)[0]
+        session = new_session()
+        login = {"username": rng.choice(accounts[role]), "password": Config.LOADTEST_PASSWORD}
+        started = time.monotonic()
+        try:
+            status, headers = session.request("POST", "/login", login)
+        except Exception:
+            status, headers = None, {}
+        seconds = time.monotonic() - started
+        ok = status == 302 and DASHBOARDS[role] in headers.get("Location", "")
+        recorder.record("POST /login", started, seconds, ok, headers)
+        if not ok:
+            continue
+
+        for _ in range(views_per_login):
+            if time.monotonic() >= deadline:
+                break
+            started = time.monotonic()
+            try:
+                status, headers = session.request("GET", DASHBOARDS[role])
+            except Exception:
+                status, headers = None, {}
+            recorder.record(f"GET {DASHBOARDS[role]}", started, time.monotonic() - started, status == 200, headers)
+
+
+def load_accounts(roles, limit=10000):
+    # seeded usernames per role (up to `limit` each) -- an HTTP run reads them from the same database
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    accounts = {}
+    try:
+        for role in roles:
+            cursor.execute(
+                "SELECT username FROM users WHERE role = %s AND username LIKE %s ORDER BY id LIMIT %s",
+                (role, f"lt_{role}_%", limit),
+            )
+            accounts[role] = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+    missing = [role for role in roles if not accounts[role]]
+    if missing:
+        raise RuntimeError(f"no seeded {', '.join(missing)} accounts -- run `python -m app.loadtest seed` first")
+    return accounts
+
+
+def parse_mix(text):
+    # "patient=70,medic=25,admin=5" -> {"patient": 70.0, ...}; roles with weight 0 are left out
+    mix = {}
+    for part in text.split(","):
+        role, _, weight = part.partition("=")
+        role = role.strip()
+        if role not in ROLES:
+            raise ValueError(f"unknown role {role!r} in --mix")
+        mix[role] = float(weight or 1)
+    return {role: weight for role, weight in mix.items() if weight > 0}
+
+
+def run(concurrency=8, duration=30.0, warmup=5.0, mix=None, views_per_login=10, base_url=None, random_seed=None,
+        progress=print):
+    mix = mix or {"patient": 70, "medic": 25, "admin": 5}
+    roles, weights = list(mix), list(mix.values())
+    accounts = load_accounts(roles)
+
+    if base_url:
+        def new_session():
+            return HttpSession(base_url)
+        target = base_url
+    else:
+        from . import create_app
+
+        # the per-route split needs the timing hooks, which are installed when the app is created
+        Config.REQUEST_TIMING = True
+        app = create_app()
+
+        def new_session():
+            return TestClientSession(app)
+        target = "in-process (Flask test client)"
+
+    progress(f"Driving {target} with {concurrency} virtual users for {warmup:.0f}s warm-up + {duration:.0f}s")
+    started = time.monotonic()
+    recorder = Recorder(started + warmup)
+    deadline = started + warmup + duration
+    seeder = random.Random(random_seed)
+    threads = [
+        threading.Thread(
+            target=_virtual_user,
+            args=(new_session, accounts, roles, weights, views_per_login, deadline, recorder,
+                  random.Random(seeder.random())),
+            daemon=True,
+        )
+        for _ in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = max(time.monotonic() - recorder.record_from, 1e-6)
+
+    all_requests = RouteStats()
+    for stats in recorder.routes.values():
+        all_requests.latencies.extend(stats.latencies)
+        all_requests.errors += stats.errors
+    report = {
+        "target": target,
+        "backend": Config.DB_BACKEND,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 1),
+        "mix": mix,
+        "views_per_login": views_per_login,
+        "total": all_requests.to_dict(seconds),
+        "routes": {route: stats.to_dict(seconds) for route, stats in sorted(recorder.routes.items())},
+    }
+    if not base_url:
+        report["db_pool"] = pool_stats()
+    return report
+
+
+def print_report(report, out=print):
+    out(f"{report['target']}: {report['concurrency']} virtual users, {report['seconds']}s measured")
+    header = f"  {'route':<16} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}   {'db':>7} {'crypto':>7} {'passwd':>7}"
+    out(header + "   (ms; db/crypto/passwd = server-side mean)")
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for route, r in rows:
+        def cell(key, width=8):
+            value = r.get(key)
+            return f"{'-' if value is None else f'{value:.1f}':>{width}}"
+        out(
+            f"  {route:<16} {r['requests']:>7} {r['errors']:>5} {r['per_second']:>8.1f} {cell('p50_ms')} "
+            f"{cell('p95_ms')} {cell('p99_ms')}   {cell('db_ms_mean', 7)} {cell('crypto_ms_mean', 7)} "
+            f"{cell('password_ms_mean', 7)}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic data and load-test the web app.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sd = sub.add_parser("seed", help="create synthetic users and appointments (PII encrypted)")
+    sd.add_argument("--users", type=int, default=1000)
+    sd.add_argument("--appointments", type=int, default=20000)
+    sd.add_argument("--medic-share", type=float, default=0.01, help="fraction of the users that are medics")
+    sd.add_argument("--admins", type=int, default=5)
+    sd.add_argument("--batch", type=int, default=5000, help="rows per insert transaction")
+    sd.add_argument("--random-seed", type=int, help="make the generated data reproducible")
+    sd.add_argument("--force", action="store_true", help="seed even though users is not empty")
+
+    rn = sub.add_parser("run", help="drive the routes with concurrent virtual users")
+    rn.add_argument("--concurrency", type=int, default=8, help="virtual users (threads)")
+    rn.add_argument("--duration", type=float, default=30, help="measured seconds")
+    rn.add_argument("--warmup", type=float, default=5, help="seconds before measuring starts")
+    rn.add_argument("--mix", default="patient=70,medic=25,admin=5", help="role weights")
+    rn.add_argument("--views-per-login", type=int, default=10, help="dashboard views after each login")
+    rn.add_argument("--base-url", help="load a running server over HTTP instead of the in-process app")
+    rn.add_argument("--random-seed", type=int)
+    rn.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "seed":
+        try:
+            seed(args.users, args.appointments, args.medic_share, args.admins, args.batch, args.random_seed, args.force)
+        except RuntimeError as e:
+            print(e)
+            return 1
+        return 0
+
+    report = run(
+        concurrency=args.concurrency,
+        duration=args.duration,
+        warmup=args.warmup,
+        mix=parse_mix(args.mix),
+        views_per_login=args.views_per_login,
+        base_url=args.base_url,
+        random_seed=args.random_seed,
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Report written to {args.output}")
+    return 1 if report["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
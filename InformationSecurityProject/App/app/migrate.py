@@ -0,0 +1,236 @@
+# app/migrate.py
+# applies the versioned migrations in app/migrations and checks the hot queries' plans against the live schema
+# usage (from App/):  python -m app.migrate [--to VERSION] [--status] [--check]
+import argparse
+import re
+import sys
+
+import mysql.connector
+
+from . import appointment_import, security
+from .appointment_summary import bump, for_update, monthly_report, subtract_appointments
+from .audit import audit
+from .backup import record_deletions
+from .blind_index import index_user, search_user_ids
+from .config import Config
+from .db import get_db_connection
+from .migrations import backend, load_migrations
+from .routes import admin, auth, medic, patient
+
+_SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        name VARCHAR(128) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+def ensure_database():
+    # the app connects straight into DB_NAME, so the schema itself is created over a database-less connection
+    if backend() == "sqlite":
+        return
+    conn = mysql.connector.connect(
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE DATABASE IF NOT EXISTS `{Config.DB_NAME}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+        )
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def applied_versions(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_SCHEMA_MIGRATIONS)
+        conn.commit()
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def migrate(to=None, progress=print):
+    # runs every pending migration up to `to` (default: all), recording each one once it succeeded
+    ensure_database()
+    conn = get_db_connection()
+    try:
+        done = applied_versions(conn)
+        ran = 0
+        for version, name, module in load_migrations():
+            if version in done or (to is not None and version > to):
+                continue
+            progress(f"  applying v{version:03d} {name}: {module.DESCRIPTION}")
+            module.upgrade(conn)
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+            finally:
+                cursor.close()
+            ran += 1
+    finally:
+        conn.close()
+
+    if ran:
+        audit(f"Applied {ran} schema migration(s)", action="schema.migrate")
+    progress(f"{ran} migration(s) applied" if ran else "Schema is up to date")
+    return ran
+
+
+def status(progress=print):
+    conn = get_db_connection()
+    try:
+        done = applied_versions(conn)
+    finally:
+        conn.close()
+    for version, name, module in load_migrations():
+        state = "applied" if version in done else "pending"
+        progress(f"  v{version:03d} {name:<24} {state:<8} {module.DESCRIPTION}")
+
+
+# --- query check -------------------------------------------------------------------
+# checks the statements the code actually runs: the routes' SQL constants, and what the cursor helpers send
+# when run against a recording cursor -- only the sample parameters (typed, LIMIT needs numbers) live here
+
+
+class _RecordingCursor:
+    # stands in for a cursor when a helper is run only to capture the SQL it sends (reads return nothing)
+
+    def __init__(self):
+        self.statements = []
+        self.rowcount = 0
+        self.lastrowid = 0
+
+    def execute(self, sql, params=()):
+        self.statements.append((" ".join(sql.split()), tuple(params or ())))
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            self.execute(sql, seq_of_params[0])
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+def _recorded(name, helper, *args):
+    cursor = _RecordingCursor()
+    helper(cursor, *args)
+    return [(name, sql, params) for sql, params in cursor.statements]
+
+
+def hot_queries():
+    # [(name, sql, params)] for the queries on the request path, with sample parameters of the right type
+    # (LIMIT/OFFSET must be numbers) -- a route that gets a new query keeps it in a module constant listed here
+    limit = Config.ADMIN_PAGE_SIZE + 1
+    queries = [
+        ("security.get_user_by_username_sql", security.USER_BY_USERNAME_SQL, ("x",)),
+        ("auth.login", auth.LOGIN_SQL, ("x",)),
+        ("auth.login rehash", auth.REHASH_SQL, ("x", 1, "x")),
+        ("admin.fetch_users_page next", admin.USERS_PAGE_NEXT_SQL, (0, limit)),
+        ("admin.fetch_users_page prev", admin.USERS_PAGE_PREV_SQL, (1, limit)),
+        ("admin.search_users rows", admin.USERS_BY_IDS_SQL.format(placeholders="%s, %s"), (1, 2)),
+        ("admin.update_user", admin.USER_UPDATE_SQL, ("x", "x", "patient", 1)),
+        ("admin.delete_user", admin.USER_DELETE_SQL, (1,)),
+        ("medic.fetch_dashboard_data", medic.DASHBOARD_SQL, (1, 1)),
+        ("medic.update_appointment check", medic.APPOINTMENT_CHECK_SQL + for_update(), (1, 1)),
+        ("medic.update_appointment", medic.APPOINTMENT_UPDATE_SQL, ("done", "x", 1)),
+        ("medic.delete_appointment", medic.APPOINTMENT_DELETE_SQL, (1,)),
+        ("patient.dashboard profile", patient.PROFILE_SQL, (1,)),
+        ("patient.dashboard appointments", patient.APPOINTMENTS_SQL, (1,)),
+        ("appointment_import.get_import_job", appointment_import.JOB_BY_ID_SQL, ("x",)),
+        ("appointment_import.latest_import_job", appointment_import.LATEST_JOB_SQL, (1, "appointment")),
+    ]
+    queries = [(name, " ".join(sql.split()), params) for name, sql, params in queries]
+    # helpers that take a cursor are run for real, so the SQL they build (per backend) is what gets checked
+    queries += _recorded("blind_index.search_user_ids email", search_user_ids, "someone@example.com", limit)
+    queries += _recorded("blind_index.search_user_ids name", search_user_ids, "ana popescu", limit)
+    queries += _recorded("blind_index.index_user", index_user, 1, "Ana Popescu", "someone@example.com")
+    queries += _recorded("appointment_summary.bump", bump, "2024-01", "scheduled", 1, 1)
+    queries += _recorded("appointment_summary.subtract_appointments", subtract_appointments,
+                         "patient_id = %s OR medic_id = %s", (1, 1))
+    queries += _recorded("appointment_summary.monthly_report", monthly_report)
+    queries += _recorded("backup.record_deletions", record_deletions, "appointments", "id = %s", (1,))
+    return queries
+
+
+def _explain(cursor, sql, params):
+    # [(table, access type, key, flagged)] for one statement, parameters bound by the driver
+    if backend() == "sqlite":
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = []
+        for row in cursor.fetchall():
+            detail = row[-1]
+            full_scan = detail.startswith("SCAN ") and "INDEX" not in detail
+            match = re.match(r"(?:SCAN|SEARCH) (?:TABLE )?(\w+)", detail)
+            plan.append((match.group(1) if match else "", detail, "", full_scan))
+        return plan
+
+    cursor.execute(f"EXPLAIN {sql}", params)
+    plan = []
+    for row in cursor.fetchall():
+        plan.append((row.get("table"), row.get("type"), row.get("key"), row.get("type") == "ALL"))
+    return plan
+
+
+def check(progress=print):
+    # EXPLAINs every hot query and flags full table scans; a query that cannot be EXPLAINed (missing column,
+    # syntax the backend rejects) is flagged too. Returns the flagged count
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=(backend() == "mysql"))
+    flagged = 0
+    try:
+        for name, sql, params in hot_queries():
+            try:
+                plan = _explain(cursor, sql, params)
+            except Exception as e:
+                flagged += 1
+                progress(f"  {name:<44} ERROR     could not EXPLAIN: {e}")
+                progress(f"      {sql}")
+                continue
+            bad = [p for p in plan if p[3]]
+            flagged += bool(bad)
+            marker = "FULL SCAN" if bad else "ok"
+            summary = ", ".join(f"{t}:{a}" + (f"({k})" if k else "") for t, a, k, _ in plan)
+            progress(f"  {name:<44} {marker:<9} {summary}")
+            if bad:
+                progress(f"      {sql}")
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.close()
+    progress(f"{flagged} quer{'y' if flagged == 1 else 'ies'} with full table scans or errors")
+    return flagged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations and check query plans.")
+    parser.add_argument("--to", type=int, help="stop after this migration version")
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+    parser.add_argument("--check", action="store_true", help="EXPLAIN the hot queries and flag full scans")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        status()
+        return 0
+    if args.check:
+        return 1 if check() else 0
+    migrate(to=args.to)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+# app/migrations
+# versioned schema migrations, applied in order by `python -m app.migrate`
+# each vNNN_<name>.py module defines DESCRIPTION and upgrade(conn); upgrades must be idempotent
+# (DDL is not transactional in MySQL, so a migration that failed halfway is simply run again)
+import importlib
+import pkgutil
+import re
+
+from ..config import Config
+
+_MODULE_NAME = re.compile(r"^v(\d{3})_(\w+)$")
+
+
+def load_migrations():
+    # [(version, name, module), ...] sorted by version
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(info.name)
+        if match:
+            module = importlib.import_module(f"{__name__}.{info.name}")
+            found.append((int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda m: m[0])
+    return found
+
+
+def backend():
+    return "sqlite" if Config.DB_BACKEND == "sqlite" else "mysql"
+
+
+def index_columns(cursor, table):
+    # {index name: [columns in order]} of a table
+    indexes = {}
+    if backend() == "sqlite":
+        cursor.execute(f"PRAGMA index_list({table})")
+        for name in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"PRAGMA index_info({name})")
+            indexes[name] = [row[2] for row in sorted(cursor.fetchall())]
+        return indexes
+
+    cursor.execute(
+        "SELECT index_name, column_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s ORDER BY index_name, seq_in_index",
+        (table,),
+    )
+    for name, column in cursor.fetchall():
+        indexes.setdefault(name, []).append(column)
+    return indexes
+
+
+def ensure_index(cursor, table, name, columns, unique=False):
+    # creates the index unless one already starts with the same columns (an equivalent index may have
+    # been created out of band under another name -- a duplicate would only slow down writes)
+    for existing in index_columns(cursor, table).values():
+        if existing[:len(columns)] == list(columns):
+            return False
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})")
+    return True
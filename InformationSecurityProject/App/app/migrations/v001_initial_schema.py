@@ -0,0 +1,63 @@
+# users and appointments as the app expects them (no-op on databases created out of band)
+from . import backend
+
+DESCRIPTION = "create users and appointments tables"
+
+_TABLES = {
+    "mysql": [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(64) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            full_name TEXT,
+            email TEXT,
+            role VARCHAR(16) NOT NULL,
+            UNIQUE KEY uq_users_username (username)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            patient_id INT NOT NULL,
+            medic_id INT NOT NULL,
+            date DATETIME NOT NULL,
+            status VARCHAR(32) NOT NULL DEFAULT 'scheduled',
+            details TEXT,
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (medic_id) REFERENCES users(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ],
+    "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(64) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            full_name TEXT,
+            email TEXT,
+            role VARCHAR(16) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            medic_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            date DATETIME NOT NULL,
+            status VARCHAR(32) NOT NULL DEFAULT 'scheduled',
+            details TEXT
+        )
+        """,
+    ],
+}
+
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    try:
+        for ddl in _TABLES[backend()]:
+            cursor.execute(ddl)
+    finally:
+        cursor.close()
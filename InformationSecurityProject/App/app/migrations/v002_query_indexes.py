@@ -0,0 +1,17 @@
+# composite indexes for the predicates the routes filter and sort on
+from . import ensure_index
+
+DESCRIPTION = "indexes for appointments(medic_id, status, date), appointments(patient_id, date), users(username)"
+
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    try:
+        # medic dashboard: WHERE medic_id = ? AND status = ? ORDER BY date (also serves medic_id alone)
+        ensure_index(cursor, "appointments", "idx_appointments_medic_status_date", ["medic_id", "status", "date"])
+        # patient dashboard: WHERE patient_id = ? ORDER BY date
+        ensure_index(cursor, "appointments", "idx_appointments_patient_date", ["patient_id", "date"])
+        # login: WHERE username = ?
+        ensure_index(cursor, "users", "uq_users_username", ["username"], unique=True)
+    finally:
+        cursor.close()
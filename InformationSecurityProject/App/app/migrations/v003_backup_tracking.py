@@ -0,0 +1,8 @@
+# updated_at columns and the deleted_rows table used by incremental backups (see backup.py)
+from ..backup import ensure_backup_schema
+
+DESCRIPTION = "change tracking for incremental backups"
+
+
+def upgrade(conn):
+    ensure_backup_schema(conn)
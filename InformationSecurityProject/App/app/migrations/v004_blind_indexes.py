@@ -0,0 +1,9 @@
+# users.email_bidx and user_name_tokens for searching the encrypted user fields (see blind_index.py)
+from ..blind_index import ensure_blind_index_schema
+
+DESCRIPTION = "blind index column and name token table"
+
+
+def upgrade(conn):
+    # existing rows are indexed by `python -m app.blind_index backfill`
+    ensure_blind_index_schema(conn)
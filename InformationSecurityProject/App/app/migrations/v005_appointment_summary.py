@@ -0,0 +1,8 @@
+# monthly appointment counts read by the admin report (see appointment_summary.py)
+from ..appointment_summary import ensure_summary_schema
+
+DESCRIPTION = "appointment_monthly_summary table, filled from existing appointments"
+
+
+def upgrade(conn):
+    ensure_summary_schema(conn)
@@ -0,0 +1,55 @@
+# state of the background CSV/JSONL imports, shared by every worker (see appointment_import.py)
+from . import backend
+
+DESCRIPTION = "import_jobs table for background import progress"
+
+_TABLES = {
+    "mysql": [
+        """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id CHAR(12) NOT NULL PRIMARY KEY,
+            owner INT NOT NULL,
+            kind VARCHAR(16) NOT NULL,
+            state VARCHAR(16) NOT NULL,
+            active VARCHAR(40) NULL,
+            report MEDIUMTEXT NULL,
+            error TEXT NULL,
+            created DOUBLE NOT NULL,
+            started DOUBLE NULL,
+            finished DOUBLE NULL,
+            heartbeat DOUBLE NOT NULL,
+            UNIQUE KEY uq_import_jobs_active (active),
+            INDEX idx_import_jobs_owner (owner, kind, created)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ],
+    "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id CHAR(12) NOT NULL PRIMARY KEY,
+            owner INTEGER NOT NULL,
+            kind VARCHAR(16) NOT NULL,
+            state VARCHAR(16) NOT NULL,
+            active VARCHAR(40) NULL UNIQUE,
+            report TEXT NULL,
+            error TEXT NULL,
+            created DOUBLE NOT NULL,
+            started DOUBLE NULL,
+            finished DOUBLE NULL,
+            heartbeat DOUBLE NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_import_jobs_owner ON import_jobs (owner, kind, created)",
+    ],
+}
+
+
+def upgrade(conn):
+    # `active` is "<owner>:<kind>" while a job is queued or running and NULL afterwards -- the unique key
+    # is what lets only one import per owner and kind run, whichever worker starts it
+    cursor = conn.cursor()
+    try:
+        for ddl in _TABLES[backend()]:
+            cursor.execute(ddl)
+    finally:
+        cursor.close()
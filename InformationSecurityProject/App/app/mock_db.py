@@ -1,8 +1,8 @@
 import logging
-from werkzeug.security import generate_password_hash
 
 from .crypto_utils import encrypt_value
 from .audit import audit
+from .passwords import hash_password
 
 
 # in the future this will be replaced by actual DB queries
@@ -57,7 +57,7 @@ def initialize_mock_db():
         USERS[u["username"]] = {
             "id": u["id"],
             "username": u["username"],
-            "password_hash": generate_password_hash(u["password"]),
+            "password_hash": hash_password(u["password"]),
             "role": u["role"],
             "personal": encrypted_personal,
         }
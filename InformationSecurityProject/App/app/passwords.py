@@ -0,0 +1,253 @@
+# app/passwords.py
+# password hashing policy and verification off the request thread: hashes are checked in a small process pool,
+# so a burst of logins burns CPU in other processes instead of holding the GIL that every other request needs
+# usage (from App/):  python -m app.passwords calibrate [--target-ms 250] [--max-memory-mb 64] [--write]
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .config import CONFIG_FILE, Config
+from .timing import timed
+
+
+class VerifierBusy(Exception):
+    # raised when the verification queue is full (or a check took too long) -- the caller answers 503
+    pass
+
+
+@timed("password")
+def hash_password(password, method=None):
+    # every new password hash goes through here, so they all follow PASSWORD_HASH_METHOD
+    return generate_password_hash(password, method=method or Config.PASSWORD_HASH_METHOD)
+
+
+@lru_cache(maxsize=8)
+def _method_prefix(method):
+    # werkzeug expands shorthands ("scrypt" -> "scrypt:32768:8:1"), so compare against what it actually writes
+    return generate_password_hash("x", method=method).split("$", 1)[0]
+
+
+def needs_rehash(pwhash, method=None):
+    # True when a stored hash was made with other parameters than the current target
+    return pwhash.split("$", 1)[0] != _method_prefix(method or Config.PASSWORD_HASH_METHOD)
+
+
+def _timed_check(pwhash, password, method=None):
+    # runs in a worker process; also reports the pure hashing time so queueing can be told apart from work.
+    # with `method`, a correct password whose hash is outdated is rehashed in the same trip
+    started = time.perf_counter()
+    ok = check_password_hash(pwhash, password)
+    seconds = time.perf_counter() - started
+    new_hash = hash_password(password, method) if ok and method and needs_rehash(pwhash, method) else None
+    return ok, seconds, new_hash
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class PasswordVerifier:
+    # at most max_pending checks are admitted (running or queued for a worker); the rest fail fast
+
+    def __init__(self, workers, max_pending, admit_timeout, verify_timeout, start_method="spawn"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.admit_timeout = admit_timeout
+        self.verify_timeout = verify_timeout
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counters = {"verified": 0, "rejected_busy": 0, "timeouts": 0, "max_pending_seen": 0}
+        # recent samples (seconds) for the percentiles in stats()
+        self._queue_wait = deque(maxlen=1000)
+        self._hash_time = deque(maxlen=1000)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # "spawn": forking a threaded web worker (pool, audit writer) can copy held locks into the child
+                    context = multiprocessing.get_context(self.start_method)
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def verify(self, pwhash, password, method=None):
+        # (ok, new hash or None) -- see _timed_check
+        if self.workers <= 0:
+            # pool disabled: check inline, as before
+            ok, seconds, new_hash = _timed_check(pwhash, password, method)
+            self._record(0.0, seconds)
+            return ok, new_hash
+
+        if not self._slots.acquire(timeout=self.admit_timeout):
+            with self._lock:
+                self._counters["rejected_busy"] += 1
+            raise VerifierBusy("password verification queue is full")
+
+        with self._lock:
+            self._pending += 1
+            self._counters["max_pending_seen"] = max(self._counters["max_pending_seen"], self._pending)
+        started = time.perf_counter()
+        try:
+            future = self._get_executor().submit(_timed_check, pwhash, password, method)
+        except BaseException:
+            self._release_slot()
+            raise
+        # the slot goes back when the check actually ends: a check that timed out keeps running in its worker
+        # (cancel() only stops one still queued), and freeing its slot early would admit more work than
+        # the pool can get through
+        future.add_done_callback(self._release_slot)
+        try:
+            ok, seconds, new_hash = future.result(timeout=self.verify_timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise VerifierBusy("password verification timed out")
+
+        self._record(max(0.0, time.perf_counter() - started - seconds), seconds)
+        return ok, new_hash
+
+    def _release_slot(self, future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _record(self, queue_wait, hash_time):
+        with self._lock:
+            self._counters["verified"] += 1
+            self._queue_wait.append(queue_wait)
+            self._hash_time.append(hash_time)
+
+    def stats(self):
+        with self._lock:
+            waits, hashes = list(self._queue_wait), list(self._hash_time)
+            data = dict(self._counters, pending=self._pending, workers=self.workers, max_pending=self.max_pending)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        data.update(
+            queue_wait_ms_p50=ms(_percentile(waits, 50)),
+            queue_wait_ms_p95=ms(_percentile(waits, 95)),
+            hash_ms_p50=ms(_percentile(hashes, 50)),
+            hash_ms_p95=ms(_percentile(hashes, 95)),
+        )
+        return data
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+verifier = PasswordVerifier(
+    Config.PASSWORD_WORKERS,
+    Config.PASSWORD_MAX_PENDING,
+    Config.PASSWORD_ADMIT_TIMEOUT,
+    Config.PASSWORD_VERIFY_TIMEOUT,
+)
+atexit.register(verifier.shutdown)
+
+
+@timed("password")
+def verify_and_rehash(pwhash, password):
+    # (ok, new hash) -- new hash is set when the password is right but its hash predates PASSWORD_HASH_METHOD;
+    # raises VerifierBusy when the pool is saturated
+    return verifier.verify(pwhash, password, Config.PASSWORD_HASH_METHOD)
+
+
+def password_stats():
+    return dict(verifier.stats(), method=_method_prefix(Config.PASSWORD_HASH_METHOD))
+
+
+# --- calibration -------------------------------------------------------------------
+
+def _verify_ms(method, rounds=3):
+    # median time of one check_password_hash with `method`, in milliseconds
+    pwhash = generate_password_hash("calibration-password", method=method)
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        check_password_hash(pwhash, "calibration-password")
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def calibrate(target_ms, max_memory_mb, r=8, progress=print):
+    # scrypt: N sets time *and* memory (128 * N * r bytes), p multiplies time only. N is doubled while it fits
+    # the memory budget and stays under the target; then p is raised to spend what is left of the target
+    budget = max_memory_mb * 1024 * 1024
+    n, p = 2 ** 14, 1
+    ms = _verify_ms(f"scrypt:{n}:{r}:{p}")
+    progress(f"  scrypt:{n}:{r}:{p}  {ms:.0f} ms  {128 * n * r // 2 ** 20} MiB")
+    while 128 * (n * 2) * r <= budget:
+        candidate = _verify_ms(f"scrypt:{n * 2}:{r}:{p}")
+        progress(f"  scrypt:{n * 2}:{r}:{p}  {candidate:.0f} ms  {128 * n * 2 * r // 2 ** 20} MiB")
+        if candidate > target_ms:
+            break
+        n, ms = n * 2, candidate
+
+    while ms * (p + 1) / p <= target_ms:
+        p += 1
+        ms = _verify_ms(f"scrypt:{n}:{r}:{p}")
+        progress(f"  scrypt:{n}:{r}:{p}  {ms:.0f} ms  {128 * n * r // 2 ** 20} MiB")
+        if ms > target_ms:
+            p -= 1
+            ms = ms * p / (p + 1)
+            break
+    return f"scrypt:{n}:{r}:{p}", ms
+
+
+def write_hash_method(method):
+    # stores the method in app/config.json (other keys are kept); PASSWORD_HASH_METHOD in the environment still wins
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    data["PASSWORD_HASH_METHOD"] = method
+    tmp = CONFIG_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, CONFIG_FILE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Password hashing maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="pick scrypt parameters that meet a verification latency target on this host")
+    cal.add_argument("--target-ms", type=float, default=Config.PASSWORD_TARGET_MS, help="verification time to aim for")
+    cal.add_argument("--max-memory-mb", type=int, default=Config.PASSWORD_MAX_MEMORY_MB, help="memory per hash")
+    cal.add_argument("--write", action="store_true", help="store the result as PASSWORD_HASH_METHOD in config.json")
+    args = parser.parse_args(argv)
+
+    print(f"Calibrating for {args.target_ms:.0f} ms and at most {args.max_memory_mb} MiB per hash:")
+    method, ms = calibrate(args.target_ms, args.max_memory_mb)
+    print(f"Selected {method} (~{ms:.0f} ms per verification, current: {Config.PASSWORD_HASH_METHOD})")
+    if args.write:
+        write_hash_method(method)
+        print(f"Written to {CONFIG_FILE}; existing hashes are upgraded as their users log in.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# app/rekey.py
+# online key rotation / format migration: re-encrypts every encrypted column under the primary key of the ring
+# and the current FIELD_CIPHER, in keyset batches (one short transaction each), throttled, and resumable
+# from a checkpoint file
+# usage (from App/):  python -m app.rekey generate-key
+#                     python -m app.rekey run [--batch N] [--rows-per-second N] [--checkpoint FILE] [--restart]
+#                     python -m app.rekey status [--checkpoint FILE] [--formats]
+#
+# rotating: 1. ENCRYPTION_KEYS="new,old" everywhere and restart the web workers (they now write with the new key
+# and still read the old one)  2. run this job  3. once it finished with 0 failed, drop the old key from the ring
+# converting Fernet values to the compact format is the same job, in two steps because older workers cannot read
+# it: 1. deploy this version everywhere with the default FIELD_CIPHER=fernet  2. once no older worker is left, set
+# FIELD_CIPHER=aead everywhere, restart, then `run` (before downgrading again: FIELD_CIPHER=fernet and `run`)
+# the blind indexes (app.blind_index) do not depend on the encryption keys, search keeps working throughout
+import argparse
+import json
+import os
+import sys
+import time
+
+from cryptography.fernet import Fernet
+from mysql.connector import Error
+
+from . import crypto_utils
+from .audit import audit
+from .config import Config
+from .db import get_db_connection
+
+# table -> encrypted columns, walked in this order
+TARGETS = (
+    ("users", ("full_name", "email")),
+    ("appointments", ("details",)),
+)
+
+
+def rotate_if_needed(ciphertext):
+    # the default transform: the new ciphertext, or None when the value is already in the target format and key
+    if not crypto_utils.needs_rotation(ciphertext):
+        return None
+    return crypto_utils.rotate_value(ciphertext)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    # written after every committed batch; replace() keeps a crash from leaving half a file behind
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def _new_state(target):
+    return {
+        "target": target,
+        "table_index": 0,
+        "last_id": 0,
+        "rewritten": 0,
+        "current": 0,
+        "changed_meanwhile": 0,
+        "failed": 0,
+        "finished": False,
+    }
+
+
+class Throttle:
+    # keeps the long-run average at or below rows_per_second by sleeping after each batch (0 = off)
+
+    def __init__(self, rows_per_second):
+        self.rows_per_second = rows_per_second
+        self.started = time.monotonic()
+        self.rows = 0
+
+    def after(self, rows):
+        self.rows += rows
+        if self.rows_per_second <= 0:
+            return
+        ahead = self.rows / self.rows_per_second - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _rekey_batch(conn, table, columns, last_id, batch, transform, state):
+    # one keyset batch in one transaction; returns the last id seen, or None when the table is done
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, batch),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        for column in columns:
+            values = [r[column] for r in rows if r[column] is not None]
+            new_values = iter(crypto_utils.transform_many(transform, values))
+            updates = []
+            for row in rows:
+                if row[column] is None:
+                    continue
+                new_value = next(new_values)
+                if new_value is crypto_utils.CRYPTO_FAILED:
+                    state["failed"] += 1
+                elif new_value is None:
+                    state["current"] += 1
+                else:
+                    updates.append((new_value, row["id"], row[column]))
+            # compare-and-swap instead of row locks: a value the app changed since the SELECT is left alone
+            # (the app wrote it under the primary key already)
+            for params in updates:
+                cursor.execute(f"UPDATE {table} SET {column} = %s WHERE id = %s AND {column} = %s", params)
+                if cursor.rowcount:
+                    state["rewritten"] += 1
+                else:
+                    state["changed_meanwhile"] += 1
+
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return rows[-1]["id"]
+
+
+def rekey(batch=None, rows_per_second=None, checkpoint=None, restart=False, transform=None, target=None,
+          progress=print):
+    # walks TARGETS and rewrites every value `transform` returns a new ciphertext for (None = leave as is,
+    # raising = counted as failed); `target` names the goal in the checkpoint -- a checkpoint for another
+    # goal (e.g. an older primary key) is not resumed
+    batch = batch or Config.REKEY_BATCH_ROWS
+    rows_per_second = Config.REKEY_ROWS_PER_SECOND if rows_per_second is None else rows_per_second
+    checkpoint = checkpoint or Config.REKEY_CHECKPOINT
+    transform = transform or rotate_if_needed
+    target = target or f"{Config.FIELD_CIPHER}:{crypto_utils.key_fingerprint(crypto_utils.key)}"
+
+    state = None if restart else load_checkpoint(checkpoint)
+    if state is not None and state.get("target") != target:
+        progress(f"Checkpoint {checkpoint} is for {state.get('target')}, starting over for {target}")
+        state = None
+    if state is None:
+        state = _new_state(target)
+    elif state["finished"]:
+        progress(f"Re-encryption for {target} already finished (use --restart to run it again)")
+        return state
+    else:
+        progress(f"Resuming {TARGETS[state['table_index']][0]} after id {state['last_id']}")
+
+    audit(f"Re-encryption started for {target}", action="crypto.rekey", target=target)
+    throttle = Throttle(rows_per_second)
+    conn = get_db_connection()
+    try:
+        while state["table_index"] < len(TARGETS):
+            table, columns = TARGETS[state["table_index"]]
+            last_id = _rekey_batch(conn, table, columns, state["last_id"], batch, transform, state)
+            if last_id is None:
+                state["table_index"] += 1
+                state["last_id"] = 0
+            else:
+                state["last_id"] = last_id
+            save_checkpoint(checkpoint, state)
+            if last_id is not None:
+                progress(
+                    f"  {table} up to id {last_id}: {state['rewritten']} rewritten, {state['current']} already "
+                    f"current, {state['failed']} failed"
+                )
+                throttle.after(batch)
+    finally:
+        conn.close()
+
+    state["finished"] = True
+    save_checkpoint(checkpoint, state)
+    # cached plaintexts are still valid, but nothing in this process needs them any more
+    crypto_utils.decrypt_cache.clear()
+    audit(
+        f"Re-encryption finished for {target}: {state['rewritten']} values rewritten, "
+        f"{state['failed']} could not be decrypted",
+        action="crypto.rekey",
+        target=target,
+    )
+    progress(
+        f"Finished: {state['rewritten']} rewritten, {state['current']} already current, "
+        f"{state['changed_meanwhile']} changed meanwhile, {state['failed']} failed"
+    )
+    return state
+
+
+def format_survey(conn):
+    # per encrypted column: how many values are in each format and their average stored length
+    cursor = conn.cursor()
+    survey = []
+    try:
+        for table, columns in TARGETS:
+            for column in columns:
+                cursor.execute(
+                    f"SELECT SUM(CASE WHEN {column} LIKE %s THEN 1 ELSE 0 END), "
+                    f"AVG(CASE WHEN {column} LIKE %s THEN LENGTH({column}) END), "
+                    f"SUM(CASE WHEN {column} NOT LIKE %s THEN 1 ELSE 0 END), "
+                    f"AVG(CASE WHEN {column} NOT LIKE %s THEN LENGTH({column}) END) "
+                    f"FROM {table} WHERE {column} IS NOT NULL",
+                    (crypto_utils.AEAD_PREFIX + "%",) * 4,
+                )
+                aead, aead_len, other, other_len = cursor.fetchone()
+                survey.append((f"{table}.{column}", int(aead or 0), aead_len, int(other or 0), other_len))
+    finally:
+        cursor.close()
+    return survey
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encryption key rotation.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("generate-key", help="print a new key to put first in ENCRYPTION_KEYS")
+    run = sub.add_parser("run", help="re-encrypt all values under the primary key (resumes from the checkpoint)")
+    run.add_argument("--batch", type=int, help="rows per batch/transaction")
+    run.add_argument("--rows-per-second", type=float, help="throughput cap (0 = unthrottled)")
+    run.add_argument("--checkpoint", help="progress file")
+    run.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    st = sub.add_parser("status", help="show the key ring and the checkpoint")
+    st.add_argument("--checkpoint", help="progress file")
+    st.add_argument("--formats", action="store_true", help="count stored values per format (scans the tables)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate-key":
+        print(Fernet.generate_key().decode())
+        return 0
+
+    if args.command == "status":
+        for i, k in enumerate(crypto_utils.keys):
+            print(f"  key {crypto_utils.key_fingerprint(k)}{'  (primary)' if i == 0 else ''}")
+        path = args.checkpoint or Config.REKEY_CHECKPOINT
+        state = load_checkpoint(path)
+        print(json.dumps(state, indent=2) if state else f"No checkpoint at {path}")
+        if args.formats:
+            conn = get_db_connection()
+            try:
+                for name, aead, aead_len, other, other_len in format_survey(conn):
+                    print(
+                        f"  {name:<20} aead {aead} (avg {float(aead_len or 0):.0f} chars)  "
+                        f"fernet {other} (avg {float(other_len or 0):.0f} chars)"
+                    )
+            finally:
+                conn.close()
+        return 0
+
+    try:
+        state = rekey(args.batch, args.rows_per_second, args.checkpoint, args.restart)
+    except KeyboardInterrupt:
+        print("Interrupted -- run again to resume from the last committed batch")
+        return 130
+    return 1 if state["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
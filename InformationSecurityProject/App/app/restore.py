@@ -0,0 +1,288 @@
+# app/restore.py
+# bulk restore for admin backups: streams a backup file and loads it with multi-row inserts in chunked transactions
+# usage (from App/):  python -m app.restore backups/backup_20251217_102738.ndjson.gz [--batch-rows N] [--commit-rows N]
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from .appointment_summary import ensure_summary_schema, rebuild as rebuild_summary
+from .backup import BACKUP_FORMAT, BACKUP_TABLES, backup_chain, canonical_row, open_backup_file
+from .blind_index import backfill as backfill_blind_indexes, ensure_blind_index_schema
+from .config import Config
+from .db import get_db_connection
+
+
+class RestoreError(Exception):
+    pass
+
+
+class Restorer:
+    # buffers rows per (table, columns) and writes them as multi-row INSERTs, committing every commit_rows rows
+
+    def __init__(self, conn, batch_rows=1000, commit_rows=20000, upsert=False, report_every=50000):
+        self.conn = conn
+        self.batch_rows = batch_rows
+        self.commit_rows = commit_rows
+        self.upsert = upsert
+        self.report_every = report_every
+        self.cursor = conn.cursor()
+        self._rows = {}
+        self._deletes = {}
+        self._uncommitted = 0
+        self._last_report = 0
+        self.started = time.monotonic()
+        self.inserted = {}
+        self.deleted = {}
+
+    def _insert_sql(self, table, columns, n):
+        cols = ", ".join(columns)
+        row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        sql = f"INSERT INTO {table} ({cols}) VALUES " + ", ".join([row] * n)
+        if not self.upsert:
+            return sql
+        if Config.DB_BACKEND == "sqlite":
+            return sql.replace("INSERT INTO", "INSERT OR REPLACE INTO", 1)
+        updates = ", ".join(f"{c} = VALUES({c})" for c in columns if c != "id")
+        return f"{sql} ON DUPLICATE KEY UPDATE {updates}"
+
+    def _flush_rows(self, key):
+        table, columns = key
+        rows = self._rows.pop(key)
+        params = [value for row in rows for value in row]
+        self.cursor.execute(self._insert_sql(table, columns, len(rows)), params)
+        self.inserted[table] = self.inserted.get(table, 0) + len(rows)
+        self._uncommitted += len(rows)
+
+    def _flush_deletes(self, table):
+        ids = self._deletes.pop(table)
+        self.cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        self.deleted[table] = self.deleted.get(table, 0) + len(ids)
+        self._uncommitted += len(ids)
+
+    def _maybe_commit(self):
+        if self._uncommitted >= self.commit_rows:
+            self.conn.commit()
+            self._uncommitted = 0
+        done = sum(self.inserted.values()) + sum(self.deleted.values())
+        if self.report_every and done - self._last_report >= self.report_every:
+            self._last_report = done
+            elapsed = time.monotonic() - self.started
+            print(f"  {done} rows applied ({done / elapsed:.0f} rows/s)", flush=True)
+
+    def add_row(self, table, row):
+        if table not in BACKUP_TABLES:
+            raise RestoreError(f"unexpected table {table!r} in backup")
+        key = (table, tuple(row))
+        self._rows.setdefault(key, []).append(tuple(row.values()))
+        if len(self._rows[key]) >= self.batch_rows:
+            self._flush_rows(key)
+            self._maybe_commit()
+
+    def add_delete(self, table, row_id):
+        # deletes are only applied after every buffered row of the file has been written
+        for key in list(self._rows):
+            self._flush_rows(key)
+        self._deletes.setdefault(table, []).append(row_id)
+        if len(self._deletes[table]) >= self.batch_rows:
+            self._flush_deletes(table)
+            self._maybe_commit()
+
+    def flush(self):
+        for key in list(self._rows):
+            self._flush_rows(key)
+        for table in list(self._deletes):
+            self._flush_deletes(table)
+        self._maybe_commit()
+
+    def finish(self):
+        self.flush()
+        self.conn.commit()
+        self.cursor.close()
+
+
+# --- readers ---------------------------------------------------------------------
+# each yields ("header", dict), ("row", table, row), ("delete", table, id) and ("footer", dict) events
+
+def _read_ndjson(path):
+    with open_backup_file(path) as f:
+        for line in f:
+            rec = json.loads(line)
+            kind = rec["type"]
+            if kind == "row":
+                yield "row", rec["table"], rec["data"]
+            elif kind == "delete":
+                yield "delete", rec["table"], rec["id"]
+            else:
+                yield kind, rec
+
+
+def _read_legacy_json(path):
+    # backup_*.json from the old perform_backup_sql / mock perform_backup: one JSON document,
+    # so it has to be parsed in one go (these predate the streaming format and are small)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    yield "header", {"kind": "full", "format": "legacy-json"}
+
+    users = data.get("users", [])
+    if isinstance(users, dict):
+        # mock_db layout: {username: {id, username, password_hash, role, personal: {full_name, email}}}
+        users = [
+            {
+                "id": u["id"],
+                "username": u["username"],
+                "password": u["password_hash"],
+                "role": u["role"],
+                "full_name": u["personal"]["full_name"],
+                "email": u["personal"]["email"],
+            }
+            for u in users.values()
+        ]
+    for row in users:
+        yield "row", "users", row
+    for row in data.get("appointments", []):
+        yield "row", "appointments", row
+
+
+def read_backup(path):
+    if path.endswith(".json"):
+        return _read_legacy_json(path)
+    return _read_ndjson(path)
+
+
+# --- restore ---------------------------------------------------------------------
+
+def _set_checks(cursor, enabled):
+    # constraint and uniqueness checks are deferred while loading (MySQL) -- the data came out of a consistent DB
+    if Config.DB_BACKEND == "mysql":
+        flag = 1 if enabled else 0
+        cursor.execute(f"SET SESSION foreign_key_checks = {flag}, unique_checks = {flag}")
+
+
+def _clear_tables(conn):
+    # the name tokens go too: TRUNCATE with foreign_key_checks=0 does not cascade, and the sqlite stand-in
+    # has no foreign key -- stale tokens would point searches at ids and names from before the restore
+    ensure_blind_index_schema(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM user_name_tokens")
+        for table in reversed(BACKUP_TABLES):
+            cursor.execute(f"DELETE FROM {table}" if Config.DB_BACKEND == "sqlite" else f"TRUNCATE TABLE {table}")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def table_checksum(conn, table):
+    # (row count, sha256) of a table computed exactly like the backup footer, streamed in id order
+    digest = hashlib.sha256()
+    count = 0
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(f"SELECT * FROM {table} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(Config.BACKUP_CHUNK_ROWS)
+            if not rows:
+                break
+            for row in rows:
+                digest.update(canonical_row(row).encode("utf-8") + b"\n")
+            count += len(rows)
+    finally:
+        cursor.close()
+    return count, digest.hexdigest()
+
+
+def restore_file(conn, path, batch_rows, commit_rows, replace):
+    # applies one backup file, returns (header, footer, restorer)
+    header = footer = None
+    restorer = Restorer(conn, batch_rows=batch_rows, commit_rows=commit_rows, upsert=not replace)
+    for event in read_backup(path):
+        kind = event[0]
+        if kind == "row":
+            restorer.add_row(event[1], event[2])
+        elif kind == "delete":
+            restorer.add_delete(event[1], event[2])
+        elif kind == "header":
+            header = event[1]
+            if header.get("format") not in (BACKUP_FORMAT, "legacy-json"):
+                raise RestoreError(f"{path}: unsupported backup format {header.get('format')!r}")
+        elif kind == "footer":
+            footer = event[1]
+    restorer.finish()
+
+    if footer is not None:
+        for table, expected in footer["tables"].items():
+            got = restorer.inserted.get(table, 0)
+            if got != expected.get("rows", 0):
+                raise RestoreError(f"{path}: {table} has {expected['rows']} rows in the footer but {got} were loaded")
+    return header, footer, restorer
+
+
+def restore(path, batch_rows=None, commit_rows=None):
+    batch_rows = batch_rows or Config.RESTORE_BATCH_ROWS
+    commit_rows = commit_rows or Config.RESTORE_COMMIT_ROWS
+
+    # an incremental backup is restored as its base snapshot followed by every delta up to it
+    files = [path]
+    first = next(iter(read_backup(path)))
+    if first[0] == "header" and first[1].get("kind") == "incremental":
+        files = [os.path.join(Config.BACKUP_DIR, e["file"]) for e in backup_chain(os.path.basename(path))]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    started = time.monotonic()
+    try:
+        _set_checks(cursor, False)
+        last_footer = None
+        for i, file in enumerate(files):
+            replace = i == 0
+            print(f"Restoring {file} ({'base snapshot' if replace else 'delta'})", flush=True)
+            if replace:
+                _clear_tables(conn)
+            header, footer, restorer = restore_file(conn, file, batch_rows, commit_rows, replace=replace)
+            last_footer = footer
+            for table in BACKUP_TABLES:
+                print(f"  {table}: {restorer.inserted.get(table, 0)} rows, {restorer.deleted.get(table, 0)} deletes", flush=True)
+    finally:
+        _set_checks(cursor, True)
+        cursor.close()
+
+    try:
+        # end-to-end check: the tables must now hash to what the snapshot recorded
+        if len(files) == 1 and last_footer is not None:
+            for table, expected in last_footer["tables"].items():
+                count, checksum = table_checksum(conn, table)
+                if count != expected["rows"] or checksum != expected["sha256"]:
+                    raise RestoreError(f"{table}: restored data does not match the backup checksum ({count} rows)")
+                print(f"  {table}: {count} rows, checksum OK", flush=True)
+
+        # derived data is not part of the backup -- recompute it from the restored rows
+        ensure_summary_schema(conn)
+        rebuild_summary(conn)
+        print("  appointment summary rebuilt", flush=True)
+        indexed, skipped = backfill_blind_indexes(rebuild=True, progress=lambda message: None)
+        print(f"  blind indexes rebuilt: {indexed} users, {skipped} undecryptable", flush=True)
+    finally:
+        conn.close()
+    print(f"Restore finished in {time.monotonic() - started:.1f}s", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Restore an admin backup into the database.")
+    parser.add_argument("path", help="backup file (.ndjson[.gz|.zst] or legacy .json)")
+    parser.add_argument("--batch-rows", type=int, help="rows per multi-row INSERT")
+    parser.add_argument("--commit-rows", type=int, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    try:
+        restore(args.path, batch_rows=args.batch_rows, commit_rows=args.commit_rows)
+    except RestoreError as e:
+        print(f"FAILED: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,71 +1,72 @@
-import json
-import logging
-import os
-from datetime import datetime
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from functools import partial
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from mysql.connector import Error
-from werkzeug.security import generate_password_hash
 
 # import your security/audit helpers
-from ..security import roles_required, get_current_user
-from ..audit import audit
-from ..config import Config
+from ..security import roles_required, get_current_user, invalidate_user, identity_cache, revoke_user_sessions
+from ..session_store import session_stats
+from ..audit import audit, audit_stats
+from ..passwords import hash_password, password_stats
+from ..backup import start_backup_job, current_backup_job, perform_backup_sql, record_deletions
+from ..appointment_summary import monthly_report, subtract_appointments
+from ..user_import import provision_users_file, detect_format
+from ..appointment_import import check_upload_size, get_import_job, latest_import_job, spool_upload, start_import_job
+from ..blind_index import index_user, unindex_user, search_user_ids
 
 # import the DB connection helper
-from ..db import get_db_connection
+from ..db import get_db, pool_stats
 
 # import encryption/decryption functions
-from ..crypto_utils import encrypt_value, decrypt_value
+from ..crypto_utils import encrypt_value, decrypt_many, decrypt_cache, CRYPTO_FAILED
+from ..config import Config
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
+# shared with migrate.hot_queries(), which EXPLAINs them
+_USER_COLUMNS = "id, username, full_name, email, role"
+USERS_PAGE_NEXT_SQL = f"SELECT {_USER_COLUMNS} FROM users WHERE id > %s ORDER BY id ASC LIMIT %s"
+USERS_PAGE_PREV_SQL = f"SELECT {_USER_COLUMNS} FROM users WHERE id < %s ORDER BY id DESC LIMIT %s"
+# {placeholders}: one %s per id
+USERS_BY_IDS_SQL = f"SELECT {_USER_COLUMNS} FROM users WHERE id IN ({{placeholders}}) ORDER BY id"
+USER_UPDATE_SQL = """
+    UPDATE users
+    SET full_name = %s, email = %s, role = %s
+    WHERE id = %s
+"""
+USER_DELETE_SQL = "DELETE FROM users WHERE id = %s"
+
 def count_appointments_per_month_sql():
-    # generates the report using SQL aggregation
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    # generates the report from the monthly summary table (kept current by the appointment routes)
+    conn = get_db()
+    cursor = conn.cursor()
     try:
-        query = """
-            SELECT DATE_FORMAT(date, '%Y-%m') as month, COUNT(*) as count 
-            FROM appointments 
-            GROUP BY month 
-            ORDER BY month DESC
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
-        return {row['month']: row['count'] for row in results}
+        return monthly_report(cursor)
     finally:
         cursor.close()
-        conn.close()
-
-def perform_backup_sql():
-    # dumps SQL tables to a JSON file (Data remains ENCRYPTED/HASHED)
-    backup_dir = Config.BACKUP_DIR
-    os.makedirs(backup_dir, exist_ok=True)
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    path = os.path.join(backup_dir, f"backup_{timestamp}.json")
 
-    conn = get_db_connection()
+def fetch_users_page(after=None, before=None, limit=50):
+    # keyset pagination on the primary key: one index range scan of limit+1 rows, whatever the page number
+    # returns (rows, prev_cursor, next_cursor) -- a cursor is the id to continue from, None at either end
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
-    
     try:
-        cursor.execute("SELECT * FROM users")
-        users = cursor.fetchall()
-        
-        cursor.execute("SELECT * FROM appointments")
-        appointments = cursor.fetchall()
-        
-        data = {
-            "users": users,
-            "appointments": appointments,
-        }
-
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, default=str)
-            
-        return path
+        if before is not None:
+            cursor.execute(USERS_PAGE_PREV_SQL, (before, limit + 1))
+            rows = cursor.fetchall()
+            has_prev, has_next = len(rows) > limit, True
+            rows = rows[:limit][::-1]
+        else:
+            cursor.execute(USERS_PAGE_NEXT_SQL, (after or 0, limit + 1))
+            rows = cursor.fetchall()
+            has_prev, has_next = after is not None, len(rows) > limit
+            rows = rows[:limit]
     finally:
         cursor.close()
-        conn.close()
+
+    if not rows:
+        return rows, None, None
+    return rows, rows[0]["id"] if has_prev else None, rows[-1]["id"] if has_next else None
+
 
 @admin_bp.route("/")
 @roles_required("admin")
@@ -76,37 +77,44 @@ def admin_dashboard():
     # get report
     report = count_appointments_per_month_sql()
     
-    # get all users
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    # one page of users -- ?after=<id> / ?before=<id> move through the list
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int)
+    page_size = max(1, min(request.args.get("per_page", Config.ADMIN_PAGE_SIZE, type=int), 500))
+
     users_list = []
+    prev_cursor = next_cursor = None
     try:
-        cursor.execute("SELECT * FROM users ORDER BY id ASC")
-        raw_users = cursor.fetchall()
+        raw_users, prev_cursor, next_cursor = fetch_users_page(after, before, page_size)
         
-        # decryption logic for display
-        for u in raw_users:
-            try:
-                u['full_name'] = decrypt_value(u['full_name'])
-                u['email'] = decrypt_value(u['email'])
-            except Exception as e:
+        # decryption logic for display -- only the rows on this page, both columns in one batch
+        names = decrypt_many([u['full_name'] for u in raw_users])
+        emails = decrypt_many([u['email'] for u in raw_users])
+        for u, full_name, email in zip(raw_users, names, emails):
+            if full_name is CRYPTO_FAILED or email is CRYPTO_FAILED:
                 u['full_name'] = "[Decryption Error]"
                 u['email'] = "[Decryption Error]"
+            else:
+                u['full_name'] = full_name
+                u['email'] = email
             
             users_list.append(u)
 
     except Error as e:
         audit(f"Error fetching users: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
-    audit(f"Admin {user['username']} accessed admin dashboard")
-    
+    audit(f"Admin {user['username']} accessed admin dashboard", action="dashboard.view", target="admin")
+
+    import_job = latest_import_job(user["id"], "user")
     return render_template(
         "admin_dashboard.html", 
         report=report, 
-        users=users_list
+        users=users_list,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+        per_page=page_size,
+        backup_job=current_backup_job(),
+        import_job=import_job.to_dict() if import_job else None,
     )
 
 
@@ -130,13 +138,13 @@ def create_user():
         enc_email = encrypt_value(email)
         
         # hash password (irreversible - Standard Security Practice)
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         
     except Exception as e:
         audit(f"Security processing failed: {e}")
         return redirect(url_for("admin.admin_dashboard"))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         query = """
@@ -145,19 +153,65 @@ def create_user():
         """
         # Insert Hashed Password and Encrypted Fields
         cursor.execute(query, (username, hashed_password, enc_full_name, enc_email, role))
+        index_user(cursor, cursor.lastrowid, full_name, email)
         conn.commit()
         
-        audit(f"Admin created user: {username} (Role: {role})")
+        audit(f"Admin created user: {username} (Role: {role})", action="user.create", target=username)
         flash(f"User {username} created successfully.", "success")
     except Error as e:
+        conn.rollback()
         flash(f"Error creating user: {e}", "danger")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("admin.admin_dashboard"))
 
 
+@admin_bp.route("/user/import", methods=["POST"])
+@roles_required("admin")
+def import_users():
+    # bulk provisioning from an uploaded CSV / JSON-lines file (username, password, full_name, email, role) --
+    # the request only spools the file, hashing runs in the background (progress: /user/import/<job id>)
+    user = get_current_user()
+    as_json = request.args.get("format") == "json"
+    try:
+        # checked before the form is parsed, werkzeug would otherwise receive the whole upload first
+        check_upload_size(request.content_length)
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV or JSONL file to import.", "warning")
+            return redirect(url_for("admin.admin_dashboard"))
+        path = spool_upload(upload.stream)
+    except ValueError as e:
+        if as_json:
+            return jsonify({"error": str(e)}), 413
+        flash(f"Import refused: {e}.", "danger")
+        return redirect(url_for("admin.admin_dashboard"))
+
+    job, started = start_import_job(
+        user["id"], "user", partial(provision_users_file, fmt=detect_format(upload.filename)), path
+    )
+    if as_json:
+        status_url = url_for("admin.import_users_status", job_id=job.id)
+        return jsonify(dict(job.to_dict(), status_url=status_url)), 202 if started else 409
+
+    if started:
+        audit(f"User import job {job.id} started", action="user.import_start", target=job.id)
+        flash("User import started in the background -- its progress is shown below the import form.", "success")
+    else:
+        flash(f"A user import is already running ({job.to_dict()['read']} rows read so far).", "warning")
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/user/import/<job_id>")
+@roles_required("admin")
+def import_users_status(job_id):
+    job = get_import_job(job_id)
+    if job is None or job.kind != "user" or job.owner != get_current_user()["id"]:
+        return jsonify({"error": "no such import job"}), 404
+    return jsonify(job.to_dict())
+
+
 @admin_bp.route("/user/update/<int:user_id>", methods=["POST"])
 @roles_required("admin")
 def update_user(user_id):
@@ -173,24 +227,31 @@ def update_user(user_id):
         audit(f"Encryption failed: {e}")
         return redirect(url_for("admin.admin_dashboard"))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
-        query = """
-            UPDATE users 
-            SET full_name = %s, email = %s, role = %s 
-            WHERE id = %s
-        """
-        cursor.execute(query, (enc_full_name, enc_email, role, user_id))
+        cursor.execute("SELECT username, role FROM users WHERE id = %s", (user_id,))
+        before = cursor.fetchone()
+        if not before:
+            flash("User not found.", "danger")
+            return redirect(url_for("admin.admin_dashboard"))
+
+        cursor.execute(USER_UPDATE_SQL, (enc_full_name, enc_email, role, user_id))
+        index_user(cursor, user_id, full_name, email)
         conn.commit()
+        invalidate_user(user_id)
+        if before[1] != role:
+            # identity caches are per process -- revoking the sessions is what reaches every worker and host,
+            # so the old role cannot outlive IDENTITY_CACHE_TTL anywhere
+            revoke_user_sessions(before[0])
         
-        audit(f"Admin updated user ID: {user_id}")
+        audit(f"Admin updated user ID: {user_id}", action="user.update", target=f"user:{user_id}")
         flash("User updated successfully.", "success")
     except Error as e:
+        conn.rollback()
         audit(f"Error updating user: {e}")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("admin.admin_dashboard"))
 
@@ -204,32 +265,107 @@ def delete_user(user_id):
         flash("You cannot delete your own account.", "danger")
         return redirect(url_for("admin.admin_dashboard"))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
-        query = "DELETE FROM users WHERE id = %s"
-        cursor.execute(query, (user_id,))
+        # tombstones for incremental backups -- the user's appointments go with them (FK cascade)
+        record_deletions(cursor, "appointments", "patient_id = %s OR medic_id = %s", (user_id, user_id))
+        subtract_appointments(cursor, "patient_id = %s OR medic_id = %s", (user_id, user_id))
+        record_deletions(cursor, "users", "id = %s", (user_id,))
+        unindex_user(cursor, user_id)
+
+        cursor.execute("SELECT username FROM users WHERE id = %s", (user_id,))
+        row = cursor.fetchone()
+
+        cursor.execute(USER_DELETE_SQL, (user_id,))
         conn.commit()
+        invalidate_user(user_id)
+        if row:
+            # log the deleted user out of every open session
+            revoke_user_sessions(row[0])
         
-        audit(f"Admin deleted user ID: {user_id}")
+        audit(f"Admin deleted user ID: {user_id}", action="user.delete", target=f"user:{user_id}")
         flash("User deleted successfully.", "success")
     except Error as e:
+        conn.rollback()
         flash(f"Error deleting user: {e}", "danger")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("admin.admin_dashboard"))
 
+@admin_bp.route("/search")
+@roles_required("admin")
+def search_users():
+    # exact email or name-token lookup through the blind indexes -- only the matching rows are decrypted
+    query = (request.args.get("q") or "").strip()
+    limit = max(1, min(request.args.get("limit", Config.ADMIN_PAGE_SIZE, type=int), 500))
+    if not query:
+        return jsonify({"error": "missing search query ?q="}), 400
+
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        id_cursor = conn.cursor()
+        try:
+            ids = search_user_ids(id_cursor, query, limit)
+        finally:
+            id_cursor.close()
+        rows = []
+        if ids:
+            cursor.execute(USERS_BY_IDS_SQL.format(placeholders=", ".join(["%s"] * len(ids))), ids)
+            rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    names = decrypt_many([u['full_name'] for u in rows])
+    emails = decrypt_many([u['email'] for u in rows])
+    results = []
+    for u, full_name, email in zip(rows, names, emails):
+        if full_name is CRYPTO_FAILED or email is CRYPTO_FAILED:
+            u['full_name'] = "[Decryption Error]"
+            u['email'] = "[Decryption Error]"
+        else:
+            u['full_name'] = full_name
+            u['email'] = email
+        results.append(u)
+
+    # the search term itself is personal data and stays out of the audit log
+    audit(f"Admin searched users ({len(results)} matches)", action="user.search", target="users")
+    return jsonify({"count": len(results), "users": results})
+
+
 @admin_bp.route("/backup")
 @roles_required("admin")
 def admin_backup():
-    try:
-        path = perform_backup_sql()
-        audit(f"Backup Created at {path}")
-        flash(f"Backup created successfully at {path}", "success")
-    except Exception as e:
-        flash(f"Backup failed: {e}", "danger")
-        logging.error(f"Backup failed: {e}")
+    # the dump runs on a background thread -- the request only kicks it off
+    incremental = request.args.get("mode") == "incremental"
+    job, started = start_backup_job(partial(perform_backup_sql, incremental=incremental))
+    if started:
+        mode = "Incremental" if incremental else "Full"
+        audit(f"{mode} backup job {job.id} started", action="backup.start", target=job.id)
+        flash(f"{mode} backup started in the background.", "success")
+    else:
+        flash(f"A backup is already running ({job.percent}% of {job.table or 'startup'}).", "warning")
         
-    return redirect(url_for("admin.admin_dashboard"))
\ No newline at end of file
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/backup/status")
+@roles_required("admin")
+def admin_backup_status():
+    job = current_backup_job()
+    return jsonify(job.to_dict() if job else {"state": "idle"})
+
+@admin_bp.route("/stats")
+@roles_required("admin")
+def admin_stats():
+    # runtime counters for monitoring (no personal data in here)
+    return jsonify({
+        "db_pool": pool_stats(),
+        "identity_cache": identity_cache.stats(),
+        "sessions": session_stats(),
+        "decrypt_cache": decrypt_cache.stats(),
+        "audit": audit_stats(),
+        "password_verifier": password_stats(),
+    })
@@ -4,18 +4,23 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 import mysql.connector
 from mysql.connector import Error
 
-# import hashing verification
-from werkzeug.security import check_password_hash
+# import hashing verification (runs in the password worker pool)
+from ..passwords import verify_and_rehash, VerifierBusy
 
 # import decryption logic
 from ..crypto_utils import decrypt_value
 
-from ..security import create_session, clear_session, get_current_user
+from ..security import create_session, clear_session, get_current_user, invalidate_user
 from ..audit import audit
-from ..db import get_db_connection 
+from ..db import get_db
 
 auth_bp = Blueprint("auth", __name__)
 
+# shared with migrate.hot_queries(), which EXPLAINs them
+LOGIN_SQL = "SELECT * FROM users WHERE username = %s"
+# the WHERE on the old hash keeps a concurrent password change from being overwritten
+REHASH_SQL = "UPDATE users SET password = %s WHERE id = %s AND password = %s"
+
 @auth_bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -28,13 +33,12 @@ def login():
             audit(f"Invalid username format attempt: {username}")
             return render_template("login.html")
 
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         
         try:
             # fetch user from MySQL
-            query = "SELECT * FROM users WHERE username = %s"
-            cursor.execute(query, (username,))
+            cursor.execute(LOGIN_SQL, (username,))
             user = cursor.fetchone()
 
             # verify credentials
@@ -42,11 +46,17 @@ def login():
             
             if user:
                 # assume the database now contains HASHED passwords (created by Admin)
-                if user["password"] and check_password_hash(user["password"], password):
-                    authenticated = True
+                if user["password"]:
+                    authenticated, new_hash = verify_and_rehash(user["password"], password)
+                    if authenticated and new_hash:
+                        # hash made with older parameters -- upgrade it now that we know the password
+                        cursor.execute(REHASH_SQL, (new_hash, user["id"], user["password"]))
+                        conn.commit()
+                        invalidate_user(user["id"])
+                        audit(f"Password hash of {username} upgraded", action="auth.rehash", target=username)
                 
             if not authenticated:
-                audit(f"Failed login for username={username} from ip={request.remote_addr}")
+                audit(f"Failed login for username={username} from ip={request.remote_addr}", level="WARNING", action="auth.login_failed", target=username)
                 flash("Invalid username or password", "danger")
                 return render_template("login.html")
 
@@ -61,7 +71,7 @@ def login():
             # login success
             create_session(user)
             
-            audit(f"User {user['username']} logged in successfully")
+            audit(f"User {user['username']} logged in successfully", actor=user["username"], action="auth.login", target=user["username"])
             
             # redirect based on role
             if user["role"] == "medic":
@@ -73,6 +83,12 @@ def login():
             
             return redirect(url_for("main.index"))
 
+        except VerifierBusy as e:
+            # shed load instead of queueing: the pool is saturated and waiting would only make it worse
+            audit(f"Login for {username} rejected, {e}", level="WARNING", action="auth.login_busy", target=username)
+            flash("The server is busy, please try again in a moment.", "warning")
+            return render_template("login.html"), 503, {"Retry-After": "1"}
+
         except Error as e:
             audit(f"Database error during login: {e}")
             flash("System error. Please try again later.", "danger")
@@ -80,7 +96,6 @@ def login():
         
         finally:
             cursor.close()
-            conn.close()
 
     return render_template("login.html")
 
@@ -89,7 +104,7 @@ def login():
 def logout():
     user = get_current_user()
     if user:
-        audit(f"User {user['username']} logged out")
+        audit(f"User {user['username']} logged out", action="auth.logout", target=user["username"])
     
     clear_session()
     flash("You have been logged out.", "info")
@@ -1,94 +1,84 @@
 import logging
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from functools import partial
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 import mysql.connector
 from mysql.connector import Error
 
 from ..security import roles_required, get_current_user
 from ..audit import audit
-from ..db import get_db_connection 
+from ..db import get_db
+from ..backup import record_deletions
+from ..appointment_summary import bump, month_of, for_update
+from ..appointment_import import (
+    check_upload_size, get_import_job, import_appointments_file, latest_import_job, spool_upload, start_import_job,
+)
 
 # import encryption and decryption logic
-from ..crypto_utils import encrypt_value, decrypt_value
+from ..crypto_utils import encrypt_value, decrypt_many, CRYPTO_FAILED
 
 medic_bp = Blueprint("medic", __name__, url_prefix="/medic")
 
-def fetch_assigned_patients(medic_id):
-    # fetch patients who have had appointments with this medic -- decrypts personal data (Name/Email) before returning
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # DISTINCT ensures query don't list the same patient multiple times
-        query = """
-            SELECT DISTINCT u.id, u.username, u.full_name, u.email
-            FROM users u
-            JOIN appointments a ON u.id = a.patient_id
-            WHERE a.medic_id = %s AND u.role = 'patient'
-        """ 
-        cursor.execute(query, (medic_id,))
-        patients = cursor.fetchall()
-
-        # decryption loop (Patient Data)
-        for p in patients:
-            try:
-                p['full_name'] = decrypt_value(p['full_name'])
-                p['email'] = decrypt_value(p['email'])
-            except Exception as e:
-                audit(f"Failed to decrypt patient {p['id']}: {e}")
-                p['full_name'] = "[Decryption Error]"
-                p['email'] = "[Decryption Error]"
-
-        return patients
-    finally:
-        cursor.close()
-        conn.close()
+# shared with migrate.hot_queries(), which EXPLAINs them
+DASHBOARD_SQL = """
+    SELECT 'appointment' AS kind, a.id AS id, a.patient_id AS patient_id, a.medic_id AS medic_id,
+           a.date AS date, a.status AS status, a.details AS details,
+           u.username AS username, u.full_name AS full_name, u.email AS email
+    FROM appointments a
+    JOIN users u ON a.patient_id = u.id
+    WHERE a.medic_id = %s AND a.status = 'scheduled'
+    UNION ALL
+    SELECT DISTINCT 'patient' AS kind, u.id, u.id, NULL, NULL, NULL, NULL,
+           u.username, u.full_name, u.email
+    FROM users u
+    JOIN appointments a ON u.id = a.patient_id
+    WHERE a.medic_id = %s AND u.role = 'patient'
+    ORDER BY kind, date, id
+"""
+# the ownership check of update/delete -- the caller appends for_update()
+APPOINTMENT_CHECK_SQL = "SELECT id, date, status FROM appointments WHERE id = %s AND medic_id = %s"
+APPOINTMENT_UPDATE_SQL = """
+    UPDATE appointments
+    SET status = %s, details = %s
+    WHERE id = %s
+"""
+APPOINTMENT_DELETE_SQL = "DELETE FROM appointments WHERE id = %s"
 
-def fetch_appointments(medic_id, status=None):
-    # fetch appointments for the medic, optionally filtered by status -- decrypts the associated patient name AND appointment details
-    conn = get_db_connection()
+def fetch_dashboard_data(medic_id):
+    # patient roster + scheduled appointments in one round trip (UNION ALL tagged by `kind`), with every
+    # distinct patient ciphertext decrypted once and shared by both lists
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     try:
-        if status:
-            query = """
-                SELECT a.*, u.full_name as patient_name 
-                FROM appointments a
-                JOIN users u ON a.patient_id = u.id
-                WHERE a.medic_id = %s AND a.status = %s
-                ORDER BY a.date ASC
-            """
-            cursor.execute(query, (medic_id, status))
-        else:
-            query = """
-                SELECT a.*, u.full_name as patient_name 
-                FROM appointments a
-                JOIN users u ON a.patient_id = u.id
-                WHERE a.medic_id = %s
-                ORDER BY a.date ASC
-            """
-            cursor.execute(query, (medic_id,))
-        
-        appointments = cursor.fetchall()
-
-        # decryption loop
-        for a in appointments:
-            # decrypt patient name
-            try:
-                a['patient_name'] = decrypt_value(a['patient_name'])
-            except Exception as e:
-                a['patient_name'] = "Unknown (Decryption Error)"
-
-            # decrypt details
-            try:
-                if a['details']: 
-                    a['details'] = decrypt_value(a['details'])
-            except Exception as e:
-                # fallback if decryption fails or data wasn't encrypted
-                audit(f"Failed to decrypt details for appt {a['id']}: {e}")
-                a['details'] = "[Encrypted Content]"
-
-        return appointments
+        cursor.execute(DASHBOARD_SQL, (medic_id, medic_id))
+        rows = cursor.fetchall()
     finally:
         cursor.close()
-        conn.close()
+
+    # one batch per column -- a patient's name is the same ciphertext in both lists
+    names = decrypt_many([r['full_name'] for r in rows])
+    emails = decrypt_many([r['email'] if r['kind'] == 'patient' else None for r in rows])
+    details = decrypt_many([r['details'] or None for r in rows])
+
+    patients, appointments = [], []
+    for r, full_name, email, detail in zip(rows, names, emails, details):
+        if r['kind'] == 'patient':
+            if full_name is CRYPTO_FAILED or email is CRYPTO_FAILED:
+                audit(f"Failed to decrypt patient {r['id']}")
+                full_name = email = "[Decryption Error]"
+            patients.append({'id': r['id'], 'username': r['username'], 'full_name': full_name, 'email': email})
+            continue
+
+        appt = {k: r[k] for k in ('id', 'patient_id', 'medic_id', 'date', 'status', 'details')}
+        appt['patient_name'] = "Unknown (Decryption Error)" if full_name is CRYPTO_FAILED else full_name
+        if detail is CRYPTO_FAILED:
+            # fallback if decryption fails or data wasn't encrypted
+            audit(f"Failed to decrypt details for appt {r['id']}")
+            appt['details'] = "[Encrypted Content]"
+        elif detail is not None:
+            appt['details'] = detail
+        appointments.append(appt)
+
+    return patients, appointments
 
 @medic_bp.route("/")
 @roles_required("medic")
@@ -98,15 +88,16 @@ def medic_dashboard():
 
     try:
         # get patients and scheduled appointments
-        assigned_patients = fetch_assigned_patients(medic_id)
-        next_appts = fetch_appointments(medic_id, status="scheduled")
+        assigned_patients, next_appts = fetch_dashboard_data(medic_id)
         
-        audit(f"Medic {user['username']} accessed medic dashboard")
+        audit(f"Medic {user['username']} accessed medic dashboard", action="dashboard.view", target="medic")
         
+        job = latest_import_job(medic_id, "appointment")
         return render_template(
             "medic_dashboard.html",
             patients=assigned_patients,
             appointments=next_appts,
+            import_job=job.to_dict() if job else None,
         )
     except Error as e:
         audit(f"Database error: {e}", "danger")
@@ -134,7 +125,7 @@ def create_appointment():
         audit(f"Encryption failed: {e}", "danger")
         return redirect(url_for("medic.medic_dashboard"))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         # status and date are inserted as plain text
@@ -143,20 +134,66 @@ def create_appointment():
             VALUES (%s, %s, %s, 'scheduled', %s)
         """
         cursor.execute(query, (patient_id, medic_id, date_str, enc_details))
+        bump(cursor, month_of(date_str), "scheduled", medic_id, 1)
         conn.commit()
         
-        audit(f"Medic {user['username']} created appointment for patient ID {patient_id}")
+        audit(f"Medic {user['username']} created appointment for patient ID {patient_id}", action="appointment.create", target=f"patient:{patient_id}")
         flash("Appointment created successfully.", "success")
     except Error as e:
+        conn.rollback()
         flash(f"Error creating appointment: {e}", "danger")
         audit(f"Error creating appointment: {e}")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("medic.medic_dashboard"))
 
 
+@medic_bp.route("/appointment/import", methods=["POST"])
+@roles_required("medic")
+def import_appointments_csv():
+    # bulk import of the medic's own schedule from an uploaded CSV (patient_id, date, status, details) -- the
+    # request only spools the file, the import runs in the background (progress: /appointment/import/<job id>)
+    user = get_current_user()
+    as_json = request.args.get("format") == "json"
+    try:
+        # checked before the form is parsed, werkzeug would otherwise receive the whole upload first
+        check_upload_size(request.content_length)
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV file to import.", "warning")
+            return redirect(url_for("medic.medic_dashboard"))
+        path = spool_upload(upload.stream)
+    except ValueError as e:
+        if as_json:
+            return jsonify({"error": str(e)}), 413
+        flash(f"Import refused: {e}.", "danger")
+        return redirect(url_for("medic.medic_dashboard"))
+
+    job, started = start_import_job(
+        user["id"], "appointment", partial(import_appointments_file, medic_id=user["id"]), path
+    )
+    if as_json:
+        status_url = url_for("medic.import_appointments_status", job_id=job.id)
+        return jsonify(dict(job.to_dict(), status_url=status_url)), 202 if started else 409
+
+    if started:
+        audit(f"Appointment import job {job.id} started", action="appointment.import_start", target=job.id)
+        flash("Import started in the background -- its progress is shown below the import form.", "success")
+    else:
+        flash(f"An import is already running ({job.to_dict()['read']} rows read so far).", "warning")
+    return redirect(url_for("medic.medic_dashboard"))
+
+
+@medic_bp.route("/appointment/import/<job_id>")
+@roles_required("medic")
+def import_appointments_status(job_id):
+    job = get_import_job(job_id)
+    if job is None or job.kind != "appointment" or job.owner != get_current_user()["id"]:
+        return jsonify({"error": "no such import job"}), 404
+    return jsonify(job.to_dict())
+
+
 @medic_bp.route("/appointment/update/<int:appt_id>", methods=["POST"])
 @roles_required("medic")
 def update_appointment(appt_id):
@@ -172,33 +209,32 @@ def update_appointment(appt_id):
         audit(f"Encryption failed: {e}")
         return redirect(url_for("medic.medic_dashboard"))
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
-        # security check
-        check_query = "SELECT id FROM appointments WHERE id = %s AND medic_id = %s"
-        cursor.execute(check_query, (appt_id, user["id"]))
-        if not cursor.fetchone():
+        # security check -- the row stays locked until commit so the summary move below can't race
+        cursor.execute(APPOINTMENT_CHECK_SQL + for_update(), (appt_id, user["id"]))
+        current = cursor.fetchone()
+        if not current:
             flash("Unauthorized: You cannot edit this appointment.", "danger")
             return redirect(url_for("medic.medic_dashboard"))
 
         # ppdate status (plain) and details (encrypted)
-        update_query = """
-            UPDATE appointments 
-            SET status = %s, details = %s 
-            WHERE id = %s
-        """
-        cursor.execute(update_query, (new_status, enc_details, appt_id))
+        cursor.execute(APPOINTMENT_UPDATE_SQL, (new_status, enc_details, appt_id))
+        if (current[2] or "") != (new_status or ""):
+            month = month_of(current[1])
+            bump(cursor, month, current[2], user["id"], -1)
+            bump(cursor, month, new_status, user["id"], 1)
         conn.commit()
         
-        audit(f"Medic {user['username']} updated appointment ID {appt_id}")
+        audit(f"Medic {user['username']} updated appointment ID {appt_id}", action="appointment.update", target=f"appointment:{appt_id}")
         flash("Appointment updated.", "success")
     except Error as e:
+        conn.rollback()
         flash(f"Error updating appointment: {e}", "danger")
         audit(f"Error updating appointment: {e}")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("medic.medic_dashboard"))
 
@@ -209,26 +245,27 @@ def delete_appointment(appt_id):
     # delete remove an appointment
     user = get_current_user()
     
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         # security check
-        check_query = "SELECT id FROM appointments WHERE id = %s AND medic_id = %s"
-        cursor.execute(check_query, (appt_id, user["id"]))
-        if not cursor.fetchone():
+        cursor.execute(APPOINTMENT_CHECK_SQL + for_update(), (appt_id, user["id"]))
+        current = cursor.fetchone()
+        if not current:
             flash("Unauthorized: You cannot delete this appointment.", "danger")
             return redirect(url_for("medic.medic_dashboard"))
 
-        delete_query = "DELETE FROM appointments WHERE id = %s"
-        cursor.execute(delete_query, (appt_id,))
+        record_deletions(cursor, "appointments", "id = %s", (appt_id,))
+        cursor.execute(APPOINTMENT_DELETE_SQL, (appt_id,))
+        bump(cursor, month_of(current[1]), current[2], user["id"], -1)
         conn.commit()
         
-        audit(f"Medic {user['username']} deleted appointment ID {appt_id}")
+        audit(f"Medic {user['username']} deleted appointment ID {appt_id}", action="appointment.delete", target=f"appointment:{appt_id}")
         flash("Appointment deleted.", "success")
     except Error as e:
+        conn.rollback()
         flash(f"Error deleting appointment: {e}", "danger")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for("medic.medic_dashboard"))
\ No newline at end of file
@@ -4,13 +4,29 @@ from mysql.connector import Error
 
 from ..security import roles_required, get_current_user
 from ..audit import audit
-from ..db import get_db_connection 
+from ..db import get_db
 
 # import Decryption Logic
-from ..crypto_utils import decrypt_value
+from ..crypto_utils import decrypt_value, decrypt_many, CRYPTO_FAILED
 
 patient_bp = Blueprint("patient", __name__, url_prefix="/patient")
 
+# shared with migrate.hot_queries(), which EXPLAINs them
+PROFILE_SQL = "SELECT username, full_name, email FROM users WHERE id = %s"
+# JOIN with the users table again (aliased as 'm') to get the Medic's name
+APPOINTMENTS_SQL = """
+    SELECT
+        a.id,
+        a.date,
+        a.status,
+        a.details,
+        m.full_name AS medic_name
+    FROM appointments a
+    JOIN users m ON a.medic_id = m.id
+    WHERE a.patient_id = %s
+    ORDER BY a.date DESC
+"""
+
 @patient_bp.route("/")
 @roles_required("patient")
 def patient_dashboard():
@@ -18,13 +34,12 @@ def patient_dashboard():
     user = get_current_user()
     patient_id = user["id"]
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     try:
         # fetch personal data -- query the DB directly to get the most up-to-date profile info
-        user_query = "SELECT username, full_name, email FROM users WHERE id = %s"
-        cursor.execute(user_query, (patient_id,))
+        cursor.execute(PROFILE_SQL, (patient_id,))
         personal_data = cursor.fetchone()
 
         # decrypt personal data
@@ -38,31 +53,17 @@ def patient_dashboard():
                 personal_data['full_name'] = "[Decryption Error]"
                 personal_data['email'] = "[Decryption Error]"
  
-        # fetch appointments for this patient -- JOIN with the users table again (aliased as 'm') to get the Medic's name
-        appt_query = """
-            SELECT 
-                a.id, 
-                a.date, 
-                a.status, 
-                a.details, 
-                m.full_name AS medic_name
-            FROM appointments a
-            JOIN users m ON a.medic_id = m.id
-            WHERE a.patient_id = %s
-            ORDER BY a.date DESC
-        """
-        cursor.execute(appt_query, (patient_id,))
+        # fetch appointments for this patient, newest first, with the medic's name
+        cursor.execute(APPOINTMENTS_SQL, (patient_id,))
         patient_appts = cursor.fetchall()
 
-        # decrypt Medic Names in Appointment History
-        for appt in patient_appts:
-            try:
-                appt['medic_name'] = decrypt_value(appt['medic_name'])
-            except Exception as e:
-                # if the medic's name cannot be decrypted, show a fallback
-                appt['medic_name'] = "Unknown Medic"
+        # decrypt Medic Names in Appointment History -- usually the same few medics, each decrypted once
+        medic_names = decrypt_many([appt['medic_name'] for appt in patient_appts])
+        for appt, medic_name in zip(patient_appts, medic_names):
+            # if the medic's name cannot be decrypted, show a fallback
+            appt['medic_name'] = "Unknown Medic" if medic_name is CRYPTO_FAILED else medic_name
 
-        audit(f"Patient {user['username']} accessed their dashboard")
+        audit(f"Patient {user['username']} accessed their dashboard", action="dashboard.view", target="patient")
 
         return render_template(
             "patient_dashboard.html",
@@ -82,6 +83,4 @@ def patient_dashboard():
     finally:
         # clean up database resources
         if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
\ No newline at end of file
+            cursor.close()
\ No newline at end of file
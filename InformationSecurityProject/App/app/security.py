@@ -1,23 +1,82 @@
 import logging
-import secrets
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
-from flask import session, redirect, url_for, flash, abort, request
+from flask import session, redirect, url_for, flash, abort, request, g
 from mysql.connector import Error
 
 from .audit import audit
+from .config import Config
 # import DB connection helper
-from .db import get_db_connection
+from .db import get_db
+# server-side session tokens, shared by all workers (see SESSION_BACKEND)
+from .session_store import get_store
 
-# keep active tokens in memory for this simple single-instance app
-ACTIVE_TOKENS = {}
+
+class IdentityCache:
+    # bounded TTL/LRU cache of user rows keyed by (username, token) -- lets repeated page
+    # views skip the users lookup; admin changes and logout invalidate entries explicitly
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username, token):
+        key = (username, token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, username, token, user):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(username, token)] = (time.monotonic() + self.ttl, dict(user))
+            self._entries.move_to_end((username, token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username=None, user_id=None):
+        # drop every cached session of a user, by username or by users.id (the admin routes only know the id)
+        with self._lock:
+            stale = [
+                key for key, (_, user) in self._entries.items()
+                if key[0] == username or (user_id is not None and user.get("id") == user_id)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+identity_cache = IdentityCache(Config.IDENTITY_CACHE_SIZE, Config.IDENTITY_CACHE_TTL)
+
+# request-path SQL lives in module constants so `python -m app.migrate --check` EXPLAINs the exact statements
+# we select specific fields to avoid leaking sensitive info unnecessarily
+USER_BY_USERNAME_SQL = "SELECT id, username, role, full_name, email, password FROM users WHERE username = %s"
 
 def get_user_by_username_sql(username):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     try:
-        # we select specific fields to avoid leaking sensitive info unnecessarily
-        query = "SELECT id, username, role, full_name, email, password FROM users WHERE username = %s"
-        cursor.execute(query, (username,))
+        cursor.execute(USER_BY_USERNAME_SQL, (username,))
         user = cursor.fetchone()
         return user
     except Error as e:
@@ -25,43 +84,76 @@ def get_user_by_username_sql(username):
         return None
     finally:
         cursor.close()
-        conn.close()
 
 def create_session(user: dict):
-    # generates a secure token, maps it to the user, and sets the Flask session
-    token = secrets.token_urlsafe(32)
-    ACTIVE_TOKENS[user["username"]] = token
+    # generates a secure token in the session store and sets the Flask session
+    # (a user may be logged in from several browsers at once, each with its own token)
+    token = get_store().create(user["username"], user["id"])
 
     session["username"] = user["username"]
     session["role"] = user["role"]
     session["token"] = token
+    g.pop("current_user", None)
 
-    audit(f"User {user['username']} logged in with token={token}")
+    # the token itself is a credential and stays out of the audit log
+    audit(f"User {user['username']} session created")
 
 def clear_session():
-    # invalidates the server-side token and clears the client-side session
+    # revokes this session's server-side token and clears the client-side session
     username = session.get("username")
+    token = session.get("token")
+    if token:
+        get_store().revoke(token)
     if username:
-        ACTIVE_TOKENS.pop(username, None)
+        identity_cache.invalidate(username=username)
         audit(f"Session cleared for {username}")
     session.clear()
+    g.pop("current_user", None)
+
+
+def revoke_user_sessions(username):
+    # logs a user out everywhere (e.g. after a role change or deletion)
+    identity_cache.invalidate(username=username)
+    return get_store().revoke_user(username)
+
+
+def invalidate_user(user_id):
+    # call after changing or deleting a user so cached copies are not served any more
+    identity_cache.invalidate(user_id=user_id)
+    g.pop("current_user", None)
 
 def get_current_user():
     # validates the session token and fetches the fresh user object from DB - returns None if session is invalid or user doesn't exist
+    # the result is memoized for the rest of the request (decorator + view body share it)
+    if "current_user" in g:
+        return g.current_user
+    user = _load_current_user()
+    g.current_user = user
+    return user
+
+def _load_current_user():
     username = session.get("username")
     token = session.get("token")
 
     if not username or not token:
         return None
 
-    # verify token matches active server-side token (Prevents Session Hijacking via old tokens)
-    expected_token = ACTIVE_TOKENS.get(username)
-    if expected_token is None or expected_token != token:
+    # verify token is a live server-side session of this user (Prevents Session Hijacking via old tokens)
+    record = get_store().get(token)
+    if record is None or record["username"] != username:
         audit(f"Invalid or expired token for {username}", level="WARNING")
         return None
 
+    # token is still checked on every request above, only the user row comes from the cache
+    user = identity_cache.get(username, token)
+    if user is not None:
+        return user
+
     # fetch fresh user data from SQL (instead of mock_db)
-    return get_user_by_username_sql(username)
+    user = get_user_by_username_sql(username)
+    if user:
+        identity_cache.put(username, token, user)
+    return user
 
 def login_required(view_func):
     # decorator to ensure a user is logged in
@@ -89,7 +181,9 @@ def roles_required(*roles):
             if user["role"] not in roles:
                 audit(
                     f"Unauthorized access attempt by user={user['username']} role={user['role']} to {request.path}",
-                    level="WARNING"
+                    level="WARNING",
+                    action="access.denied",
+                    target=request.path,
                 )
                 abort(403) # Forbidden
             
@@ -0,0 +1,317 @@
+# app/session_store.py
+# server-side login sessions shared by every worker: a token is valid wherever the store is reachable.
+# backends: "memory" (one process), "sqlite" (processes on one host share a file), "redis" (any number of hosts)
+# tokens are stored as sha256 digests, so a copy of the store does not contain usable tokens
+import hashlib
+import json
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # optional -- only needed for SESSION_BACKEND=redis
+    redis = None
+
+from .config import Config
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionStore:
+    # create() -> token, get(token) -> {"username", "user_id", "created", "expires"} or None,
+    # revoke(token) / revoke_user(username) -> number removed, sweep() -> number of expired sessions removed
+
+    name = "base"
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._counters = {"created": 0, "revoked": 0, "expired": 0}
+        self._counter_lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._counter_lock:
+            self._counters[name] += n
+
+    def create(self, username, user_id):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        record = {"username": username, "user_id": user_id, "created": now, "expires": now + self.ttl}
+        self._put(token_key(token), record)
+        self._count("created")
+        return token
+
+    def get(self, token):
+        record = self._get(token_key(token))
+        if record is None or record["expires"] <= time.time():
+            return None
+        return record
+
+    def revoke(self, token):
+        n = self._delete(token_key(token))
+        self._count("revoked", n)
+        return n
+
+    def revoke_user(self, username):
+        n = self._delete_user(username)
+        self._count("revoked", n)
+        return n
+
+    def sweep(self):
+        n = self._sweep(time.time())
+        self._count("expired", n)
+        return n
+
+    def stats(self):
+        with self._counter_lock:
+            data = dict(self._counters)
+        data.update(backend=self.name, ttl=self.ttl, active=self._active())
+        return data
+
+    # backend hooks
+    def _put(self, key, record):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def _delete_user(self, username):
+        raise NotImplementedError
+
+    def _sweep(self, now):
+        raise NotImplementedError
+
+    def _active(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    # a dict per process plus a username -> keys index; only valid while running a single worker
+
+    name = "memory"
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self._sessions = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def _put(self, key, record):
+        with self._lock:
+            self._sessions[key] = record
+            self._by_user.setdefault(record["username"], set()).add(key)
+
+    def _get(self, key):
+        with self._lock:
+            record = self._sessions.get(key)
+            return dict(record) if record else None
+
+    def _drop(self, key):
+        record = self._sessions.pop(key, None)
+        if record is None:
+            return 0
+        keys = self._by_user.get(record["username"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[record["username"]]
+        return 1
+
+    def _delete(self, key):
+        with self._lock:
+            return self._drop(key)
+
+    def _delete_user(self, username):
+        with self._lock:
+            return sum(self._drop(key) for key in list(self._by_user.get(username, ())))
+
+    def _sweep(self, now):
+        with self._lock:
+            return sum(self._drop(key) for key, r in list(self._sessions.items()) if r["expires"] <= now)
+
+    def _active(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    # one table in a local file (WAL mode), shared by all worker processes on the host
+
+    name = "sqlite"
+
+    def __init__(self, ttl, path):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " token_key TEXT PRIMARY KEY, username TEXT NOT NULL, user_id INTEGER,"
+            " created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)")
+        conn.commit()
+
+    def _conn(self):
+        # one connection per thread -- sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, query, params=()):
+        conn = self._conn()
+        with conn:
+            return conn.execute(query, params).rowcount
+
+    def _put(self, key, record):
+        self._write(
+            "INSERT INTO sessions (token_key, username, user_id, created, expires) VALUES (?, ?, ?, ?, ?)",
+            (key, record["username"], record["user_id"], record["created"], record["expires"]),
+        )
+
+    def _get(self, key):
+        row = self._conn().execute(
+            "SELECT username, user_id, created, expires FROM sessions WHERE token_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"username": row[0], "user_id": row[1], "created": row[2], "expires": row[3]}
+
+    def _delete(self, key):
+        return self._write("DELETE FROM sessions WHERE token_key = ?", (key,))
+
+    def _delete_user(self, username):
+        return self._write("DELETE FROM sessions WHERE username = ?", (username,))
+
+    def _sweep(self, now):
+        return self._write("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def _active(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+
+class RedisSessionStore(SessionStore):
+    # sess:<key> holds the record with a native TTL, user_sessions:<username> the keys of that user's sessions.
+    # `client` can be any object with the redis-py API (e.g. fakeredis when running locally)
+
+    name = "redis"
+
+    def __init__(self, ttl, url=None, client=None, prefix="healthcare:"):
+        super().__init__(ttl)
+        if client is None:
+            if redis is None:
+                raise RuntimeError("SESSION_BACKEND=redis but the redis package is not installed")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _session(self, key):
+        return f"{self.prefix}sess:{key}"
+
+    def _user(self, username):
+        return f"{self.prefix}user_sessions:{username}"
+
+    def _put(self, key, record):
+        pipe = self.client.pipeline()
+        pipe.set(self._session(key), json.dumps(record), ex=int(self.ttl))
+        pipe.sadd(self._user(record["username"]), key)
+        pipe.expire(self._user(record["username"]), int(self.ttl))
+        pipe.execute()
+
+    def _get(self, key):
+        raw = self.client.get(self._session(key))
+        return json.loads(raw) if raw else None
+
+    def _delete(self, key):
+        record = self._get(key)
+        pipe = self.client.pipeline()
+        pipe.delete(self._session(key))
+        if record is not None:
+            pipe.srem(self._user(record["username"]), key)
+        return pipe.execute()[0]
+
+    def _delete_user(self, username):
+        keys = list(self.client.smembers(self._user(username)))
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.delete(self._session(key))
+        pipe.delete(self._user(username))
+        return sum(pipe.execute()[:len(keys)])
+
+    def _sweep(self, now):
+        # the records expire by themselves; this only prunes user index entries that point at them
+        removed = 0
+        for index in self.client.scan_iter(match=self._user("*"), count=500):
+            for key in list(self.client.smembers(index)):
+                if not self.client.exists(self._session(key)):
+                    removed += self.client.srem(index, key)
+        return removed
+
+    def _active(self):
+        return sum(1 for _ in self.client.scan_iter(match=self._session("*"), count=500))
+
+
+def create_store(backend=None):
+    backend = backend or Config.SESSION_BACKEND
+    if backend == "memory":
+        return MemorySessionStore(Config.SESSION_TTL)
+    if backend == "sqlite":
+        return SQLiteSessionStore(Config.SESSION_TTL, Config.SESSION_SQLITE_PATH)
+    if backend == "redis":
+        return RedisSessionStore(Config.SESSION_TTL, Config.SESSION_REDIS_URL)
+    raise ValueError(f"unknown SESSION_BACKEND {backend!r}")
+
+
+class Sweeper(threading.Thread):
+    # daemon thread that removes expired sessions every `interval` seconds
+
+    def __init__(self, store, interval):
+        super().__init__(name="session-sweeper", daemon=True)
+        self.store = store
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.store.sweep()
+            except Exception as e:
+                logging.warning(f"Session sweep failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_store = None
+_sweeper = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # the process-wide store, created (and its sweeper started) on first use
+    global _store, _sweeper
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = create_store()
+                if Config.SESSION_SWEEP_INTERVAL > 0:
+                    _sweeper = Sweeper(store, Config.SESSION_SWEEP_INTERVAL)
+                    _sweeper.start()
+                _store = store
+    return _store
+
+
+def session_stats():
+    return get_store().stats()
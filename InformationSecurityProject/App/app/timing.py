@@ -0,0 +1,124 @@
+# app/timing.py
+# per-request time accounting: how much of a request went to the database, field crypto and password checks.
+# off unless REQUEST_TIMING is set; then every response carries a Server-Timing header (read by app.loadtest)
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from .config import Config
+
+KINDS = ("db", "crypto", "password")
+
+_local = threading.local()
+
+
+def start():
+    # begins accounting for the current thread (one request)
+    _local.totals = dict.fromkeys(KINDS, 0.0)
+    _local.active = set()
+    _local.started = time.perf_counter()
+
+
+def stop():
+    # {"db": seconds, ..., "total": seconds} for the request, or None when accounting was not started
+    totals = getattr(_local, "totals", None)
+    if totals is None:
+        return None
+    _local.totals = None
+    return dict(totals, total=time.perf_counter() - _local.started)
+
+
+@contextmanager
+def measure(kind):
+    totals = getattr(_local, "totals", None)
+    # nested calls of the same kind (decrypt_many -> decrypt_value) are only counted by the outer one
+    if totals is None or kind in _local.active:
+        yield
+        return
+    _local.active.add(kind)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals[kind] += time.perf_counter() - started
+        _local.active.discard(kind)
+
+
+def timed(kind):
+    # decorator form of measure(); costs one thread-local lookup per call while accounting is off
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "totals", None) is None:
+                return func(*args, **kwargs)
+            with measure(kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedCursor:
+    # wraps a DB cursor so statement execution and fetching count as "db"
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @timed("db")
+    def execute(self, *args, **kwargs):
+        return self._cursor.execute(*args, **kwargs)
+
+    @timed("db")
+    def executemany(self, *args, **kwargs):
+        return self._cursor.executemany(*args, **kwargs)
+
+    @timed("db")
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    @timed("db")
+    def fetchmany(self, *args, **kwargs):
+        return self._cursor.fetchmany(*args, **kwargs)
+
+    @timed("db")
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+def server_timing_header(totals):
+    return ", ".join(f"{kind};dur={seconds * 1000:.2f}" for kind, seconds in totals.items())
+
+
+def parse_server_timing(value):
+    # {"db": ms, ...} from a Server-Timing header written by server_timing_header
+    result = {}
+    for part in (value or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.startswith("dur="):
+            try:
+                result[name] = float(params[4:])
+            except ValueError:
+                pass
+    return result
+
+
+def init_app(app):
+    if not Config.REQUEST_TIMING:
+        return
+
+    @app.before_request
+    def _start_timing():
+        start()
+
+    @app.after_request
+    def _add_server_timing(response):
+        totals = stop()
+        if totals is not None:
+            response.headers["Server-Timing"] = server_timing_header(totals)
+        return response
@@ -0,0 +1,257 @@
+# app/user_import.py
+# bulk user provisioning: password hashing is spread over a process pool, PII is encrypted in batches and
+# rows are inserted in chunked transactions (blind indexes included), with a per-row error report
+# usage (from App/):  python -m app.user_import staff.csv|staff.jsonl [--workers N] [--report errors.csv]
+#
+# columns / keys: username, password, full_name, email, role
+import argparse
+import csv
+import json
+import multiprocessing
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mysql.connector import Error
+
+from .appointment_import import ImportResult, write_report
+from .audit import audit
+from .blind_index import email_bidx, name_bidxs
+from .config import Config
+from .crypto_utils import CRYPTO_FAILED, encrypt_many
+from .db import get_db_connection
+from .passwords import hash_password
+
+ROLES = ("patient", "medic", "admin")
+FIELDS = ("username", "password", "full_name", "email", "role")
+
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+_INSERT = """
+    INSERT INTO users (username, password, full_name, email, role, email_bidx)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+class ProvisionResult(ImportResult):
+    # ImportResult plus where the time went -- hashing dominates, so it is worth seeing separately
+
+    def __init__(self, max_errors):
+        super().__init__(max_errors)
+        self.timings = {"hash": 0.0, "encrypt": 0.0, "insert": 0.0}
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["users_per_second"] = round(self.imported / max(self.seconds, 1e-6), 1)
+        data["timings"] = {k: round(v, 2) for k, v in self.timings.items()}
+        return data
+
+
+def read_records(lines, fmt):
+    # yields (line, dict) from CSV or JSON-lines input; JSON errors are yielded as (line, ValueError)
+    if fmt == "jsonl":
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                yield line_no, record
+            except ValueError as e:
+                yield line_no, ValueError(f"invalid JSON: {e}")
+        return
+
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def parse_record(record):
+    # (username, password, full_name, email, role) or raises ValueError; passwords never end up in messages
+    values = {f: str(record.get(f) or "").strip() for f in FIELDS}
+    values["password"] = str(record.get("password") or "")
+    missing = [f for f in FIELDS if not values[f]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if values["role"] not in ROLES:
+        raise ValueError(f"role {values['role']!r} is not one of {', '.join(ROLES)}")
+    if not _EMAIL.match(values["email"]):
+        raise ValueError("email is not a valid address")
+    if len(values["username"]) > 64:
+        raise ValueError("username is longer than 64 characters")
+    return tuple(values[f] for f in FIELDS)
+
+
+def _existing_usernames(conn, usernames):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT username FROM users WHERE username IN ({', '.join(['%s'] * len(usernames))})",
+            list(usernames),
+        )
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def _write_tokens(cursor, rows):
+    # name tokens need the new ids -- looked up by username instead of trusting lastrowid arithmetic
+    names = {username: full_name for username, full_name in rows}
+    cursor.execute(
+        f"SELECT id, username FROM users WHERE username IN ({', '.join(['%s'] * len(names))})",
+        list(names),
+    )
+    tokens = [(t, user_id) for user_id, username in cursor.fetchall() for t in name_bidxs(names[username])]
+    if tokens:
+        cursor.executemany("INSERT INTO user_name_tokens (token_bidx, user_id) VALUES (%s, %s)", tokens)
+
+
+def _insert_chunk(conn, rows):
+    # rows: [(line, insert values, full_name)] -- one transaction, retried row by row if the batch is rejected
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.executemany(_INSERT, [values for _, values, _ in rows])
+            _write_tokens(cursor, [(values[0], full_name) for _, values, full_name in rows])
+            conn.commit()
+            return []
+        except Error:
+            conn.rollback()
+
+        failures = []
+        for line, values, full_name in rows:
+            try:
+                cursor.execute(_INSERT, values)
+                _write_tokens(cursor, [(values[0], full_name)])
+                conn.commit()
+            except Error as e:
+                conn.rollback()
+                failures.append((line, f"database rejected the row: {e}"))
+        return failures
+    finally:
+        cursor.close()
+
+
+def _flush(conn, pool, workers, pending, result):
+    taken = _existing_usernames(conn, [values[0] for _, values in pending])
+    valid = []
+    for line, values in pending:
+        if values[0] in taken:
+            result.error(line, f"username {values[0]!r} already exists")
+        else:
+            valid.append((line, values))
+    if not valid:
+        return
+
+    started = time.monotonic()
+    # a few tasks per worker keeps them all busy without paying IPC per password
+    chunksize = max(1, len(valid) // (workers * 4))
+    hashes = list(pool.map(hash_password, [v[1] for _, v in valid], chunksize=chunksize))
+    result.timings["hash"] += time.monotonic() - started
+
+    started = time.monotonic()
+    names = encrypt_many([v[2] for _, v in valid])
+    emails = encrypt_many([v[3] for _, v in valid])
+    result.timings["encrypt"] += time.monotonic() - started
+
+    rows = []
+    for (line, values), password_hash, name, email in zip(valid, hashes, names, emails):
+        if name is CRYPTO_FAILED or email is CRYPTO_FAILED:
+            result.error(line, "personal data could not be encrypted")
+            continue
+        username, _, full_name, plain_email, role = values
+        rows.append((line, (username, password_hash, name, email, role, email_bidx(plain_email)), full_name))
+
+    started = time.monotonic()
+    failures = _insert_chunk(conn, rows) if rows else []
+    result.timings["insert"] += time.monotonic() - started
+    for line, message in failures:
+        result.error(line, message)
+    result.imported += len(rows) - len(failures)
+
+
+def provision_users(lines, fmt="csv", workers=None, chunk_rows=None, max_errors=None, progress=None):
+    # `lines`: iterable of text lines; fmt "csv" or "jsonl"
+    workers = workers or Config.PROVISION_WORKERS
+    chunk_rows = chunk_rows or Config.PROVISION_CHUNK_ROWS
+    result = ProvisionResult(max_errors or Config.IMPORT_MAX_ERRORS)
+
+    conn = get_db_connection()
+    try:
+        # a pool per run: provisioning is occasional, and idle worker processes would only hold memory;
+        # "spawn" because this runs inside a threaded web worker, where fork can copy held locks into the child
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            pending, seen = [], set()
+            for line, record in read_records(lines, fmt):
+                result.read += 1
+                try:
+                    if isinstance(record, ValueError):
+                        raise record
+                    values = parse_record(record)
+                    if values[0] in seen:
+                        raise ValueError(f"username {values[0]!r} appears more than once in the file")
+                    seen.add(values[0])
+                    pending.append((line, values))
+                except ValueError as e:
+                    result.error(line, str(e))
+                if len(pending) >= chunk_rows:
+                    _flush(conn, pool, workers, pending, result)
+                    pending = []
+                    if progress:
+                        progress(result)
+            if pending:
+                _flush(conn, pool, workers, pending, result)
+    finally:
+        conn.close()
+
+    result.errors.sort()
+    audit(
+        f"Bulk provisioning: {result.imported} users created, {result.failed} rows rejected",
+        action="user.import",
+        target="users",
+    )
+    return result
+
+
+def provision_users_file(path, fmt=None, **kwargs):
+    # provision_users() on a file, the format taken from its name unless given (keyword arguments as there)
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        return provision_users(f, fmt or detect_format(path), **kwargs)
+
+
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create users in bulk from a CSV or JSON-lines file.")
+    parser.add_argument("path", help="users file (.csv or .jsonl)")
+    parser.add_argument("--workers", type=int, help="password hashing processes (default: CPU count)")
+    parser.add_argument("--chunk-rows", type=int, help="users per transaction")
+    parser.add_argument("--report", help="write the rejected rows to this CSV")
+    args = parser.parse_args(argv)
+
+    def progress(result):
+        print(f"  {result.read} rows read, {result.imported} created ({result.imported / max(result.seconds, 1e-6):.0f} users/s)", flush=True)
+
+    result = provision_users_file(args.path, workers=args.workers, chunk_rows=args.chunk_rows, progress=progress)
+
+    t = result.timings
+    print(
+        f"Created {result.imported} of {result.read} users in {result.seconds:.1f}s "
+        f"({result.imported / max(result.seconds, 1e-6):.0f} users/s; hashing {t['hash']:.1f}s, "
+        f"encryption {t['encrypt']:.1f}s, inserts {t['insert']:.1f}s), {result.failed} rejected"
+    )
+    for line, message in result.errors[:20]:
+        print(f"  line {line}: {message}")
+    if args.report:
+        write_report(result, args.report)
+        print(f"Error report written to {args.report}")
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# tests/conftest.py
+# the suite runs against the sqlite stand-in (DB_BACKEND=sqlite) with throwaway keys, no MySQL server needed
+# usage (from App/):  python -m pytest [-k rekey]
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+from cryptography.fernet import Fernet
+
+# Config reads the environment when it is imported, so the test settings go in before anything from app
+_TMP = tempfile.mkdtemp(prefix="healthcare-tests-")
+atexit.register(shutil.rmtree, _TMP, True)
+os.environ.update({
+    "DB_BACKEND": "sqlite",
+    "DB_SQLITE_PATH": os.path.join(_TMP, "app.sqlite3"),
+    "ENCRYPTION_KEYS": Fernet.generate_key().decode(),
+    "SECRET_KEY": "test-secret",
+    "BACKUP_DIR": os.path.join(_TMP, "backups"),
+    "REKEY_CHECKPOINT": os.path.join(_TMP, "rekey_checkpoint.json"),
+    "AUDIT_LOG_FILE": os.path.join(_TMP, "audit.log"),
+    "AUDIT_ASYNC": "0",
+    "AUDIT_ECHO": "0",
+    "SESSION_BACKEND": "memory",
+    "SESSION_SWEEP_INTERVAL": "0",
+    "PASSWORD_WORKERS": "0",
+    "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+})
+
+from app import appointment_summary, blind_index, create_app, crypto_utils, migrate  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.db import dispose_pool, get_db_connection  # noqa: E402
+from app.passwords import hash_password  # noqa: E402
+from app.security import identity_cache  # noqa: E402
+
+PASSWORD = "Test_pw_2024"
+
+
+@pytest.fixture
+def key_ring():
+    # tests may switch keys and FIELD_CIPHER; both are put back afterwards
+    keys, cipher = list(crypto_utils.keys), Config.FIELD_CIPHER
+    yield
+    crypto_utils.set_keys(keys)
+    Config.FIELD_CIPHER = cipher
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # a fresh, fully migrated database file (and backup directory) per test
+    monkeypatch.setattr(Config, "DB_SQLITE_PATH", str(tmp_path / "app.sqlite3"))
+    monkeypatch.setattr(Config, "BACKUP_DIR", str(tmp_path / "backups"))
+    # the schema helpers remember per process that they already ran
+    monkeypatch.setattr(blind_index, "_schema_ready", False)
+    monkeypatch.setattr(appointment_summary, "_schema_ready", False)
+    dispose_pool()
+    migrate.migrate(progress=lambda message: None)
+    yield tmp_path
+    dispose_pool()
+
+
+@pytest.fixture
+def seed(db):
+    # one medic, `patients` patients, `admins` admins and `appointments` appointments, personal data encrypted,
+    # indexed and counted in the monthly summary as the app does; returns {"medic": id, "patients": [ids],
+    # "admins": [ids]} -- usernames are <role><position>, e.g. medic0, patient1
+    def seed(patients=5, appointments=10, admins=0):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            ids = []
+            for i, role in enumerate(["medic"] + ["patient"] * patients + ["admin"] * admins):
+                cursor.execute(
+                    "INSERT INTO users (username, password, full_name, email, role) VALUES (%s, %s, %s, %s, %s)",
+                    (f"{role}{i}", "x", crypto_utils.encrypt_value(f"User {i}"),
+                     crypto_utils.encrypt_value(f"user{i}@example.com"), role),
+                )
+                ids.append(cursor.lastrowid)
+                blind_index.index_user(cursor, ids[-1], f"User {i}", f"user{i}@example.com")
+            for i in range(appointments):
+                cursor.execute(
+                    "INSERT INTO appointments (patient_id, medic_id, date, status, details) VALUES (%s, %s, %s, %s, %s)",
+                    (ids[1 + i % patients], ids[0], f"2024-0{1 + i % 9}-15 10:00:00", "scheduled",
+                     crypto_utils.encrypt_value(f"visit {i}")),
+                )
+                appointment_summary.bump(cursor, f"2024-0{1 + i % 9}", "scheduled", ids[0], 1)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return {"medic": ids[0], "patients": ids[1:1 + patients], "admins": ids[1 + patients:]}
+
+    return seed
+
+
+@pytest.fixture
+def login(db):
+    # login(username) -> a Flask test client signed in as that user (its password is reset to PASSWORD first)
+    app = create_app()
+    app.testing = True
+    identity_cache.clear()
+
+    def login(username):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE users SET password = %s WHERE username = %s", (hash_password(PASSWORD), username))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        client = app.test_client()
+        response = client.post("/login", data={"username": username, "password": PASSWORD})
+        assert response.status_code == 302, response.data
+        return client
+
+    return login
@@ -0,0 +1,38 @@
+# tests/test_admin_users_page.py
+from app import create_app
+from app.routes.admin import fetch_users_page
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_keyset_pages_forward_and_back(seed):
+    ids = seed(patients=6, appointments=0)
+    users = [ids["medic"]] + ids["patients"]
+    with create_app().app_context():
+        rows, prev_cursor, next_cursor = fetch_users_page(limit=3)
+        assert _ids(rows) == users[:3] and prev_cursor is None and next_cursor == users[2]
+
+        rows, prev_cursor, next_cursor = fetch_users_page(after=next_cursor, limit=3)
+        assert _ids(rows) == users[3:6] and prev_cursor == users[3] and next_cursor == users[5]
+
+        last, last_prev, last_next = fetch_users_page(after=next_cursor, limit=3)
+        assert _ids(last) == users[6:] and last_prev == users[6] and last_next is None
+
+        # back from the last page, then back to the first one, which has no previous page
+        rows, prev_cursor, next_cursor = fetch_users_page(before=last_prev, limit=3)
+        assert _ids(rows) == users[3:6] and prev_cursor == users[3] and next_cursor == users[5]
+        rows, prev_cursor, next_cursor = fetch_users_page(before=prev_cursor, limit=3)
+        assert _ids(rows) == users[:3] and prev_cursor is None and next_cursor == users[2]
+
+        assert fetch_users_page(after=users[-1], limit=3) == ([], None, None)
+
+
+def test_dashboard_shows_only_the_page(seed, login):
+    seed(patients=6, appointments=0, admins=1)
+    admin = login("admin7")
+    page = admin.get("/admin/", query_string={"per_page": 2}).data.decode()
+    assert "User 0" in page and "User 1" in page and "User 2" not in page
+    page = admin.get("/admin/", query_string={"per_page": 2, "after": 2}).data.decode()
+    assert "User 2" in page and "User 3" in page and "User 1" not in page
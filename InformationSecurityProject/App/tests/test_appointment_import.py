@@ -0,0 +1,118 @@
+# tests/test_appointment_import.py
+import io
+import threading
+import time
+
+from app import appointment_import, create_app
+from app.appointment_import import ImportResult, import_appointments, start_import_job
+from app.db import get_db_connection
+
+
+def _csv(rows):
+    return io.StringIO("patient_id,date,status,details\n" + "".join(f"{row}\n" for row in rows))
+
+
+def test_per_row_error_report(seed):
+    ids = seed(patients=2, appointments=0)
+    patient, medic = ids["patients"][0], ids["medic"]
+    result = import_appointments(_csv([
+        f"{patient},2025-03-01 10:00,scheduled,ok",
+        f"x{patient},2025-03-01,scheduled,bad id",
+        f"{patient},03/01/2025,scheduled,bad date",
+        f"{patient},2025-03-02,postponed,bad status",
+        f"{medic},2025-03-03,,not a patient",
+        f"{patient},2025-03-04,completed,ok",
+    ]), medic_id=medic, chunk_rows=2)
+
+    assert (result.read, result.imported, result.failed) == (6, 2, 4)
+    assert [line for line, _ in result.errors] == [3, 4, 5, 6]
+    messages = dict(result.errors)
+    assert "patient_id" in messages[3] and "ISO date" in messages[4]
+    assert "postponed" in messages[5] and "is not a patient" in messages[6]
+    assert import_appointments(io.StringIO("date,status\n2025-01-01,scheduled\n"), medic_id=medic).errors == [
+        (1, "missing column(s): patient_id")
+    ]
+
+
+def test_error_report_is_capped(seed):
+    ids = seed(patients=1, appointments=0)
+    result = import_appointments(_csv(["bad,2025-01-01,,"] * 5), medic_id=ids["medic"], max_errors=2)
+    assert result.failed == 5 and len(result.errors) == 2
+    assert result.to_dict()["errors_truncated"]
+
+
+def _poll(client, url):
+    for _ in range(200):
+        state = client.get(url).json
+        if state["state"] in ("done", "failed"):
+            return state
+        time.sleep(0.02)
+    raise AssertionError(f"import still {state['state']}")
+
+
+def test_import_job_progress_is_read_from_the_database(seed, login):
+    ids = seed(patients=1, appointments=0)
+    client = login("medic0")
+    upload = f"patient_id,date,status,details\n{ids['patients'][0]},2025-05-01,scheduled,x\nbad,2025-05-01,,\n"
+    response = client.post("/medic/appointment/import?format=json",
+                           data={"file": (io.BytesIO(upload.encode()), "schedule.csv")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 202
+    state = _poll(client, response.json["status_url"])
+    assert (state["imported"], state["failed"]) == (1, 1)
+    assert state["errors"] == [{"line": 3, "error": "patient_id is missing or not a number"}]
+
+    # what another worker would answer: nothing but the row in import_jobs
+    with create_app().app_context():
+        job = appointment_import.get_import_job(state["id"])
+        assert job.owner == ids["medic"] and job.to_dict()["imported"] == 1
+        assert appointment_import.latest_import_job(ids["medic"], "appointment").id == state["id"]
+    assert client.get("/medic/appointment/import/unknown").status_code == 404
+
+
+def test_one_running_import_per_owner(seed, tmp_path):
+    seed(patients=1, appointments=0)
+    release = threading.Event()
+
+    def target(path, progress=None):
+        release.wait(5)
+        return ImportResult(10)
+
+    paths = []
+    for name in ("a", "b"):
+        paths.append(tmp_path / f"{name}.upload")
+        paths[-1].write_text("")
+    with create_app().app_context():
+        first, started = start_import_job(1, "appointment", target, str(paths[0]))
+        assert started
+        again, started = start_import_job(1, "appointment", target, str(paths[1]))
+        assert not started and again.id == first.id and not paths[1].exists()
+        release.set()
+        first._thread.join(5)
+        assert appointment_import.get_import_job(first.id).state == "done"
+
+
+def test_stale_job_stops_blocking(seed, tmp_path):
+    seed(patients=1, appointments=0)
+    upload = tmp_path / "a.upload"
+    upload.write_text("")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # left behind by a worker that was killed an hour ago
+        cursor.execute(
+            "INSERT INTO import_jobs (id, owner, kind, state, active, created, heartbeat) "
+            "VALUES ('dead00000000', 1, 'appointment', 'running', '1:appointment', %s, %s)",
+            (time.time() - 3600, time.time() - 3600),
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    with create_app().app_context():
+        job, started = start_import_job(1, "appointment", lambda path, progress=None: ImportResult(10), str(upload))
+        assert started
+        job._thread.join(5)
+        dead = appointment_import.get_import_job("dead00000000")
+        assert dead.state == "failed" and "stopped" in dead.error
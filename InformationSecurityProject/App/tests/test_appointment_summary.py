@@ -0,0 +1,50 @@
+# tests/test_appointment_summary.py
+# the monthly summary is kept current by the medic routes alone -- reconcile must find nothing to fix
+from app import appointment_summary
+from app.db import get_db_connection
+
+
+def _drift():
+    conn = get_db_connection()
+    try:
+        return appointment_summary.reconcile(conn, fix=False)
+    finally:
+        conn.close()
+
+
+def _appointment_ids(medic_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM appointments WHERE medic_id = %s ORDER BY id", (medic_id,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_summary_follows_create_update_delete(seed, login):
+    ids = seed(patients=3, appointments=6)
+    client = login("medic0")
+    assert _drift() == []
+
+    client.post("/medic/appointment/create", data={"patient_id": ids["patients"][0], "date": "2025-02-10T09:30",
+                                                   "details": "new"})
+    client.post("/medic/appointment/create", data={"patient_id": ids["patients"][1], "date": "2025-02-11T09:30",
+                                                   "details": "new"})
+    appointments = _appointment_ids(ids["medic"])
+    assert len(appointments) == 8
+    client.post(f"/medic/appointment/update/{appointments[0]}", data={"status": "completed", "details": "done"})
+    client.post(f"/medic/appointment/update/{appointments[-1]}", data={"status": "cancelled", "details": "no"})
+    client.post(f"/medic/appointment/delete/{appointments[1]}")
+
+    assert len(_appointment_ids(ids["medic"])) == 7
+    assert _drift() == []
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        assert appointment_summary.monthly_report(cursor)["2025-02"] == 2
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,77 @@
+# tests/test_audit_verify.py
+import time
+
+import pytest
+
+from app.audit import AuditConfigError, AuditLog
+from app.audit_verify import VerificationError, verify
+
+KEY = "audit-test-key"
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    # a chained json log of 10 records with a checkpoint every 3
+    path = str(tmp_path / "audit.log")
+    log = AuditLog(path, fmt="json", chain=True, checkpoint_every=3, hmac_key=KEY)
+    now = time.time()
+    log.write([
+        {"ts": now + i, "level": "INFO", "msg": f"event {i}", "actor": "admin", "action": "test.event",
+         "target": f"user:{i}", "ip": None}
+        for i in range(10)
+    ])
+    log.close()
+    return path
+
+
+def _lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.readlines()
+
+
+def _write(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def test_intact_log_verifies(log_file):
+    result = verify(log_file, key=KEY)
+    assert result["to_seq"] == 10 and result["checked"] == 10
+
+
+def test_altered_record_is_detected(log_file):
+    lines = _lines(log_file)
+    index = next(i for i, line in enumerate(lines) if "event 4" in line)
+    lines[index] = lines[index].replace("event 4", "event X")
+    _write(log_file, lines)
+    with pytest.raises(VerificationError, match="hash mismatch at seq 5"):
+        verify(log_file, key=KEY)
+
+
+def test_removed_record_is_detected(log_file):
+    lines = [line for line in _lines(log_file) if "event 4" not in line]
+    _write(log_file, lines)
+    with pytest.raises(VerificationError, match="expected seq 5"):
+        verify(log_file, key=KEY)
+
+
+def test_truncated_tail_is_detected(log_file):
+    lines = _lines(log_file)
+    index = next(i for i, line in enumerate(lines) if "event 7" in line)
+    _write(log_file, lines[:index])
+    with pytest.raises(VerificationError, match="tail truncated"):
+        verify(log_file, key=KEY)
+
+
+def test_wrong_key_fails_checkpoint_mac(log_file):
+    with pytest.raises(VerificationError, match="bad MAC"):
+        verify(log_file, key="another-key")
+
+
+def test_chain_needs_its_own_key(tmp_path, log_file):
+    with pytest.raises(AuditConfigError, match="AUDIT_HMAC_KEY"):
+        AuditLog(str(tmp_path / "other.log"), fmt="json", chain=True, checkpoint_every=3)
+    # no key configured in the test environment -- no silent fallback to SECRET_KEY either
+    with pytest.raises(AuditConfigError):
+        verify(log_file)
+    AuditLog(str(tmp_path / "plain.log"), fmt="json").close()
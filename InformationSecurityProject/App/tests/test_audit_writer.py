@@ -0,0 +1,59 @@
+# tests/test_audit_writer.py
+import threading
+import time
+
+from app.audit import AuditWriter
+
+
+class StuckLog:
+    # a log whose disk has stopped answering until `release` is set
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.written = []
+        self.closed = False
+
+    def write(self, records, echo=False):
+        self.release.wait(5)
+        self.written.extend(records)
+
+    def fsync(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _record(i):
+    return {"ts": time.time(), "level": "INFO", "msg": f"event {i}", "actor": None, "action": None,
+            "target": None, "ip": None}
+
+
+def test_close_does_not_hang_on_a_stuck_writer():
+    log = StuckLog()
+    writer = AuditWriter(log, queue_size=2, batch_size=1, overflow="drop", block_timeout=0, fsync="never",
+                         fsync_interval=0, echo=False)
+    writer.submit(_record(0))
+    time.sleep(0.05)  # the writer thread now hangs inside write()
+    assert writer.submit(_record(1)) and writer.submit(_record(2))
+    assert not writer.submit(_record(3))
+
+    started = time.monotonic()
+    writer.close(timeout=0.2)
+    assert time.monotonic() - started < 1
+    assert writer.stats()["dropped"] == 3
+
+    log.release.set()
+    writer._thread.join(5)
+    assert [r["msg"] for r in log.written] == ["event 0"] and log.closed
+
+
+def test_close_writes_everything_queued():
+    log = StuckLog()
+    log.release.set()
+    writer = AuditWriter(log, queue_size=100, batch_size=10, overflow="block", block_timeout=1, fsync="never",
+                         fsync_interval=0, echo=False)
+    for i in range(25):
+        writer.submit(_record(i))
+    writer.close()
+    assert len(log.written) == 25 and log.closed and writer.stats()["dropped"] == 0
@@ -0,0 +1,122 @@
+# tests/test_backup_restore.py
+import fcntl
+import os
+
+import pytest
+
+from app import crypto_utils
+from app.backup import BACKUP_TABLES, BackupBusy, load_backup_manifest, perform_backup_sql, record_deletions
+from app.config import Config
+from app.db import get_db_connection
+from app.blind_index import index_user, search_user_ids
+from app.restore import read_backup, restore, table_checksum
+
+
+def _checksums():
+    conn = get_db_connection()
+    try:
+        return {table: table_checksum(conn, table) for table in BACKUP_TABLES}
+    finally:
+        conn.close()
+
+
+def _wipe():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for table in reversed(BACKUP_TABLES):
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_full_backup_restores(seed):
+    seed(patients=4, appointments=12)
+    expected = _checksums()
+    path = perform_backup_sql()
+    _wipe()
+    restore(path)
+    assert _checksums() == expected
+
+
+def test_incremental_backup_restores_with_its_base(seed):
+    ids = seed(patients=4, appointments=12)
+    perform_backup_sql()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE appointments SET status = %s WHERE id = %s", ("completed", 1))
+        cursor.execute(
+            "INSERT INTO appointments (patient_id, medic_id, date, status, details) VALUES (%s, %s, %s, %s, %s)",
+            (ids["patients"][0], ids["medic"], "2024-12-01 09:00:00", "scheduled", "x"),
+        )
+        record_deletions(cursor, "appointments", "id = %s", (2,))
+        cursor.execute("DELETE FROM appointments WHERE id = %s", (2,))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    expected = _checksums()
+
+    path = perform_backup_sql(incremental=True)
+    full, incremental = load_backup_manifest()
+    assert incremental["kind"] == "incremental" and incremental["parent"] == full["file"]
+    header = next(iter(read_backup(path)))[1]
+    assert header["kind"] == "incremental"
+    assert incremental["tables"]["appointments"]["deleted"] == 1
+
+    _wipe()
+    restore(path)
+    assert _checksums() == expected
+
+
+def _search(query):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        return search_user_ids(cursor, query)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_restore_rebuilds_name_search(seed):
+    ids = seed(patients=3, appointments=0)
+    path = perform_backup_sql()
+
+    # a user created after the backup: the restore drops the row, its name tokens must go with it
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO users (username, password, full_name, email, role) VALUES (%s, %s, %s, %s, %s)",
+            ("late", "x", crypto_utils.encrypt_value("Zed Late"), crypto_utils.encrypt_value("z@example.com"),
+             "patient"),
+        )
+        index_user(cursor, cursor.lastrowid, "Zed Late", "z@example.com")
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    assert _search("zed")
+
+    restore(path)
+    assert _search("zed") == []
+    assert _search("user 2") == [ids["patients"][1]]
+    assert _search("user2@example.com") == [ids["patients"][1]]
+
+
+def test_backup_refused_while_another_process_holds_the_lock(seed):
+    seed(patients=2, appointments=3)
+    os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+    # a second open file description conflicts just like another worker process would
+    with open(os.path.join(Config.BACKUP_DIR, ".backup.lock"), "a") as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        with pytest.raises(BackupBusy):
+            perform_backup_sql()
+        assert load_backup_manifest() == []
+    path = perform_backup_sql()
+    assert [e["file"] for e in load_backup_manifest()] == [os.path.basename(path)]
@@ -0,0 +1,54 @@
+# tests/test_blind_index.py
+# the admin search only sees what the create/update routes wrote into the blind indexes
+from app.db import get_db_connection
+
+
+def _search(client, query):
+    response = client.get("/admin/search", query_string={"q": query})
+    assert response.status_code == 200
+    return [(u["username"], u["full_name"], u["email"]) for u in response.json["users"]]
+
+
+def test_search_after_create_and_update(seed, login):
+    seed(patients=2, appointments=0, admins=1)
+    client = login("admin3")
+
+    client.post("/admin/user/create", data={"username": "ada", "password": "Secret_2024", "role": "patient",
+                                            "full_name": "Ada Lovelace", "email": "ada@example.com"})
+    assert _search(client, "ada@example.com") == [("ada", "Ada Lovelace", "ada@example.com")]
+    assert _search(client, "lovelace ADA") == [("ada", "Ada Lovelace", "ada@example.com")]
+    assert _search(client, "Ada Byron") == []
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM users WHERE username = 'ada'")
+        user_id = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+    client.post(f"/admin/user/update/{user_id}", data={"full_name": "Ada King", "email": "countess@example.com",
+                                                       "role": "patient"})
+    assert _search(client, "ada@example.com") == []
+    assert _search(client, "Lovelace") == []
+    assert _search(client, "countess@example.com") == [("ada", "Ada King", "countess@example.com")]
+    assert _search(client, "king") == [("ada", "Ada King", "countess@example.com")]
+
+
+def test_update_of_missing_user_writes_nothing(seed, login):
+    seed(patients=1, appointments=0, admins=1)
+    client = login("admin2")
+
+    response = client.post("/admin/user/update/999", data={"full_name": "Nobody", "email": "nobody@example.com",
+                                                           "role": "admin"}, follow_redirects=True)
+    assert b"User not found." in response.data
+    assert _search(client, "nobody") == []
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM user_name_tokens WHERE user_id = 999")
+        assert cursor.fetchone()[0] == 0
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,121 @@
+# tests/test_crypto.py
+import base64
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+
+from app import crypto_utils
+from app.config import Config
+
+
+@pytest.mark.parametrize("cipher", ["fernet", "aead"])
+@pytest.mark.parametrize("plaintext", ["", "Ana-Maria Popescu", "ünïcødé ✓", "x" * 5000])
+def test_round_trip(key_ring, cipher, plaintext):
+    Config.FIELD_CIPHER = cipher
+    token = crypto_utils.encrypt_value(plaintext)
+    assert crypto_utils.is_aead(token) == (cipher == "aead")
+    assert crypto_utils.decrypt_value(token) == plaintext
+
+
+def test_both_formats_readable_whatever_the_setting(key_ring):
+    Config.FIELD_CIPHER = "fernet"
+    fernet_token = crypto_utils.encrypt_value("a")
+    Config.FIELD_CIPHER = "aead"
+    aead_token = crypto_utils.encrypt_value("b")
+    for cipher in ("fernet", "aead"):
+        Config.FIELD_CIPHER = cipher
+        assert crypto_utils.decrypt_many([fernet_token, aead_token]) == ["a", "b"]
+
+
+@pytest.mark.parametrize("cipher", ["fernet", "aead"])
+def test_key_missing_from_ring_fails(key_ring, cipher):
+    Config.FIELD_CIPHER = cipher
+    token = crypto_utils.encrypt_value("secret")
+    crypto_utils.set_keys([Fernet.generate_key()])
+    with pytest.raises(InvalidToken):
+        crypto_utils.decrypt_value(token)
+    assert crypto_utils.decrypt_many([token]) == [crypto_utils.CRYPTO_FAILED]
+
+
+def test_relabelled_key_id_fails(key_ring):
+    # the header is authenticated: pointing a value at another key of the ring must not decrypt
+    Config.FIELD_CIPHER = "aead"
+    old = crypto_utils.key
+    crypto_utils.set_keys([Fernet.generate_key(), old])
+    token = crypto_utils.encrypt_value("secret")
+    blob = crypto_utils._aead_unwrap(token)
+    other_id = crypto_utils._aead_for(old)[0]
+    forged = crypto_utils.AEAD_PREFIX + base64.urlsafe_b64encode(
+        other_id + blob[crypto_utils._KEY_ID_BYTES:]
+    ).rstrip(b"=").decode()
+    with pytest.raises(InvalidTag):
+        crypto_utils.decrypt_value(forged)
+
+
+def test_rotation_to_new_primary(key_ring):
+    Config.FIELD_CIPHER = "fernet"
+    old = crypto_utils.key
+    token = crypto_utils.encrypt_value("secret")
+    new = Fernet.generate_key()
+    crypto_utils.set_keys([new, old])
+    assert crypto_utils.needs_rotation(token)
+
+    Config.FIELD_CIPHER = "aead"
+    rotated = crypto_utils.rotate_value(token)
+    assert crypto_utils.is_aead(rotated) and not crypto_utils.needs_rotation(rotated)
+    crypto_utils.set_keys([new])
+    assert crypto_utils.decrypt_value(rotated) == "secret"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # DECRYPT_CACHE_ENABLED is off by default
+    monkeypatch.setattr(crypto_utils.decrypt_cache, "enabled", True)
+    crypto_utils.decrypt_cache.clear()
+    yield crypto_utils.decrypt_cache
+    crypto_utils.decrypt_cache.clear()
+
+
+def test_cached_plaintext_is_flushed_by_set_keys(key_ring, cache):
+    token = crypto_utils.encrypt_value("secret")
+    assert crypto_utils.decrypt_value(token) == "secret"
+    assert crypto_utils.decrypt_value(token) == "secret"
+    assert cache.stats()["hits"] == 1 and cache.stats()["entries"] == 1
+
+    # the key is gone from the ring -- the cached plaintext must not outlive it
+    crypto_utils.set_keys([Fernet.generate_key()])
+    assert cache.stats()["entries"] == 0
+    with pytest.raises(InvalidToken):
+        crypto_utils.decrypt_value(token)
+
+
+def test_decrypt_started_before_a_key_change_is_not_cached(key_ring, cache):
+    token = crypto_utils.encrypt_value("secret")
+    digest, generation = cache.digest(token), cache.generation
+    crypto_utils.set_keys([Fernet.generate_key()])
+    cache.put(digest, "secret", generation)
+    assert cache.get(digest) is None
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_decrypt_many_dedupes_and_marks_failures(key_ring, monkeypatch, threads):
+    monkeypatch.setattr(Config, "CRYPTO_THREADS", threads)
+    monkeypatch.setattr(Config, "CRYPTO_PARALLEL_THRESHOLD", 2)
+    calls = []
+    real = crypto_utils._decrypt_uncached
+    monkeypatch.setattr(crypto_utils, "_decrypt_uncached", lambda c: calls.append(c) or real(c))
+
+    tokens = [crypto_utils.encrypt_value(f"value {i}") for i in range(6)]
+    column = [tokens[0], None, "not-a-token", tokens[0]] + tokens[1:] + [tokens[5], None]
+    result = crypto_utils.decrypt_many(column)
+
+    assert result == (["value 0", None, crypto_utils.CRYPTO_FAILED, "value 0"]
+                      + [f"value {i}" for i in range(1, 6)] + ["value 5", None])
+    assert sorted(calls) == sorted(tokens + ["not-a-token"])
+
+
+def test_encrypt_many_keeps_order_and_none(key_ring):
+    encrypted = crypto_utils.encrypt_many(["a", None, "a", "b"])
+    assert encrypted[1] is None and encrypted[0] != encrypted[2]
+    assert crypto_utils.decrypt_many(encrypted) == ["a", None, "a", "b"]
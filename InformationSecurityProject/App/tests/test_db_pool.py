@@ -0,0 +1,134 @@
+# tests/test_db_pool.py
+import threading
+import time
+
+import pytest
+
+from app.db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise OSError("server has gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    return ConnectionPool(connect, **kwargs), opened
+
+
+def test_checkout_reuses_released_connection():
+    pool, opened = make_pool(size=2, max_overflow=0)
+    conn = pool.connect()
+    raw = conn._raw
+    conn.close()
+    with pool.connect() as again:
+        assert again._raw is raw
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["checkouts"] == 2
+    assert stats["idle"] == 1 and stats["checked_out"] == 0
+
+
+def test_overflow_connections_are_closed_on_release():
+    pool, opened = make_pool(size=1, max_overflow=1)
+    first, second = pool.connect(), pool.connect()
+    first.close()
+    second.close()
+    assert pool.stats()["open"] == 1
+    assert [c.closed for c in opened] == [False, True]
+
+
+def test_checkout_times_out_when_exhausted():
+    pool, _ = make_pool(size=1, max_overflow=0, timeout=0.05)
+    held = pool.connect()
+    with pytest.raises(PoolTimeout):
+        pool.connect()
+    assert pool.stats()["timeouts"] == 1
+    held.close()
+    pool.connect().close()
+
+
+def test_waiting_checkout_gets_released_connection():
+    pool, opened = make_pool(size=1, max_overflow=0, timeout=5)
+    held = pool.connect()
+    threading.Timer(0.05, held.close).start()
+    with pool.connect() as conn:
+        assert conn._raw is opened[0]
+    assert pool.stats()["waits"] == 1
+
+
+def test_old_connection_is_recycled():
+    pool, opened = make_pool(size=1, max_overflow=0, recycle=0.01)
+    pool.connect().close()
+    time.sleep(0.02)
+    with pool.connect() as conn:
+        assert conn._raw is opened[1]
+    assert opened[0].closed
+    assert pool.stats()["recycled"] == 1
+
+
+def test_dead_idle_connection_is_replaced():
+    pool, opened = make_pool(size=1, max_overflow=0, ping_interval=0)
+    pool.connect().close()
+    opened[0].alive = False
+    with pool.connect() as conn:
+        assert conn._raw is opened[1]
+    assert pool.stats()["ping_failures"] == 1
+
+
+def test_failed_connect_frees_the_slot():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("connection refused")
+        return FakeConnection()
+
+    pool = ConnectionPool(connect, size=1, max_overflow=0, timeout=0.05)
+    with pytest.raises(OSError):
+        pool.connect()
+    pool.connect().close()
+    assert pool.stats()["open"] == 1
+
+
+def test_connection_returned_after_dispose_is_closed():
+    pool, opened = make_pool(size=2, max_overflow=0)
+    idle, held = pool.connect(), pool.connect()
+    idle.close()
+    pool.dispose()
+    assert opened[0].closed and not opened[1].closed
+    held.close()
+    assert opened[1].closed
+    assert pool.stats()["idle"] == 0 and pool.stats()["open"] == 0
+
+
+def test_dispose_without_close_leaves_inherited_connections_alone():
+    # after a fork the child must not talk on the parent's sockets -- not even a rollback
+    pool, opened = make_pool(size=2, max_overflow=0)
+    idle, held = pool.connect(), pool.connect()
+    idle.close()
+    rollbacks = opened[0].rollbacks
+    pool.dispose(close=False)
+    held.close()
+    assert not any(c.closed for c in opened)
+    assert opened[0].rollbacks == rollbacks and opened[1].rollbacks == 0
+    assert pool.stats()["idle"] == 0 and pool.stats()["open"] == 0
@@ -0,0 +1,45 @@
+# tests/test_identity_cache.py
+# cached user rows must not outlive an admin change to the user
+from app.security import identity_cache
+
+
+def _cached_ids():
+    return sorted(user["id"] for _, user in identity_cache._entries.values())
+
+
+def test_update_invalidates_cached_user(seed, login):
+    ids = seed(patients=1, appointments=0, admins=1)
+    patient_id, admin_id = ids["patients"][0], ids["admins"][0]
+    patient, admin = login("patient1"), login("admin2")
+
+    assert patient.get("/patient/").status_code == 200
+    assert admin.get("/admin/").status_code == 200
+    assert _cached_ids() == sorted([patient_id, admin_id])
+    assert patient.get("/patient/").status_code == 200
+    assert identity_cache.stats()["hits"] >= 1
+
+    # same role: the session survives, only the cached row goes
+    admin.post(f"/admin/user/update/{patient_id}", data={"full_name": "Renamed", "email": "r@example.com",
+                                                         "role": "patient"})
+    assert patient_id not in _cached_ids()
+    assert patient.get("/patient/").status_code == 200
+
+    # new role: the old one must not be honoured from the cache
+    admin.post(f"/admin/user/update/{patient_id}", data={"full_name": "Renamed", "email": "r@example.com",
+                                                         "role": "medic"})
+    assert patient_id not in _cached_ids()
+    response = patient.get("/patient/")
+    assert response.status_code == 302 and "/login" in response.headers["Location"]
+
+
+def test_delete_invalidates_cached_user(seed, login):
+    ids = seed(patients=1, appointments=0, admins=1)
+    patient_id = ids["patients"][0]
+    patient, admin = login("patient1"), login("admin2")
+    assert patient.get("/patient/").status_code == 200
+    assert patient_id in _cached_ids()
+
+    admin.post(f"/admin/user/delete/{patient_id}")
+    assert patient_id not in _cached_ids()
+    response = patient.get("/patient/")
+    assert response.status_code == 302 and "/login" in response.headers["Location"]
@@ -0,0 +1,55 @@
+# tests/test_medic_dashboard.py
+from app import create_app, crypto_utils
+from app.db import get_db, get_db_connection
+from app.routes import medic
+
+
+class CountingConnection:
+
+    def __init__(self, conn, executed):
+        self._conn = conn
+        self._executed = executed
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        execute = cursor.execute
+
+        def counted(*a, **kw):
+            self._executed.append(a[0])
+            return execute(*a, **kw)
+
+        cursor.execute = counted
+        return cursor
+
+
+def test_dashboard_loads_in_one_query(seed, monkeypatch):
+    ids = seed(patients=3, appointments=6)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # one appointment done, one with details that no longer decrypt, one of another medic's patients
+        cursor.execute("UPDATE appointments SET status = 'completed' WHERE id = 1")
+        cursor.execute("UPDATE appointments SET details = 'garbage' WHERE id = 2")
+        cursor.execute(
+            "INSERT INTO users (username, password, full_name, email, role) VALUES ('other', 'x', %s, %s, 'patient')",
+            (crypto_utils.encrypt_value("Other"), crypto_utils.encrypt_value("o@example.com")),
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+    executed = []
+    with create_app().app_context():
+        monkeypatch.setattr(medic, "get_db", lambda: CountingConnection(get_db(), executed))
+        patients, appointments = medic.fetch_dashboard_data(ids["medic"])
+
+    assert len(executed) == 1
+    assert [p["id"] for p in patients] == ids["patients"]
+    assert patients[0]["full_name"] == "User 1" and patients[0]["email"] == "user1@example.com"
+    assert sorted(a["id"] for a in appointments) == [2, 3, 4, 5, 6]
+    by_id = {a["id"]: a for a in appointments}
+    assert by_id[2]["details"] == "[Encrypted Content]"
+    assert by_id[3]["details"] == "visit 2" and by_id[3]["patient_name"] == "User 3"
+    dates = [str(a["date"]) for a in appointments]
+    assert dates == sorted(dates)
@@ -0,0 +1,12 @@
+# tests/test_migrate.py
+from app import migrate
+
+
+def test_hot_queries_use_indexes(db):
+    lines = []
+    assert migrate.check(progress=lines.append) == 0, "\n".join(lines)
+
+
+def test_migrate_is_idempotent(db):
+    migrate.migrate(progress=lambda message: None)
+    assert migrate.check(progress=lambda message: None) == 0
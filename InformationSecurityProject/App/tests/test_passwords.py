@@ -0,0 +1,68 @@
+# tests/test_passwords.py
+import time
+
+import pytest
+from werkzeug.security import check_password_hash
+
+from app.db import get_db_connection
+from app.passwords import PasswordVerifier, VerifierBusy, hash_password, needs_rehash, verify_and_rehash
+
+# ~0.5 s per check -- long enough to outlive verify_timeout below
+SLOW_METHOD = "pbkdf2:sha256:1000000"
+
+
+@pytest.fixture
+def verifier():
+    verifier = PasswordVerifier(workers=1, max_pending=1, admit_timeout=0.05, verify_timeout=0.05,
+                                start_method="fork")
+    yield verifier
+    verifier.shutdown()
+
+
+def test_timed_out_check_keeps_its_slot_until_it_ends(verifier):
+    slow = hash_password("secret", SLOW_METHOD)
+    with pytest.raises(VerifierBusy, match="timed out"):
+        verifier.verify(slow, "secret")
+
+    # the hash is still running in the worker, so the only slot is still taken
+    assert verifier.stats()["pending"] == 1
+    with pytest.raises(VerifierBusy, match="queue is full"):
+        verifier.verify(slow, "secret")
+    assert verifier.stats()["rejected_busy"] == 1
+
+    deadline = time.monotonic() + 10
+    while verifier.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert verifier.stats()["pending"] == 0
+    verifier.verify_timeout = 10
+    assert verifier.verify(hash_password("quick"), "quick") == (True, None)
+
+
+def test_verify_and_rehash_upgrades_outdated_hash():
+    old = hash_password("secret", "pbkdf2:sha256:500")
+    assert needs_rehash(old)
+
+    ok, new_hash = verify_and_rehash(old, "secret")
+    assert ok and new_hash and not needs_rehash(new_hash)
+    assert check_password_hash(new_hash, "secret")
+    assert verify_and_rehash(new_hash, "secret") == (True, None)
+    assert verify_and_rehash(old, "wrong") == (False, None)
+
+
+def test_login_stores_upgraded_hash(seed, login):
+    seed(patients=1, appointments=0)
+    client = login("patient1")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE users SET password = %s WHERE username = 'patient1'",
+                       (hash_password("Old_pw_2024", "pbkdf2:sha256:500"),))
+        conn.commit()
+        response = client.post("/login", data={"username": "patient1", "password": "Old_pw_2024"})
+        assert response.status_code == 302
+        cursor.execute("SELECT password FROM users WHERE username = 'patient1'")
+        stored = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+    assert not needs_rehash(stored) and check_password_hash(stored, "Old_pw_2024")
@@ -0,0 +1,64 @@
+# tests/test_rekey.py
+import pytest
+from cryptography.fernet import Fernet
+
+from app import crypto_utils, rekey
+from app.config import Config
+from app.db import get_db_connection
+
+
+def _stored_values(conn):
+    cursor = conn.cursor()
+    try:
+        values = []
+        for table, columns in rekey.TARGETS:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+            values += [v for row in cursor.fetchall() for v in row]
+        return values
+    finally:
+        cursor.close()
+
+
+def test_rekey_resumes_from_checkpoint(seed, key_ring, tmp_path):
+    Config.FIELD_CIPHER = "fernet"
+    seed(patients=5, appointments=6)
+    old = crypto_utils.key
+    new = Fernet.generate_key()
+    crypto_utils.set_keys([new, old])
+    Config.FIELD_CIPHER = "aead"
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    def interrupt(message):
+        # the first progress line comes right after the first batch was committed and checkpointed
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        rekey.rekey(batch=2, rows_per_second=0, checkpoint=checkpoint, progress=interrupt)
+    state = rekey.load_checkpoint(checkpoint)
+    assert (state["table_index"], state["last_id"], state["rewritten"]) == (0, 2, 4)
+    assert not state["finished"]
+
+    messages = []
+    state = rekey.rekey(batch=2, rows_per_second=0, checkpoint=checkpoint, progress=messages.append)
+    assert messages[0] == "Resuming users after id 2"
+    # 6 users x 2 columns + 6 appointments, each rewritten exactly once across both runs
+    assert state["finished"] and state["rewritten"] == 18
+    assert state["current"] == 0 and state["failed"] == 0
+
+    crypto_utils.set_keys([new])
+    conn = get_db_connection()
+    try:
+        values = _stored_values(conn)
+    finally:
+        conn.close()
+    assert all(crypto_utils.is_aead(v) for v in values)
+    assert crypto_utils.CRYPTO_FAILED not in crypto_utils.decrypt_many(values)
+
+
+def test_finished_checkpoint_is_not_rerun(seed, key_ring, tmp_path):
+    seed(patients=2, appointments=2)
+    checkpoint = str(tmp_path / "checkpoint.json")
+    rekey.rekey(batch=10, rows_per_second=0, checkpoint=checkpoint, progress=lambda message: None)
+    messages = []
+    rekey.rekey(batch=10, rows_per_second=0, checkpoint=checkpoint, progress=messages.append)
+    assert "already finished" in messages[0]
@@ -0,0 +1,52 @@
+# tests/test_session_store.py
+# the same contract for every backend; redis runs against fakeredis when it is installed
+import time
+
+import pytest
+
+from app.session_store import MemorySessionStore, RedisSessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path):
+    # returns a factory, so a test can open a second store on the same backing data (another worker)
+    if request.param == "memory":
+        store = MemorySessionStore(60)
+        return lambda: store
+    if request.param == "sqlite":
+        return lambda: SQLiteSessionStore(60, str(tmp_path / "sessions.sqlite3"))
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisSessionStore(60, client=fakeredis.FakeRedis(server=server, decode_responses=True))
+
+
+def test_create_and_get(make_store):
+    store = make_store()
+    token = store.create("alice", 1)
+    record = store.get(token)
+    assert record["username"] == "alice" and record["user_id"] == 1
+    assert store.get("not-a-token") is None
+
+
+def test_revoke(make_store):
+    store = make_store()
+    token = store.create("alice", 1)
+    assert store.revoke(token) == 1
+    assert store.get(token) is None
+
+
+def test_revoke_user_reaches_every_worker(make_store):
+    worker_a, worker_b = make_store(), make_store()
+    tokens = [worker_a.create("alice", 1), worker_b.create("alice", 1)]
+    other = worker_a.create("bob", 2)
+    assert worker_b.revoke_user("alice") == 2
+    assert all(worker_a.get(t) is None for t in tokens)
+    assert worker_a.get(other) is not None
+
+
+def test_expired_session_is_not_returned(make_store, monkeypatch):
+    store = make_store()
+    token = store.create("alice", 1)
+    later = time.time() + 61
+    monkeypatch.setattr("app.session_store.time.time", lambda: later)
+    assert store.get(token) is None
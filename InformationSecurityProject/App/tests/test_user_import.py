@@ -0,0 +1,46 @@
+# tests/test_user_import.py
+import io
+import json
+
+from werkzeug.security import check_password_hash
+
+from app import crypto_utils
+from app.blind_index import search_user_ids
+from app.db import get_db_connection
+from app.user_import import provision_users
+
+
+def test_provisioning_report_and_indexes(seed):
+    seed(patients=1, appointments=0)
+    records = [
+        {"username": "ada", "password": "Secret_2024", "full_name": "Ada Lovelace", "email": "ada@example.com",
+         "role": "medic"},
+        {"username": "ada", "password": "x", "full_name": "Ada Again", "email": "ada2@example.com",
+         "role": "patient"},
+        {"username": "patient1", "password": "x", "full_name": "Taken", "email": "t@example.com",
+         "role": "patient"},
+        {"username": "bob", "password": "x", "full_name": "Bob", "email": "not-an-email", "role": "patient"},
+        {"username": "eve", "password": "x", "full_name": "Eve", "email": "eve@example.com", "role": "root"},
+    ]
+    lines = io.StringIO("\n".join(json.dumps(r) for r in records) + "\n{broken\n")
+    result = provision_users(lines, fmt="jsonl", workers=1, chunk_rows=2)
+
+    assert (result.read, result.imported, result.failed) == (6, 1, 5)
+    messages = dict(result.errors)
+    assert sorted(messages) == [2, 3, 4, 5, 6]
+    assert "more than once" in messages[2] and "already exists" in messages[3]
+    assert "email" in messages[4] and "role 'root'" in messages[5] and "invalid JSON" in messages[6]
+    assert all("Secret_2024" not in m for m in messages.values())
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, password, full_name, role FROM users WHERE username = 'ada'")
+        user_id, password, full_name, role = cursor.fetchone()
+        assert check_password_hash(password, "Secret_2024") and role == "medic"
+        assert crypto_utils.decrypt_value(full_name) == "Ada Lovelace"
+        assert search_user_ids(cursor, "ada@example.com") == [user_id]
+        assert search_user_ids(cursor, "lovelace") == [user_id]
+    finally:
+        cursor.close()
+        conn.close()